@@ -1,14 +1,23 @@
 #!/usr/bin/env python
 import argparse
+import concurrent.futures
+import hashlib
+import json
 import os
 import pathlib
 import re
 import sys
+import urllib.parse
 from datetime import datetime
 
 import requests
 
 REPO_ROOT = pathlib.Path(__file__).resolve().parent.parent.parent.parent
+CACHE_DIR = pathlib.Path(
+    os.environ.get("GITHUB_API_CACHE_DIR")
+    or pathlib.Path.home() / ".cache" / "salt-bootstrap" / "github-api"
+)
+VERSION_RE = re.compile(r"^v?(?P<release>\d+(?:\.\d+)*)(?P<suffix>.*)$")
 
 
 class ClassPropertyDescriptor:
@@ -45,10 +54,12 @@ class Session:
 
     _instance = None
 
-    def __init__(self, endpoint=None):
+    def __init__(self, endpoint=None, cache_dir=CACHE_DIR, workers=8):
         if endpoint is None:
-            endpoint = "https://api.github.com"
-        self.endpoint = endpoint
+            endpoint = os.environ.get("GITHUB_API_URL") or "https://api.github.com"
+        self.endpoint = endpoint.rstrip("/")
+        self.cache_dir = cache_dir
+        self.workers = workers
         self.session = requests.Session()
         self.session.headers.update(
             {
@@ -63,8 +74,66 @@ class Session:
             cls._instance = cls()
         return cls._instance
 
-    def get(self, path, **kwargs):
-        return self.session.get(f"{self.endpoint}/{path.lstrip('/')}", **kwargs)
+    def _cache_path(self, url, params):
+        key = json.dumps([url, sorted((params or {}).items())])
+        return self.cache_dir / f"{hashlib.sha256(key.encode()).hexdigest()}.json"
+
+    def get(self, path, params=None, **kwargs):
+        """
+        GET from the API, revalidating responses seen before with their ETag.
+
+        GitHub answers an unchanged resource with a ``304``, which doesn't count against the
+        rate limit. The cached body is then returned as a ``200`` response.
+        """
+        url = f"{self.endpoint}/{path.lstrip('/')}"
+        cache_path = self._cache_path(url, params)
+        cached = None
+        if cache_path.exists():
+            cached = json.loads(cache_path.read_text())
+            headers = {"If-None-Match": cached["etag"], **kwargs.pop("headers", {})}
+            kwargs["headers"] = headers
+        response = self.session.get(url, params=params, **kwargs)
+        if response.status_code == 304 and cached is not None:
+            response.status_code = 200
+            response._content = cached["body"].encode()
+            response.headers["Link"] = cached["link"]
+        elif response.status_code == 200 and "ETag" in response.headers:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            cache_path.write_text(
+                json.dumps(
+                    {
+                        "etag": response.headers["ETag"],
+                        "link": response.headers.get("Link", ""),
+                        "body": response.text,
+                    }
+                )
+            )
+        return response
+
+    def get_paginated(self, path, params=None):
+        """
+        All the items of a paginated API listing, in order.
+
+        The first page tells, through its ``Link`` header, how many pages there are. The rest
+        of them are then fetched concurrently.
+        """
+        params = {"per_page": 100, **(params or {})}
+        response = self.get(path, params=params)
+        response.raise_for_status()
+        items = response.json()
+        last = response.links.get("last")
+        if last is None:
+            return items
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(last["url"]).query)
+        pages = range(2, int(query["page"][0]) + 1)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            responses = pool.map(
+                lambda page: self.get(path, params={**params, "page": page}), pages
+            )
+            for response in responses:
+                response.raise_for_status()
+                items.extend(response.json())
+        return items
 
     def post(self, path, **kwargs):
         return self.session.post(f"{self.endpoint}/{path.lstrip('/')}", **kwargs)
@@ -77,7 +146,24 @@ class Session:
         self.session.__exit__(*args)
 
 
+def version_key(tag):
+    """
+    Sort key for release tags, e.g. ``v2023.11.16``, in version order.
+
+    A pre-release, like ``v2023.11.16rc1``, sorts before its release.
+    """
+    match = VERSION_RE.match(tag)
+    release = tuple(int(part) for part in match.group("release").split("."))
+    suffix = match.group("suffix")
+    return release, not suffix, suffix
+
+
 def get_latest_release(options):
+    """
+    The tag of the latest release, or of the highest version tag when there is no release.
+
+    Returns ``None`` when no tag looks like a version.
+    """
     response = Session.instance.get(f"/repos/{options.repo}/releases/latest")
     if response.status_code != 404:
         return response.json()["tag_name"]
@@ -89,23 +175,14 @@ def get_latest_release(options):
     )
     print("Searching tags...", file=sys.stderr, flush=True)
 
-    tags = []
-    page = 0
-    while True:
-        page += 1
-        response = Session.instance.get(
-            f"/repos/{options.repo}/tags", data={"pre_page": 100, "page": page}
-        )
-        repo_tags = response.json()
-        added_tags = False
-        for tag in repo_tags:
-            if tag["name"] not in tags:
-                tags.append(tag["name"])
-                added_tags = True
-        if added_tags is False:
-            break
-
-    return list(sorted(tags))[-1]
+    tags = {
+        tag["name"]
+        for tag in Session.instance.get_paginated(f"/repos/{options.repo}/tags")
+        if VERSION_RE.match(tag["name"])
+    }
+    if not tags:
+        return None
+    return max(tags, key=version_key)
 
 
 def get_generated_changelog(options):
@@ -142,6 +219,14 @@ def main():
         options.release_tag = f"v{datetime.utcnow().strftime('%Y.%m.%d')}"
     if not options.previous_tag:
         options.previous_tag = get_latest_release(options)
+        if options.previous_tag is None:
+            parser.exit(
+                status=1,
+                message=(
+                    f"No release of {options.repo} and none of its tags looks like a "
+                    "version. Pass the previous release tag with --previous-tag.\n"
+                ),
+            )
 
     print(
         f"Creating changelog entries from {options.previous_tag} to {options.release_tag} ...",
@@ -1,10 +1,19 @@
 #!/usr/bin/env python
-import datetime
+"""
+Generate the test jobs of the CI workflow.
+
+Which ``<bootstrap type>-<salt version>`` instances are tested on each distribution is
+described by the exclusion ``RULES`` below, compiled into a compatibility bitmap by ``Matrix``.
+"""
+from __future__ import annotations
+
+import argparse
 import json
-import os
 import pathlib
+import re
+from dataclasses import dataclass
 
-os.chdir(os.path.abspath(os.path.dirname(__file__)))
+TEMPLATES_DIR = pathlib.Path(__file__).resolve().parent
 
 LINUX_DISTROS = [
     "almalinux-8",
@@ -430,308 +439,416 @@ TEMPLATE = """
     name: {display_name}{ifcheck}
     uses: {uses}
     needs:
+      - collect-changed-files
       - lint
       - generate-actions-workflow
     with:
       distro-slug: {distro}
       display-name: {display_name}
       timeout: {timeout_minutes}{runs_on}
-      instances: '{instances}'
+      instances: {instances}
 """
 
 
-def generate_test_jobs():
-    test_jobs = ""
-    needs = ["lint", "generate-actions-workflow"]
-
-    for distro in BSD:
-        test_jobs += "\n"
-        runs_on = "macos-12"
-        runs_on = f"\n      runs-on: {runs_on}"
-        ifcheck = "\n    if: github.event_name == 'push' || needs.collect-changed-files.outputs.run-tests == 'true'"
-        uses = "./.github/workflows/test-bsd.yml"
-        instances = []
-        timeout_minutes = (
-            TIMEOUT_OVERRIDES[distro]
-            if distro in TIMEOUT_OVERRIDES
-            else TIMEOUT_DEFAULT
-        )
-        for salt_version in SALT_VERSIONS:
-
-            if salt_version == "latest":
-                if distro in LATEST_PKG_BLACKLIST:
-                    continue
-
-                instances.append(salt_version)
-                continue
-
-            if distro == "openbsd-7":
-                # Only test latest on OpenBSD 6
-                continue
-
-            if salt_version != "master":
-                # Only test the master branch on BSD's
-                continue
-
-            # BSD's don't have a stable release, only use git
-            for bootstrap_type in ("git",):
-
-                BLACKLIST = {
-                    "3003": BLACKLIST_3003,
-                    "3004": BLACKLIST_3004,
-                }
-                if bootstrap_type == "git":
-                    BLACKLIST = {
-                        "3003": BLACKLIST_GIT_3003,
-                        "3004": BLACKLIST_GIT_3004,
-                        "master": BLACKLIST_GIT_MASTER,
-                    }
-
-                    # .0 versions are a virtual version for pinning to the first
-                    # point release of a major release, such as 3003,
-                    # there is no git version.
-                    if salt_version.endswith("-0"):
-                        continue
-
-                if (
-                    salt_version in ("3003", "3004", "master")
-                    and distro in BLACKLIST[salt_version]
-                ):
-                    continue
+ALL_DISTROS = frozenset(LINUX_DISTROS + WINDOWS + OSX + BSD)
+ALL_SALT_VERSIONS = frozenset(SALT_VERSIONS)
 
-                kitchen_target = f"{bootstrap_type}-{salt_version}"
-                instances.append(kitchen_target)
+RUNS_ON_OVERRIDES = {
+    "macos-1015": "macos-10.15",
+}
 
-        if instances:
-            needs.append(distro)
-            test_jobs += TEMPLATE.format(
-                distro=distro,
-                runs_on=runs_on,
-                uses=uses,
-                ifcheck=ifcheck,
-                instances=json.dumps(instances),
-                display_name=DISTRO_DISPLAY_NAMES[distro],
-                timeout_minutes=timeout_minutes,
-            )
 
-    test_jobs += "\n"
-    for distro in OSX:
-        test_jobs += "\n"
-        if distro == "macos-1015":
-            runs_on = "macos-10.15"
-        else:
-            runs_on = distro
-        runs_on = f"\n      runs-on: {runs_on}"
-        ifcheck = "\n    if: github.event_name == 'push' || needs.collect-changed-files.outputs.run-tests == 'true'"
-        uses = "./.github/workflows/test-macos.yml"
-        instances = []
-        timeout_minutes = (
-            TIMEOUT_OVERRIDES[distro]
-            if distro in TIMEOUT_OVERRIDES
-            else TIMEOUT_DEFAULT
+@dataclass(frozen=True)
+class Platform:
+    """
+    A family of distributions sharing a test workflow and the bootstrap types tried on them.
+    """
+
+    distros: list[str]
+    uses: str
+    bootstrap_types: tuple[str, ...]
+    # None when the workflow picks its own runner, '{distro}' for a runner named after the distro
+    runs_on: str | None = None
+
+
+PLATFORMS = (
+    Platform(
+        distros=BSD,
+        uses="./.github/workflows/test-bsd.yml",
+        # BSD's don't have a stable release, only use git
+        bootstrap_types=("git",),
+        runs_on="macos-12",
+    ),
+    Platform(
+        distros=OSX,
+        uses="./.github/workflows/test-macos.yml",
+        bootstrap_types=("stable", "old-stable"),
+        runs_on="{distro}",
+    ),
+    Platform(
+        distros=WINDOWS,
+        uses="./.github/workflows/test-windows.yml",
+        bootstrap_types=("stable",),
+        runs_on="{distro}",
+    ),
+    Platform(
+        distros=LINUX_DISTROS,
+        uses="./.github/workflows/test-linux.yml",
+        bootstrap_types=("old-stable", "stable", "git", "onedir", "onedir-rc"),
+    ),
+)
+BOOTSTRAP_TYPES = ("old-stable", "stable", "git", "onedir", "onedir-rc")
+PACKAGE_BOOTSTRAP_TYPES = frozenset(BOOTSTRAP_TYPES) - {"git"}
+
+
+@dataclass(frozen=True)
+class Rule:
+    """
+    Exclude the ``<bootstrap type>-<salt version>`` instances of the matching distributions.
+
+    A rule matches when the instance is in all of its sets, ``None`` matches everything.
+    """
+
+    bootstrap_types: frozenset[str] | None = None
+    versions: frozenset[str] | None = None
+    distros: frozenset[str] | None = None
+    reason: str = ""
+
+    def matches(self, distro: str, salt_version: str, bootstrap_type: str) -> bool:
+        return (
+            (self.bootstrap_types is None or bootstrap_type in self.bootstrap_types)
+            and (self.versions is None or salt_version in self.versions)
+            and (self.distros is None or distro in self.distros)
         )
 
-        for salt_version in SALT_VERSIONS:
-
-            if salt_version == "latest":
-
-                instances.append(salt_version)
-                continue
-
-            for bootstrap_type in ("stable", "old-stable"):
-                if bootstrap_type == "stable":
-                    if salt_version in MAC_STABLE_VERSION_BLACKLIST:
-                        continue
-
-                if bootstrap_type == "old-stable":
-                    if salt_version in MAC_OLD_STABLE_VERSION_BLACKLIST:
-                        continue
 
-                kitchen_target = f"{bootstrap_type}-{salt_version}"
-                instances.append(kitchen_target)
-
-        for bootstrap_type in ("default",):
-            if distro not in STABLE_DISTROS:
-                continue
-            instances.append(bootstrap_type)
-
-        if instances:
-            needs.append(distro)
-            test_jobs += TEMPLATE.format(
-                distro=distro,
-                runs_on=runs_on,
-                uses=uses,
-                ifcheck=ifcheck,
-                instances=json.dumps(instances),
-                display_name=DISTRO_DISPLAY_NAMES[distro],
-                timeout_minutes=timeout_minutes,
+def only(allowed, universe) -> frozenset[str]:
+    """
+    The complement of ``allowed``, to exclude everything else.
+    """
+    return frozenset(universe) - frozenset(allowed)
+
+
+RULES = (
+    Rule(
+        frozenset({"onedir"}),
+        versions=only(ONEDIR_SALT_VERSIONS, SALT_VERSIONS),
+        reason="Not a onedir release",
+    ),
+    Rule(
+        frozenset({"onedir"}),
+        distros=only(ONEDIR_DISTROS, LINUX_DISTROS),
+        reason="No onedir packages",
+    ),
+    Rule(
+        frozenset({"onedir-rc"}),
+        versions=only(ONEDIR_RC_SALT_VERSIONS, SALT_VERSIONS),
+        reason="Not a onedir release candidate",
+    ),
+    Rule(
+        frozenset({"onedir-rc"}),
+        distros=only(ONEDIR_RC_DISTROS, LINUX_DISTROS),
+        reason="No onedir release candidate packages",
+    ),
+    Rule(
+        frozenset({"old-stable"}),
+        versions=frozenset(OLD_STABLE_VERSION_BLACKLIST),
+        distros=frozenset(LINUX_DISTROS),
+        reason="Not an old-stable release",
+    ),
+    Rule(
+        frozenset({"old-stable"}),
+        distros=only(OLD_STABLE_DISTROS, LINUX_DISTROS),
+        reason="No old-stable packages",
+    ),
+    Rule(
+        frozenset({"old-stable"}),
+        versions=frozenset(MAC_OLD_STABLE_VERSION_BLACKLIST),
+        distros=frozenset(OSX),
+        reason="Not an old-stable macOS release",
+    ),
+    Rule(
+        frozenset({"stable"}),
+        versions=frozenset(STABLE_VERSION_BLACKLIST),
+        distros=frozenset(LINUX_DISTROS + WINDOWS),
+        reason="Not a stable release",
+    ),
+    Rule(
+        frozenset({"stable"}),
+        distros=only(STABLE_DISTROS, LINUX_DISTROS),
+        reason="No stable packages",
+    ),
+    Rule(
+        frozenset({"stable"}),
+        versions=frozenset(MAC_STABLE_VERSION_BLACKLIST),
+        distros=frozenset(OSX),
+        reason="Not a stable macOS release",
+    ),
+    Rule(
+        frozenset({"git"}),
+        versions=frozenset(GIT_VERSION_BLACKLIST),
+        distros=frozenset(LINUX_DISTROS),
+        reason="No git tag",
+    ),
+    Rule(
+        frozenset({"git"}),
+        distros=frozenset(GIT_DISTRO_BLACKLIST),
+        reason="Git builds broken",
+    ),
+    # .0 versions are a virtual version for pinning to the first
+    # point release of a major release, such as 3003,
+    # there is no git version.
+    Rule(
+        frozenset({"git"}),
+        versions=frozenset(
+            version for version in SALT_VERSIONS if version.endswith("-0")
+        ),
+        reason="Virtual point release",
+    ),
+    # The BSD's only test the master branch, and OpenBSD only the latest package
+    Rule(
+        versions=only(("master",), SALT_VERSIONS),
+        distros=frozenset(BSD),
+        reason="Only master on BSD",
+    ),
+    Rule(
+        distros=frozenset({"openbsd-7"}),
+        reason="Only latest on OpenBSD",
+    ),
+    *(
+        Rule(
+            frozenset(PACKAGE_BOOTSTRAP_TYPES),
+            versions=frozenset({version}),
+            distros=frozenset(blacklist),
+            reason=f"No {version} packages",
+        )
+        for version, blacklist in (
+            ("3003", BLACKLIST_3003),
+            ("3004", BLACKLIST_3004),
+            ("3005", BLACKLIST_3005),
+            ("3005-1", BLACKLIST_3005),
+            ("3006", BLACKLIST_3006),
+            ("3006-1", BLACKLIST_3006),
+        )
+    ),
+    *(
+        Rule(
+            frozenset({"git"}),
+            versions=frozenset({version}),
+            distros=frozenset(blacklist),
+            reason=f"Git {version} broken",
+        )
+        for version, blacklist in (
+            ("3003", BLACKLIST_GIT_3003),
+            ("3004", BLACKLIST_GIT_3004),
+            ("3005", BLACKLIST_GIT_3005),
+            ("3006", BLACKLIST_GIT_3006),
+            ("master", BLACKLIST_GIT_MASTER),
+        )
+    ),
+)
+
+
+class Matrix:
+    """
+    The rules compiled into a distro x salt version x bootstrap type compatibility bitmap.
+
+    Each distro maps to an integer where bit ``version_index * len(BOOTSTRAP_TYPES) + type_index``
+    is set when that instance is tested.
+    """
+
+    def __init__(self, rules=RULES):
+        self.version_index = {version: idx for idx, version in enumerate(SALT_VERSIONS)}
+        self.type_index = {btype: idx for idx, btype in enumerate(BOOTSTRAP_TYPES)}
+        # The distros each (bootstrap type, salt version) pair excludes
+        excluded: dict[tuple[str, str], set[str]] = {}
+        for rule in rules:
+            btypes = (
+                BOOTSTRAP_TYPES
+                if rule.bootstrap_types is None
+                else rule.bootstrap_types
             )
-
-    test_jobs += "\n"
-    for distro in WINDOWS:
-        test_jobs += "\n"
-        runs_on = f"\n      runs-on: {distro}"
-        ifcheck = "\n    if: github.event_name == 'push' || needs.collect-changed-files.outputs.run-tests == 'true'"
-        uses = "./.github/workflows/test-windows.yml"
-        instances = []
-        timeout_minutes = (
-            TIMEOUT_OVERRIDES[distro]
-            if distro in TIMEOUT_OVERRIDES
-            else TIMEOUT_DEFAULT
+            versions = SALT_VERSIONS if rule.versions is None else rule.versions
+            distros = ALL_DISTROS if rule.distros is None else rule.distros
+            for btype in btypes:
+                for version in versions:
+                    excluded.setdefault((btype, version), set()).update(distros)
+        self.excluded = {key: frozenset(distros) for key, distros in excluded.items()}
+
+        self.bitmap: dict[str, int] = {}
+        for distro in sorted(ALL_DISTROS):
+            bits = 0
+            for version, vidx in self.version_index.items():
+                for btype, tidx in self.type_index.items():
+                    if distro not in self.excluded.get((btype, version), ()):
+                        bits |= 1 << (vidx * len(BOOTSTRAP_TYPES) + tidx)
+            self.bitmap[distro] = bits
+
+    def compatible(self, distro: str, salt_version: str, bootstrap_type: str) -> bool:
+        bit = (
+            self.version_index[salt_version] * len(BOOTSTRAP_TYPES)
+            + self.type_index[bootstrap_type]
         )
+        return bool(self.bitmap[distro] >> bit & 1)
 
+    def instances(self, platform: Platform, distro: str) -> list[str]:
+        instances = []
         for salt_version in SALT_VERSIONS:
-
             if salt_version == "latest":
-
-                instances.append(salt_version)
+                if distro not in LATEST_PKG_BLACKLIST:
+                    instances.append(salt_version)
                 continue
 
-            for bootstrap_type in ("stable",):
-                if bootstrap_type == "stable":
-                    if salt_version in STABLE_VERSION_BLACKLIST:
-                        continue
+            for bootstrap_type in platform.bootstrap_types:
+                if self.compatible(distro, salt_version, bootstrap_type):
+                    instances.append(f"{bootstrap_type}-{salt_version}")
+
+        if distro in STABLE_DISTROS:
+            instances.append("default")
+        return instances
+
+    def jobs(self) -> list[dict]:
+        """
+        The test jobs, one per distribution with instances to test, in workflow order.
+        """
+        jobs = []
+        for platform in PLATFORMS:
+            for distro in platform.distros:
+                instances = self.instances(platform, distro)
+                if not instances:
+                    continue
+                runs_on = None
+                if platform.runs_on is not None:
+                    runs_on = RUNS_ON_OVERRIDES.get(
+                        distro, platform.runs_on.format(distro=distro)
+                    )
+                jobs.append(
+                    {
+                        "distro": distro,
+                        "display_name": DISTRO_DISPLAY_NAMES[distro],
+                        "uses": platform.uses,
+                        "runs_on": runs_on,
+                        "push_only": distro in VERSION_ONLY_OVERRIDES,
+                        "timeout": TIMEOUT_OVERRIDES.get(distro, TIMEOUT_DEFAULT),
+                        "instances": instances,
+                    }
+                )
+        return jobs
 
-                kitchen_target = f"{bootstrap_type}-{salt_version}"
-                instances.append(kitchen_target)
 
-        for bootstrap_type in ("default",):
-            if distro not in STABLE_DISTROS:
+def render_ci_workflow(jobs: list[dict]) -> str:
+    test_jobs = ""
+    needs = ["lint", "generate-actions-workflow"]
+    by_distro = {job["distro"]: job for job in jobs}
+    for idx, platform in enumerate(PLATFORMS):
+        if idx:
+            test_jobs += "\n"
+        for distro in platform.distros:
+            test_jobs += "\n"
+            job = by_distro.get(distro)
+            if job is None:
                 continue
-            instances.append(bootstrap_type)
-
-        if instances:
             needs.append(distro)
+            ifcheck = "\n    if: github.event_name == 'push'"
+            instances = f"'{json.dumps(job['instances'])}'"
+            if not job["push_only"]:
+                # Pull requests only test the instances 'tools analyze impact' selected, if it ran
+                selected = "needs.collect-changed-files.outputs.test-instances"
+                ifcheck += (
+                    " || (needs.collect-changed-files.outputs.run-tests == 'true'"
+                    f" && ({selected} == '' || fromJSON({selected})['{distro}'] != null))"
+                )
+                instances = (
+                    f"${{{{ {selected} != ''"
+                    f" && toJSON(fromJSON({selected})['{distro}']) || {instances} }}}}"
+                )
+            runs_on = ""
+            if job["runs_on"] is not None:
+                runs_on = f"\n      runs-on: {job['runs_on']}"
             test_jobs += TEMPLATE.format(
                 distro=distro,
                 runs_on=runs_on,
-                uses=uses,
+                uses=job["uses"],
                 ifcheck=ifcheck,
-                instances=json.dumps(instances),
-                display_name=DISTRO_DISPLAY_NAMES[distro],
-                timeout_minutes=timeout_minutes,
+                instances=instances,
+                display_name=job["display_name"],
+                timeout_minutes=job["timeout"],
             )
 
-    test_jobs += "\n"
-    for distro in LINUX_DISTROS:
-        test_jobs += "\n"
-        runs_on = ""
-        ifcheck = "\n    if: github.event_name == 'push' || needs.collect-changed-files.outputs.run-tests == 'true'"
-        uses = "./.github/workflows/test-linux.yml"
-        instances = []
-        timeout_minutes = (
-            TIMEOUT_OVERRIDES[distro]
-            if distro in TIMEOUT_OVERRIDES
-            else TIMEOUT_DEFAULT
+    ci_workflow_contents = (TEMPLATES_DIR / "ci.yml").read_text() + test_jobs + "\n"
+    ci_workflow_contents += (
+        (TEMPLATES_DIR / "ci-tail.yml")
+        .read_text()
+        .format(needs="\n".join([f"      - {need}" for need in needs]).lstrip())
+    )
+    return ci_workflow_contents
+
+
+def parse_instances(ci_workflow_contents: str) -> dict[str, list[str]]:
+    """
+    The instances tested per distribution in a rendered ``ci.yml``.
+    """
+    matrix = {}
+    distro = None
+    for line in ci_workflow_contents.splitlines():
+        line = line.strip()
+        if line.startswith("distro-slug:"):
+            distro = line.split(":", 1)[1].strip()
+        elif line.startswith("instances:") and distro is not None:
+            # The full list is the quoted fallback of the pull request selection
+            matrix[distro] = json.loads(re.search(r"'(\[.*?\])'", line).group(1))
+            distro = None
+    return matrix
+
+
+def diff_matrix(
+    previous: dict[str, list[str]], current: dict[str, list[str]]
+) -> list[str]:
+    lines = []
+    for distro in sorted(set(previous) | set(current)):
+        before = set(previous.get(distro, ()))
+        after = set(current.get(distro, ()))
+        for instance in sorted(after - before):
+            lines.append(f"+ {distro}: {instance}")
+        for instance in sorted(before - after):
+            lines.append(f"- {distro}: {instance}")
+    return lines
+
+
+def generate_test_jobs(json_path=None, diff=False):
+    jobs = Matrix().jobs()
+    ci_workflow_contents = render_ci_workflow(jobs)
+
+    ci_dst_workflow = TEMPLATES_DIR.parent / "ci.yml"
+    if diff:
+        previous = ""
+        if ci_dst_workflow.exists():
+            previous = ci_dst_workflow.read_text()
+        changes = diff_matrix(
+            parse_instances(previous), {job["distro"]: job["instances"] for job in jobs}
         )
-        if distro in VERSION_ONLY_OVERRIDES:
-            ifcheck = "\n    if: github.event_name == 'push'"
+        print("\n".join(changes) if changes else "The test matrix is unchanged")
 
-        for salt_version in SALT_VERSIONS:
-
-            if salt_version == "latest":
-                if distro in LATEST_PKG_BLACKLIST:
-                    continue
-
-                instances.append(salt_version)
-                continue
-
-            for bootstrap_type in (
-                "old-stable",
-                "stable",
-                "git",
-                "onedir",
-                "onedir-rc",
-            ):
-                if bootstrap_type == "onedir":
-                    if salt_version not in ONEDIR_SALT_VERSIONS:
-                        continue
-                    if distro not in ONEDIR_DISTROS:
-                        continue
-
-                if bootstrap_type == "onedir-rc":
-                    if salt_version not in ONEDIR_RC_SALT_VERSIONS:
-                        continue
-                    if distro not in ONEDIR_RC_DISTROS:
-                        continue
-
-                if bootstrap_type == "old-stable":
-                    if salt_version in OLD_STABLE_VERSION_BLACKLIST:
-                        continue
-                    if distro not in OLD_STABLE_DISTROS:
-                        continue
-
-                if bootstrap_type == "stable":
-                    if salt_version in STABLE_VERSION_BLACKLIST:
-                        continue
-                    if distro not in STABLE_DISTROS:
-                        continue
-
-                if bootstrap_type == "git":
-                    if salt_version in GIT_VERSION_BLACKLIST:
-                        continue
-                    if distro in GIT_DISTRO_BLACKLIST:
-                        continue
-
-                BLACKLIST = {
-                    "3003": BLACKLIST_3003,
-                    "3004": BLACKLIST_3004,
-                    "3005": BLACKLIST_3005,
-                    "3005-1": BLACKLIST_3005,
-                    "3006": BLACKLIST_3006,
-                    "3006-1": BLACKLIST_3006,
-                }
-                if bootstrap_type == "git":
-                    BLACKLIST = {
-                        "3003": BLACKLIST_GIT_3003,
-                        "3004": BLACKLIST_GIT_3004,
-                        "3005": BLACKLIST_GIT_3005,
-                        "3006": BLACKLIST_GIT_3006,
-                        "master": BLACKLIST_GIT_MASTER,
-                    }
-
-                    # .0 versions are a virtual version for pinning to the first
-                    # point release of a major release, such as 3003,
-                    # there is no git version.
-                    if salt_version.endswith("-0"):
-                        continue
-
-                if (
-                    salt_version
-                    in ("3003", "3004", "3005", "3005-1", "3006", "3006-1", "master")
-                    and distro in BLACKLIST[salt_version]
-                ):
-                    continue
-
-                kitchen_target = f"{bootstrap_type}-{salt_version}"
-                instances.append(kitchen_target)
-
-        for bootstrap_type in ("default",):
-            if distro not in STABLE_DISTROS:
-                continue
-            instances.append(bootstrap_type)
+    ci_dst_workflow.write_text(ci_workflow_contents)
+    if json_path is not None:
+        pathlib.Path(json_path).write_text(json.dumps(jobs, indent=2) + "\n")
 
-        if instances:
-            needs.append(distro)
-            test_jobs += TEMPLATE.format(
-                distro=distro,
-                runs_on=runs_on,
-                uses=uses,
-                ifcheck=ifcheck,
-                instances=json.dumps(instances),
-                display_name=DISTRO_DISPLAY_NAMES[distro],
-                timeout_minutes=timeout_minutes,
-            )
 
-    ci_src_workflow = pathlib.Path("ci.yml").resolve()
-    ci_tail_src_workflow = pathlib.Path("ci-tail.yml").resolve()
-    ci_dst_workflow = pathlib.Path("../ci.yml").resolve()
-    ci_workflow_contents = ci_src_workflow.read_text() + test_jobs + "\n"
-    ci_workflow_contents += ci_tail_src_workflow.read_text().format(
-        needs="\n".join([f"      - {need}" for need in needs]).lstrip()
+def main():
+    parser = argparse.ArgumentParser(description="Generate the CI workflow test matrix")
+    parser.add_argument(
+        "--json",
+        metavar="PATH",
+        help="Also write the test matrix, one entry per job, to this JSON file",
     )
-    ci_dst_workflow.write_text(ci_workflow_contents)
+    parser.add_argument(
+        "--diff",
+        action="store_true",
+        help="Print the instances added to and removed from the current ci.yml",
+    )
+    args = parser.parse_args()
+    generate_test_jobs(json_path=args.json, diff=args.diff)
 
 
 if __name__ == "__main__":
-    generate_test_jobs()
+    main()
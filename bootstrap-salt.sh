@@ -45,6 +45,47 @@ __ScriptArgs="$*"
 #   * BS_GENTOO_USE_BINHOST:    If 1 add `--getbinpkg` to gentoo's emerge
 #   * BS_SALT_MASTER_ADDRESS:   The IP or DNS name of the salt-master the minion should connect to
 #   * BS_SALT_GIT_CHECKOUT_DIR: The directory where to clone Salt on git installations
+#   * BS_GIT_REFERENCE_DIR:     A local clone of Salt whose objects are borrowed, with `git clone --reference`,
+#                               when cloning Salt on git installations
+#   * BS_GIT_MIRROR_DIR:        A bare mirror of the Salt repository, created on the first git installation and
+#                               incrementally refreshed on the following ones, used as the clone reference
+#   * BS_GIT_PARTIAL_CLONE:     If 1, clone Salt without blobs (`--filter=blob:none`), which are then fetched on
+#                               checkout. Requires git 2.19 or newer.
+#   * BS_PIP_WHEELHOUSE:        A directory or URL of pre-built wheels which pip installs from before building any,
+#                               see `tools wheelhouse build`. Applies to -P, -a, virtualenv and git installations.
+#   * BS_PIP_NO_INDEX:          If 1, pip only installs from BS_PIP_WHEELHOUSE and never reaches the package index.
+#   * BS_PIP_CACHE_DIR:         A persistent pip cache directory, reused by later bootstraps on the same host
+#   * BS_CACHE_DIR:             If set, downloaded files are cached in this directory, keyed by URL and verified
+#                               by their SHA256 sum, and reused by later bootstraps on the same host.
+#                               The distribution detection is cached there too, and reused as long as the
+#                               release files in /etc are unchanged.
+#                               On git installations, the Salt wheels built for a commit are cached there as well.
+#   * BS_CACHE_TTL:             Minutes a cached download is reused before it's fetched again. Default 1440.
+#   * BS_CACHE_MAX_SIZE:        Maximum size of the download cache in MiB. Default 1024.
+#   * BS_PKG_BATCH:             If 1, the packages a package based install needs, dependencies, extra packages and
+#                               Salt packages, are collected and installed in a single package manager transaction
+#                               per repository setup step, instead of one transaction per install call.
+#   * BS_PKG_DRY_RUN:           If 1, print the collected package transactions instead of running them and stop
+#                               after the install step. Implies BS_PKG_BATCH. Repositories are still configured.
+#   * BS_PREFETCH:              If 1, the repository GPG keys and repository files are downloaded in background jobs
+#                               as soon as their URLs are known, overlapping with the packages being installed.
+#   * BS_PKG_LOCK_TIMEOUT:      Seconds to wait for another apt, dpkg, yum, dnf, rpm or zypper process to release
+#                               the package manager lock, like unattended upgrades at boot. Default 900.
+#   * BS_DAEMONS_READY_TIMEOUT: Seconds to wait for the started Salt daemons to be up and running. Default 60.
+#   * BS_REPORT_FILE:           If set, a JSON report of the run is written to this file when the script exits.
+#                               It holds the detected distribution, the chosen functions, how long each phase
+#                               took, the package manager lock retries and the bytes downloaded.
+#   * BS_FETCH_RETRIES:         Times a failed download is retried, resuming what was already downloaded, after
+#                               an exponentially growing, jittered, delay. Downloads the server refused with an
+#                               HTTP client error, like 404, are not retried. Default 3.
+#   * BS_FETCH_CONNECT_TIMEOUT: Seconds a download has to connect to the server. Default 30.
+#   * BS_FETCH_STALL_TIMEOUT:   Seconds a download can go without receiving any data before it's aborted, and
+#                               retried. Default 60.
+#   * BS_MIRROR_PROBE_PATH:     The path fetched from each -R mirror to rank them, when more than one is given.
+#                               Default salt/py3/onedir/repo.json.
+#   * BS_MIRROR_PROBE_TIMEOUT:  Seconds a -R mirror has to answer the probe before it's ranked last. Default 5.
+#   * BS_PROFILE_TRACE:         If set, and the script is run with bash, every command it runs is traced to this
+#                               file, with a timestamp and the calling function. See `tools analyze profile`.
 #======================================================================================================================
 
 
@@ -52,6 +93,18 @@ __ScriptArgs="$*"
 BS_TRUE=1
 BS_FALSE=0
 
+# Trace every command, as early as possible. Only bash knows the calling function and
+# has sub-second timestamps, so the trace is left out under any other shell.
+_PROFILE_TRACE=${BS_PROFILE_TRACE:-null}
+if [ "$_PROFILE_TRACE" != "null" ] && [ -n "${BASH_VERSION:-}" ]; then
+    exec 9>"$_PROFILE_TRACE"
+    # shellcheck disable=SC2034
+    BASH_XTRACEFD=9
+    # shellcheck disable=SC2016
+    PS4='+|${EPOCHREALTIME:-$SECONDS}|${FUNCNAME[0]:-main}|${LINENO}| '
+    set -x
+fi
+
 # Default sleep time used when waiting for daemons to start, restart and checking for these running
 __DEFAULT_SLEEP=3
 
@@ -226,12 +279,14 @@ _SALTSTACK_REPO_URL="https://github.com/saltstack/salt.git"
 _SALT_REPO_URL=${_SALTSTACK_REPO_URL}
 _TEMP_KEYS_DIR="null"
 _SLEEP="${__DEFAULT_SLEEP}"
+_SLEEP_PASSED=$BS_FALSE
 _INSTALL_MASTER=$BS_FALSE
 _INSTALL_SYNDIC=$BS_FALSE
 _INSTALL_MINION=$BS_TRUE
 _INSTALL_CLOUD=$BS_FALSE
 _VIRTUALENV_DIR=${BS_VIRTUALENV_DIR:-"null"}
 _START_DAEMONS=$BS_TRUE
+_BOOTSTRAP_MODE="full"
 _DISABLE_SALT_CHECKS=$BS_FALSE
 _ECHO_DEBUG=${BS_ECHO_DEBUG:-$BS_FALSE}
 _CONFIG_ONLY=$BS_FALSE
@@ -258,6 +313,47 @@ _LIBCLOUD_MIN_VERSION="0.14.0"
 _EXTRA_PACKAGES=""
 _HTTP_PROXY=""
 _SALT_GIT_CHECKOUT_DIR=${BS_SALT_GIT_CHECKOUT_DIR:-/tmp/git/salt}
+_GIT_REFERENCE_DIR=${BS_GIT_REFERENCE_DIR:-null}
+_GIT_MIRROR_DIR=${BS_GIT_MIRROR_DIR:-null}
+_GIT_PARTIAL_CLONE=${BS_GIT_PARTIAL_CLONE:-$BS_FALSE}
+_PIP_WHEELHOUSE=${BS_PIP_WHEELHOUSE:-null}
+_PIP_NO_INDEX=${BS_PIP_NO_INDEX:-$BS_FALSE}
+_PIP_CACHE_DIR=${BS_PIP_CACHE_DIR:-null}
+_CACHE_DIR=${BS_CACHE_DIR:-null}
+_CACHE_TTL=${BS_CACHE_TTL:-1440}
+_CACHE_MAX_SIZE=${BS_CACHE_MAX_SIZE:-1024}
+_FETCH_RETRIES=${BS_FETCH_RETRIES:-3}
+_FETCH_CONNECT_TIMEOUT=${BS_FETCH_CONNECT_TIMEOUT:-30}
+_FETCH_STALL_TIMEOUT=${BS_FETCH_STALL_TIMEOUT:-60}
+_FETCH_HTTP_STATUS=""
+_DETECTION_CACHED=$BS_FALSE
+_PKG_BATCH=${BS_PKG_BATCH:-$BS_FALSE}
+_PKG_DRY_RUN=${BS_PKG_DRY_RUN:-$BS_FALSE}
+_PKG_PLAN=""
+_PKG_PLAN_FUNC=""
+_PKG_PLAN_ACTIVE=$BS_FALSE
+_PKG_PLAN_FLUSHING=$BS_FALSE
+_PREFETCH=${BS_PREFETCH:-$BS_FALSE}
+_PREFETCH_DIR="null"
+_PREFETCH_JOBS=""
+_PREFETCH_COUNT=0
+_OFFLINE_BUNDLE="null"
+_OFFLINE_BUNDLE_DIR="null"
+_OFFLINE_BUNDLE_TMPDIR="null"
+_OFFLINE_BUNDLE_FORMAT="null"
+_OFFLINE_BUNDLE_DISTRO_DEPS_FUNC="null"
+_MACOS_REPO_JSON="null"
+_DAEMONS_READY_TIMEOUT=${BS_DAEMONS_READY_TIMEOUT:-60}
+_PKG_LOCK_TIMEOUT=${BS_PKG_LOCK_TIMEOUT:-900}
+_REPORT_FILE=${BS_REPORT_FILE:-null}
+_REPORT_PHASES=""
+_REPORT_LOCK_RETRIES=0
+_REPORT_LOCK_WAIT=0
+_REPORT_DOWNLOADS=0
+_REPORT_DOWNLOADED_BYTES=0
+_REPORT_CACHE_HITS=0
+_REPORT_DOWNLOAD_RETRIES=0
+_TIMED_DEPTH=0
 _NO_DEPS=$BS_FALSE
 _FORCE_SHALLOW_CLONE=$BS_FALSE
 _DISABLE_SSL=$BS_FALSE
@@ -267,6 +363,10 @@ _CUSTOM_MASTER_CONFIG="null"
 _CUSTOM_MINION_CONFIG="null"
 _QUIET_GIT_INSTALLATION=$BS_FALSE
 _REPO_URL="repo.saltproject.io"
+_REPO_MIRRORS=""
+_REPO_MIRRORS_SELECTED=$BS_FALSE
+_MIRROR_PROBE_PATH=${BS_MIRROR_PROBE_PATH:-salt/py3/onedir/repo.json}
+_MIRROR_PROBE_TIMEOUT=${BS_MIRROR_PROBE_TIMEOUT:-5}
 _ONEDIR_DIR="salt"
 _ONEDIR_NIGHTLY_DIR="salt-dev/${_ONEDIR_DIR}"
 _PY_EXE="python3"
@@ -347,6 +447,12 @@ __usage() {
     -b  Assume that dependencies are already installed and software sources are
         set up. If git is selected, git tree is still checked out as dependency
         step.
+    -B  Install Salt from an offline bundle, either the tarball or its extracted
+        directory, built with 'tools bundle build'. No Salt repository is set
+        up and nothing is downloaded from it, the distribution dependencies are
+        still installed from the repositories configured on the host unless -b
+        is passed. Only works with the onedir install type, which stable and -Q
+        also use, on Debian, Ubuntu and RPM based distributions.
     -c  Temporary configuration directory
     -C  Only run the configuration function. Implies -F (forced overwrite).
         To overwrite Master or Syndic configs, -M or -S, respectively, must
@@ -386,6 +492,12 @@ __usage() {
     -l  Disable ssl checks. When passed, switches "https" calls to "http" where
         possible.
     -L  Also install salt-cloud and required python-libcloud package
+    -m  Bootstrap in two steps, for golden images. 'prepare' installs Salt and
+        leaves its daemons stopped, not started on boot and without any
+        identity: the image can be taken afterwards. 'personalize', run at
+        boot, only writes the -A, -i, -k, -c, -j and -J identity and
+        configuration, then starts the daemons. Pass both the same install
+        type and -M, -N and -S options. Default: full, both in one run.
     -M  Also install salt-master
     -n  No colours
     -N  Do not install salt-minion
@@ -404,8 +516,14 @@ __usage() {
         repo.saltproject.io. The option passed with -R replaces the
         "repo.saltproject.io". If -R is passed, -r is also set. Currently only
         works on CentOS/RHEL and Debian based distributions and macOS.
+        A comma separated list of mirrors can be passed. They are probed
+        concurrently before the repository is configured, the fastest one is
+        used, and downloads failing on it are retried on the next ones.
     -s  Sleep time used when waiting for daemons to start, restart and when
         checking for the services running. Default: ${__DEFAULT_SLEEP}
+        Without it, the script polls the daemons until they are running, and
+        still are a second later, for up to \${BS_DAEMONS_READY_TIMEOUT}
+        seconds, instead of sleeping.
     -S  Also install salt-syndic
     -r  Disable all repository configuration performed by this script. This
         option assumes all necessary repository configuration is already present
@@ -430,7 +548,7 @@ EOT
 }   # ----------  end of function __usage  ----------
 
 
-while getopts ':hvnDc:g:Gyx:k:s:MSNXCPFUKIA:i:Lp:dH:bflV:J:j:rR:aqQ' opt
+while getopts ':hvnDc:g:Gyx:k:s:MSNXCPFUKIA:i:Lp:dH:bB:flm:V:J:j:rR:aqQ' opt
 do
   case "${opt}" in
 
@@ -447,7 +565,7 @@ do
          ;;
 
     k )  _TEMP_KEYS_DIR="$OPTARG"                       ;;
-    s )  _SLEEP=$OPTARG                                 ;;
+    s )  _SLEEP=$OPTARG; _SLEEP_PASSED=$BS_TRUE         ;;
     M )  _INSTALL_MASTER=$BS_TRUE                       ;;
     S )  _INSTALL_SYNDIC=$BS_TRUE                       ;;
     N )  _INSTALL_MINION=$BS_FALSE                      ;;
@@ -465,8 +583,10 @@ do
     d )  _DISABLE_SALT_CHECKS=$BS_TRUE                  ;;
     H )  _HTTP_PROXY="$OPTARG"                          ;;
     b )  _NO_DEPS=$BS_TRUE                              ;;
+    B )  _OFFLINE_BUNDLE="$OPTARG"                      ;;
     f )  _FORCE_SHALLOW_CLONE=$BS_TRUE                  ;;
     l )  _DISABLE_SSL=$BS_TRUE                          ;;
+    m )  _BOOTSTRAP_MODE="$OPTARG"                      ;;
     V )  _VIRTUALENV_DIR="$OPTARG"                      ;;
     a )  _PIP_ALL=$BS_TRUE                              ;;
     r )  _DISABLE_REPOS=$BS_TRUE                        ;;
@@ -488,6 +608,10 @@ do
 done
 shift $((OPTIND-1))
 
+if [ "$_PROFILE_TRACE" != "null" ] && [ -z "${BASH_VERSION:-}" ]; then
+    echowarn "BS_PROFILE_TRACE is ignored, the script must be run with bash to be traced"
+fi
+
 
 # Define our logging file and pipe paths
 LOGFILE="/tmp/$( echo "$__ScriptName" | sed s/.sh/.log/g )"
@@ -513,6 +637,111 @@ exec 2>&-
 exec 2>"$LOGPIPE"
 
 
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __monotonic_ms
+#   DESCRIPTION:  Print a monotonic timestamp in milliseconds, falling back to the wall clock where /proc/uptime
+#                 is not available.
+#----------------------------------------------------------------------------------------------------------------------
+__monotonic_ms() {
+    if [ -r /proc/uptime ]; then
+        awk '{ printf "%d\n", $1 * 1000 }' /proc/uptime
+    else
+        echo $(( $(date +%s) * 1000 ))
+    fi
+}
+
+_REPORT_START=$(__monotonic_ms)
+_REPORT_STARTED_AT=$(date -u +%Y-%m-%dT%H:%M:%SZ)
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __json_escape
+#   DESCRIPTION:  Escape a string to be used as a JSON string value
+#----------------------------------------------------------------------------------------------------------------------
+__json_escape() {
+    printf '%s' "$1" | sed -e 's/\\/\\\\/g' -e 's/"/\\"/g' | tr -d '\n'
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __timed
+#   DESCRIPTION:  Run a command as a named phase, recording how long it took and its exit status for the run
+#                 report. Phases can be nested.
+#    PARAMETERS:  phase name, command and its arguments
+#----------------------------------------------------------------------------------------------------------------------
+__timed() {
+    _TIMED_DEPTH=$((_TIMED_DEPTH + 1))
+    eval "_TIMED_NAME_${_TIMED_DEPTH}=\$1"
+    eval "_TIMED_FUNC_${_TIMED_DEPTH}=\$2"
+    eval "_TIMED_START_${_TIMED_DEPTH}=\$(__monotonic_ms)"
+    shift
+
+    "$@"
+    timed_status=$?
+
+    eval "timed_name=\$_TIMED_NAME_${_TIMED_DEPTH}"
+    eval "timed_func=\$_TIMED_FUNC_${_TIMED_DEPTH}"
+    eval "timed_duration=\$(( \$(__monotonic_ms) - _TIMED_START_${_TIMED_DEPTH} ))"
+    _TIMED_DEPTH=$((_TIMED_DEPTH - 1))
+
+    echodebug "Phase ${timed_name} (${timed_func}) took ${timed_duration}ms and returned ${timed_status}"
+    _REPORT_PHASES="${_REPORT_PHASES}${_REPORT_PHASES:+,}
+    {\"name\": \"${timed_name}\", \"function\": \"$(__json_escape "$timed_func")\", \"duration_ms\": ${timed_duration}, \"status\": ${timed_status}}"
+
+    return $timed_status
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __write_report
+#   DESCRIPTION:  Write the JSON run report to BS_REPORT_FILE
+#    PARAMETERS:  exit code
+#----------------------------------------------------------------------------------------------------------------------
+__write_report() {
+    [ "$_REPORT_FILE" = "null" ] && return 0
+
+    cat <<_eof > "${_REPORT_FILE}.$$"
+{
+  "script_version": "${__ScriptVersion}",
+  "started_at": "${_REPORT_STARTED_AT}",
+  "duration_ms": $(( $(__monotonic_ms) - _REPORT_START )),
+  "exit_code": $1,
+  "install_type": "$(__json_escape "${ITYPE:-}")",
+  "revision": "$(__json_escape "${GIT_REV:-${ONEDIR_REV:-${STABLE_REV:-}}}")",
+  "repo_url": "$(__json_escape "$_REPO_URL")",
+  "detection": {
+    "os_name": "$(__json_escape "${OS_NAME:-}")",
+    "distro_name": "$(__json_escape "${DISTRO_NAME:-}")",
+    "distro_name_l": "$(__json_escape "${DISTRO_NAME_L:-}")",
+    "distro_version": "$(__json_escape "${DISTRO_VERSION:-}")",
+    "distro_major_version": "$(__json_escape "${DISTRO_MAJOR_VERSION:-}")",
+    "distro_minor_version": "$(__json_escape "${DISTRO_MINOR_VERSION:-}")",
+    "distro_codename": "$(__json_escape "${DISTRO_CODENAME:-}")",
+    "cpu_arch": "$(__json_escape "${CPU_ARCH_L:-}")",
+    "cached": $([ "$_DETECTION_CACHED" -eq $BS_TRUE ] && echo true || echo false)
+  },
+  "functions": {
+    "deps": "${DEPS_INSTALL_FUNC:-null}",
+    "config": "${CONFIG_SALT_FUNC:-null}",
+    "preseed": "${PRESEED_MASTER_FUNC:-null}",
+    "install": "${INSTALL_FUNC:-null}",
+    "post": "${POST_INSTALL_FUNC:-null}",
+    "check_services": "${CHECK_SERVICES_FUNC:-null}",
+    "restart_daemons": "${STARTDAEMONS_INSTALL_FUNC:-null}",
+    "daemons_running": "${DAEMONS_RUNNING_FUNC:-null}"
+  },
+  "phases": [${_REPORT_PHASES}
+  ],
+  "lock_retries": ${_REPORT_LOCK_RETRIES},
+  "lock_wait_seconds": ${_REPORT_LOCK_WAIT},
+  "downloads": ${_REPORT_DOWNLOADS},
+  "downloaded_bytes": ${_REPORT_DOWNLOADED_BYTES},
+  "cache_hits": ${_REPORT_CACHE_HITS},
+  "download_retries": ${_REPORT_DOWNLOAD_RETRIES}
+}
+_eof
+    mv -f "${_REPORT_FILE}.$$" "$_REPORT_FILE" || return 1
+    echoinfo "Wrote the run report to ${_REPORT_FILE}"
+}
+
+
 #---  FUNCTION  -------------------------------------------------------------------------------------------------------
 #          NAME:  __exit_cleanup
 #   DESCRIPTION:  Cleanup any leftovers after script has ended
@@ -533,6 +762,8 @@ APT_ERR=$(mktemp /tmp/apt_error.XXXXXX)
 __exit_cleanup() {
     EXIT_CODE=$?
 
+    __write_report "$EXIT_CODE"
+
     if [ "$ITYPE" = "git" ] && [ -d "${_SALT_GIT_CHECKOUT_DIR}" ]; then
         if [ $_KEEP_TEMP_FILES -eq $BS_FALSE ]; then
             # Clean up the checked out repository
@@ -553,6 +784,26 @@ __exit_cleanup() {
         rm -f "$LOGPIPE"
     fi
 
+    # Remove the extracted offline bundle
+    if [ "$_OFFLINE_BUNDLE_TMPDIR" != "null" ] && [ -d "$_OFFLINE_BUNDLE_TMPDIR" ]; then
+        echodebug "Removing the extracted offline bundle $_OFFLINE_BUNDLE_TMPDIR"
+        rm -rf "$_OFFLINE_BUNDLE_TMPDIR"
+    fi
+
+    # Remove the downloaded list of the macOS packages
+    if [ "$_MACOS_REPO_JSON" != "null" ]; then
+        rm -f "$_MACOS_REPO_JSON"
+    fi
+
+    # Stop the prefetch jobs nobody waited for and remove their downloads
+    if [ "$_PREFETCH_DIR" != "null" ]; then
+        for prefetch_pid in $(echo "$_PREFETCH_JOBS" | awk '{ print $1 }'); do
+            echodebug "Killing the prefetch job with pid $prefetch_pid"
+            kill "$prefetch_pid" 2>/dev/null
+        done
+        rm -rf "$_PREFETCH_DIR"
+    fi
+
     # Remove the temporary apt error file when the script exits
     if [ -f "$APT_ERR" ]; then
         echodebug "Removing the temporary apt error file $APT_ERR"
@@ -725,6 +976,10 @@ fi
 if [ "$_QUICK_START" -eq "$BS_TRUE" ]; then
   # make install type is stable
   ITYPE="stable"
+  # which installs the onedir packages, the only ones an offline bundle holds
+  if [ "$_OFFLINE_BUNDLE" != "null" ]; then
+      ITYPE="onedir"
+  fi
 
   # make sure the revision is latest
   STABLE_REV="latest"
@@ -745,6 +1000,28 @@ if [ "$_QUICK_START" -eq "$BS_TRUE" ]; then
   _AUTO_ACCEPT_MINION_KEYS=$BS_TRUE
 fi
 
+# Check the offline bundle
+if [ "$_OFFLINE_BUNDLE" != "null" ]; then
+    if [ "$ITYPE" != "onedir" ]; then
+        echoerror "Offline bundles hold onedir packages, they can't be used with the ${ITYPE} install type"
+        exit 1
+    fi
+    if [ ! -f "$_OFFLINE_BUNDLE" ] && [ ! -d "$_OFFLINE_BUNDLE" ]; then
+        echoerror "The offline bundle $_OFFLINE_BUNDLE does not exist"
+        exit 1
+    fi
+    case "$_OFFLINE_BUNDLE" in
+        /*) ;;
+        *) _OFFLINE_BUNDLE="$(pwd)/${_OFFLINE_BUNDLE}" ;;
+    esac
+    if [ "$_CUSTOM_REPO_URL" != "null" ]; then
+        echowarn "Ignoring -R ${_CUSTOM_REPO_URL}, the Salt packages come from the offline bundle"
+        _CUSTOM_REPO_URL="null"
+    fi
+    # The distribution dependencies are still installed, but the Salt repository isn't set up
+    _DISABLE_REPOS=$BS_TRUE
+fi
+
 # Check for any unparsed arguments. Should be an error.
 if [ "$#" -gt 0 ]; then
     __usage
@@ -766,6 +1043,34 @@ if [ "$($whoami)" != "root" ]; then
     exit 1
 fi
 
+# Check the bootstrap mode. Preparing an image leaves the identity out, personalizing it only configures Salt
+case "$_BOOTSTRAP_MODE" in
+    full)
+        ;;
+    prepare)
+        if [ "$_CONFIG_ONLY" -eq $BS_TRUE ] || [ "$_QUICK_START" -eq $BS_TRUE ]; then
+            echoerror "The prepare mode (-m) can't be combined with -C or -Q."
+            exit 1
+        fi
+        if [ "$_SALT_MASTER_ADDRESS" != "null" ] || [ "$_SALT_MINION_ID" != "null" ] || \
+                [ "$_TEMP_KEYS_DIR" != "null" ] || [ "$_TEMP_CONFIG_DIR" != "null" ] || \
+                [ "$_CUSTOM_MASTER_CONFIG" != "null" ] || [ "$_CUSTOM_MINION_CONFIG" != "null" ]; then
+            echoerror "The prepare mode (-m) leaves the host without identity. Pass -A, -i, -k, -c, -j and -J to the personalize mode instead."
+            exit 1
+        fi
+        _START_DAEMONS=$BS_FALSE
+        ;;
+    personalize)
+        _CONFIG_ONLY=$BS_TRUE
+        # It runs unattended at boot, there's no one to give the time to abort overwriting the configuration
+        _FORCE_OVERWRITE=$BS_TRUE
+        ;;
+    *)
+        echoerror "Unknown bootstrap mode (-m): ${_BOOTSTRAP_MODE}. It can be full, prepare or personalize."
+        exit 1
+        ;;
+esac
+
 # Check that we're actually installing one of minion/master/syndic
 if [ "$_INSTALL_MINION" -eq $BS_FALSE ] && [ "$_INSTALL_MASTER" -eq $BS_FALSE ] && [ "$_INSTALL_SYNDIC" -eq $BS_FALSE ] && [ "$_CONFIG_ONLY" -eq $BS_FALSE ]; then
     echowarn "Nothing to install or configure"
@@ -849,7 +1154,8 @@ fi
 
 # Set the _REPO_URL value based on if -R was passed or not. Defaults to repo.saltproject.io.
 if [ "$_CUSTOM_REPO_URL" != "null" ]; then
-    _REPO_URL="$_CUSTOM_REPO_URL"
+    _REPO_MIRRORS=$(echo "$_CUSTOM_REPO_URL" | tr ',' ' ')
+    _REPO_URL=${_CUSTOM_REPO_URL%%,*}
 
     # Check for -r since -R is being passed. Set -r with a warning.
     if [ "$_DISABLE_REPOS" -eq $BS_FALSE ]; then
@@ -913,18 +1219,444 @@ if [ -d "${_VIRTUALENV_DIR}" ]; then
     exit 1
 fi
 
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#         NAME:  __sha256sum
+#  DESCRIPTION:  Print the SHA256 sum of the passed file, or of the standard input if no file is passed
+#----------------------------------------------------------------------------------------------------------------------
+__sha256sum() {
+    if __check_command_exists sha256sum; then
+        sha256sum "$@" | awk '{ print $1 }'
+    elif __check_command_exists shasum; then
+        # macOS
+        shasum -a 256 "$@" | awk '{ print $1 }'
+    elif __check_command_exists sha256; then
+        # FreeBSD and OpenBSD
+        sha256 -q "$@"
+    else
+        openssl dgst -sha256 "$@" | awk '{ print $NF }'
+    fi
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#         NAME:  __cache_url_key
+#  DESCRIPTION:  Print the path of the file mapping a URL to the SHA256 sum of its cached content
+#----------------------------------------------------------------------------------------------------------------------
+__cache_url_key() {
+    echo "${_CACHE_DIR}/urls/$(printf '%s' "$1" | __sha256sum)"
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#         NAME:  __cache_evict
+#   DESCRIPTION:  Remove the download cache entries not used within the TTL and then the least recently used
+#                 objects until the cache fits in its maximum size
+#----------------------------------------------------------------------------------------------------------------------
+__cache_evict() {
+    find "${_CACHE_DIR}/urls" "${_CACHE_DIR}/objects" -type f -mmin +"${_CACHE_TTL}" -exec rm -f {} + 2>/dev/null
+
+    cache_size=$(du -sk "${_CACHE_DIR}/objects" | awk '{ print $1 }')
+    cache_max_size=$((_CACHE_MAX_SIZE * 1024))
+    [ "$cache_size" -le "$cache_max_size" ] && return 0
+
+    echodebug "The download cache holds ${cache_size}KiB, evicting the least recently used objects"
+    # shellcheck disable=SC2045
+    for cache_object in $(ls -tr "${_CACHE_DIR}/objects"); do
+        [ "$cache_size" -le "$cache_max_size" ] && break
+        cache_object_size=$(du -sk "${_CACHE_DIR}/objects/${cache_object}" | awk '{ print $1 }')
+        rm -f "${_CACHE_DIR}/objects/${cache_object}"
+        cache_size=$((cache_size - cache_object_size))
+    done
+
+    return 0
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#         NAME:  __cache_lookup
+#   DESCRIPTION:  Copy the cached content of a URL to a given path. Returns 1 if the URL is not cached, its cache
+#                 entry is older than the TTL or the cached content does not match its SHA256 sum.
+#    PARAMETERS:  path, url
+#----------------------------------------------------------------------------------------------------------------------
+__cache_lookup() {
+    [ "$_CACHE_DIR" = "null" ] && return 1
+
+    cache_url_key=$(__cache_url_key "$2")
+    [ -f "$cache_url_key" ] || return 1
+
+    if [ "$(find "$cache_url_key" -mmin +"${_CACHE_TTL}" 2>/dev/null)" != "" ]; then
+        echodebug "The cached copy of $2 has expired"
+        rm -f "$cache_url_key"
+        return 1
+    fi
+
+    cache_sum=$(cat "$cache_url_key")
+    cache_object="${_CACHE_DIR}/objects/${cache_sum}"
+    [ -f "$cache_object" ] || return 1
+
+    if [ "$(__sha256sum "$cache_object")" != "$cache_sum" ]; then
+        echowarn "The cached copy of $2 failed checksum verification. Discarding it."
+        rm -f "$cache_object" "$cache_url_key"
+        return 1
+    fi
+
+    cp -f "$cache_object" "$1" || return 1
+    # Mark the object as recently used
+    touch "$cache_object"
+    echodebug "Using the cached copy of $2"
+    return 0
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#         NAME:  __cache_store
+#   DESCRIPTION:  Store a downloaded file in the download cache, keyed by its URL
+#    PARAMETERS:  path, url
+#----------------------------------------------------------------------------------------------------------------------
+__cache_store() {
+    [ "$_CACHE_DIR" = "null" ] && return 0
+    [ -f "$1" ] || return 0
+
+    cache_sum=$(__sha256sum "$1")
+    [ "$cache_sum" = "" ] && return 0
+
+    cache_object="${_CACHE_DIR}/objects/${cache_sum}"
+    if [ ! -f "$cache_object" ]; then
+        if ! { cp -f "$1" "${cache_object}.$$" && mv -f "${cache_object}.$$" "$cache_object"; }; then
+            echowarn "Failed to store $2 in the download cache"
+            rm -f "${cache_object}.$$"
+            return 0
+        fi
+    fi
+
+    cache_url_key=$(__cache_url_key "$2")
+    printf '%s\n' "$cache_sum" > "${cache_url_key}.$$" && mv -f "${cache_url_key}.$$" "$cache_url_key"
+
+    __cache_evict
+    return 0
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#         NAME:  __cache_forget
+#   DESCRIPTION:  Drop the download cache entry of a URL
+#----------------------------------------------------------------------------------------------------------------------
+__cache_forget() {
+    [ "$_CACHE_DIR" = "null" ] && return 0
+    rm -f "$(__cache_url_key "$1")"
+}
+
+# Set up the download cache, if one was requested
+if [ "$_CACHE_DIR" != "null" ]; then
+    if ! mkdir -p "${_CACHE_DIR}/urls" "${_CACHE_DIR}/objects"; then
+        echoerror "Failed to create the download cache directory ${_CACHE_DIR}"
+        exit 1
+    fi
+    echoinfo "Using the download cache at ${_CACHE_DIR}"
+    __cache_evict
+fi
+
+# Point every pip and virtualenv call at the wheelhouse and the pip cache
+if [ "$_PIP_WHEELHOUSE" != "null" ]; then
+    echoinfo "Using the pip wheelhouse at ${_PIP_WHEELHOUSE}"
+    export PIP_FIND_LINKS="$_PIP_WHEELHOUSE"
+    if [ -d "$_PIP_WHEELHOUSE" ]; then
+        export VIRTUALENV_EXTRA_SEARCH_DIR="$_PIP_WHEELHOUSE"
+    fi
+fi
+if [ "$_PIP_NO_INDEX" -eq $BS_TRUE ]; then
+    if [ "$_PIP_WHEELHOUSE" = "null" ]; then
+        echoerror "BS_PIP_NO_INDEX requires BS_PIP_WHEELHOUSE"
+        exit 1
+    fi
+    export PIP_NO_INDEX=1
+fi
+if [ "$_PIP_CACHE_DIR" != "null" ]; then
+    if ! mkdir -p "$_PIP_CACHE_DIR"; then
+        echoerror "Failed to create the pip cache directory ${_PIP_CACHE_DIR}"
+        exit 1
+    fi
+    export PIP_CACHE_DIR="$_PIP_CACHE_DIR"
+fi
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __prefetch_url
+#   DESCRIPTION:  When BS_PREFETCH is enabled, start downloading URLs in background jobs. A later __fetch_url of the
+#                 same URL waits for its job and uses that download, or fetches the URL again if the job failed.
+#                 Nothing is prefetched while no downloader is installed yet.
+#    PARAMETERS:  urls
+#----------------------------------------------------------------------------------------------------------------------
+__prefetch_url() {
+    [ "$_PREFETCH" -eq $BS_TRUE ] || return 0
+    __downloader_available || return 0
+
+    if [ "$_PREFETCH_DIR" = "null" ]; then
+        _PREFETCH_DIR=$(mktemp -d /tmp/salt-prefetch.XXXXXX) || return 0
+    fi
+
+    for prefetch_url in "$@"; do
+        _PREFETCH_COUNT=$((_PREFETCH_COUNT + 1))
+        prefetch_file="${_PREFETCH_DIR}/${_PREFETCH_COUNT}"
+        (
+            # The background job must not install the planned packages nor wait on other jobs. It makes a single
+            # attempt, the foreground __fetch_url retries the download if it failed.
+            _PKG_PLAN=""
+            _PREFETCH_JOBS=""
+            _FETCH_RETRIES=0
+            _REPO_MIRRORS=""
+            __fetch_url "$prefetch_file" "$prefetch_url"
+        ) >/dev/null 2>&1 &
+        _PREFETCH_JOBS="${_PREFETCH_JOBS}$! ${prefetch_file} ${prefetch_url}
+"
+        echodebug "Prefetching ${prefetch_url}"
+    done
+    return 0
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __prefetch_join
+#   DESCRIPTION:  Wait for the prefetch job of a URL and move its download to the given path. Returns 1 if the URL
+#                 was not prefetched or the job failed.
+#    PARAMETERS:  path, url
+#----------------------------------------------------------------------------------------------------------------------
+__prefetch_join() {
+    [ "$_PREFETCH_JOBS" = "" ] && return 1
+
+    prefetch_job=""
+    prefetch_remaining=""
+    while read -r prefetch_pid prefetch_file prefetch_url; do
+        [ "$prefetch_pid" = "" ] && continue
+        if [ "$prefetch_job" = "" ] && [ "$prefetch_url" = "$2" ]; then
+            prefetch_job="${prefetch_pid} ${prefetch_file}"
+        else
+            prefetch_remaining="${prefetch_remaining}${prefetch_pid} ${prefetch_file} ${prefetch_url}
+"
+        fi
+    done <<_eof
+${_PREFETCH_JOBS}
+_eof
+    _PREFETCH_JOBS="$prefetch_remaining"
+    [ "$prefetch_job" = "" ] && return 1
+
+    prefetch_pid=${prefetch_job%% *}
+    prefetch_file=${prefetch_job#* }
+    if wait "$prefetch_pid" && [ -s "$prefetch_file" ] && mv -f "$prefetch_file" "$1"; then
+        echodebug "Using the prefetched $2"
+        _REPORT_DOWNLOADS=$((_REPORT_DOWNLOADS + 1))
+        _REPORT_DOWNLOADED_BYTES=$((_REPORT_DOWNLOADED_BYTES + $(wc -c < "$1")))
+        return 0
+    fi
+
+    rm -f "$prefetch_file"
+    echodebug "Prefetching $2 failed, fetching it again"
+    return 1
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#         NAME:  __downloader_available
+#  DESCRIPTION:  Check if any of the programs __download_url can use is installed
+#----------------------------------------------------------------------------------------------------------------------
+__downloader_available() {
+    for downloader in curl wget fetch ftp; do
+        __check_command_exists "$downloader" && return 0
+    done
+    return 1
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#         NAME:  __download_url
+#  DESCRIPTION:  Download a URL to a given path with whichever downloader is available, giving up on connections
+#                and transfers which stall. When resume is $BS_TRUE, the download continues the partial content
+#                already at the path. The HTTP status of the last response curl or wget got is left in
+#                _FETCH_HTTP_STATUS, and the other downloaders aren't tried when it is a client error.
+#   PARAMETERS:  path, url, resume
+#----------------------------------------------------------------------------------------------------------------------
+__download_url() {
+    if [ "${3:-$BS_FALSE}" -eq $BS_TRUE ]; then
+        download_curl_resume="-C -"
+        download_wget_resume="-c"
+        download_fetch_resume="-r"
+        download_ftp_resume="-C"
+    else
+        download_curl_resume=""
+        download_wget_resume=""
+        download_fetch_resume=""
+        download_ftp_resume=""
+    fi
+    _FETCH_HTTP_STATUS=""
+
+    if __check_command_exists curl; then
+        # shellcheck disable=SC2086
+        _FETCH_HTTP_STATUS=$(curl $_CURL_ARGS $download_curl_resume --connect-timeout "$_FETCH_CONNECT_TIMEOUT" \
+            --speed-limit 1 --speed-time "$_FETCH_STALL_TIMEOUT" -L -s -f -w '%{http_code}' -o "$1" "$2" 2>/dev/null) &&
+            return 0
+        __fetch_client_error && return 1
+    fi
+
+    if __check_command_exists wget; then
+        # Busybox's wget only knows -T, which GNU wget applies to the connection and the reads alike. The response
+        # headers -S prints, or Busybox's error message, hold the HTTP status.
+        # shellcheck disable=SC2086
+        download_wget_log=$(wget $_WGET_ARGS $download_wget_resume -T "$_FETCH_STALL_TIMEOUT" -q -S -O "$1" "$2" 2>&1 >/dev/null) &&
+            return 0
+        _FETCH_HTTP_STATUS=$(echo "$download_wget_log" | awk '{
+            for (i = 1; i < NF; i++) if ($i ~ /^HTTP\/[0-9.]+$/) status = $(i + 1)
+        } END { print status }')
+        __fetch_client_error && return 1
+    fi
+
+    # shellcheck disable=SC2086
+    fetch $_FETCH_ARGS $download_fetch_resume -T "$_FETCH_STALL_TIMEOUT" -q -o "$1" "$2" >/dev/null 2>&1 ||  # FreeBSD
+        fetch $download_fetch_resume -q -o "$1" "$2" >/dev/null 2>&1  ||  # Pre FreeBSD 10
+            ftp $download_ftp_resume -o "$1" "$2" >/dev/null 2>&1         # OpenBSD
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#         NAME:  __fetch_client_error
+#  DESCRIPTION:  Check if the last __download_url failed on an HTTP client error, which trying again or on another
+#                mirror won't fix. Request timeouts (408), unsatisfiable resumes (416) and rate limiting (429) are
+#                worth another attempt, as are connection errors, timeouts and server errors.
+#----------------------------------------------------------------------------------------------------------------------
+__fetch_client_error() {
+    case "$_FETCH_HTTP_STATUS" in
+        408|416|429) return 1 ;;
+        4[0-9][0-9]) return 0 ;;
+    esac
+    return 1
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#         NAME:  __fetch_backoff
+#  DESCRIPTION:  Print the seconds to wait before retrying a download: twice as long after each attempt, up to a
+#                minute, and randomly shortened by up to half so that hosts failing together don't retry together.
+#   PARAMETERS:  attempt
+#----------------------------------------------------------------------------------------------------------------------
+__fetch_backoff() {
+    awk -v attempt="$1" -v seed="$$" 'BEGIN {
+        delay = 2 ^ attempt
+        if (delay > 60) delay = 60
+        srand(); srand(srand() + seed)
+        printf "%d\n", delay / 2 + rand() * delay / 2 + 0.5
+    }'
+}
+
 #---  FUNCTION  -------------------------------------------------------------------------------------------------------
 #         NAME:  __fetch_url
-#  DESCRIPTION:  Retrieves a URL and writes it to a given path
+#  DESCRIPTION:  Retrieves a URL and writes it to a given path. When the download cache is enabled, a valid cached
+#                copy is used instead and fresh downloads are stored in the cache. Failed downloads are retried
+#                BS_FETCH_RETRIES times, resuming the partial download, unless the server answered with an HTTP
+#                client error. When the SHA256 sum of the content is passed, content which doesn't match it is
+#                discarded and downloaded again.
+#   PARAMETERS:  path, url, sha256 (optional)
 #----------------------------------------------------------------------------------------------------------------------
 __fetch_url() {
-    # shellcheck disable=SC2086
-    curl $_CURL_ARGS -L -s -f -o "$1" "$2" >/dev/null 2>&1     ||
-        wget $_WGET_ARGS -q -O "$1" "$2" >/dev/null 2>&1       ||
-            fetch $_FETCH_ARGS -q -o "$1" "$2" >/dev/null 2>&1 ||  # FreeBSD
-                fetch -q -o "$1" "$2" >/dev/null 2>&1          ||  # Pre FreeBSD 10
-                    ftp -o "$1" "$2" >/dev/null 2>&1           ||  # OpenBSD
-                        (echoerror "$2 failed to download to $1"; exit 1)
+    # The planned packages might include the downloader, install them first if there is none yet
+    if [ "$_PKG_PLAN" != "" ] && ! __downloader_available; then
+        __pkg_plan_flush || return 1
+    fi
+
+    if __prefetch_join "$1" "$2"; then
+        if [ "${3:-}" = "" ] || [ "$(__sha256sum "$1")" = "$3" ]; then
+            return 0
+        fi
+        echowarn "The prefetched $2 failed checksum verification. Downloading it again."
+    fi
+
+    # The first download from a -R mirror picks the mirror to use. URLs built before that, or before a failover,
+    # are downloaded from the mirror in use.
+    fetch_src="$2"
+    if __repo_mirror_url "$2" >/dev/null; then
+        __use_repo_mirrors || return 1
+        fetch_src=$(__repo_mirror_url "$2")
+    fi
+
+    if __cache_lookup "$1" "$fetch_src"; then
+        if [ "${3:-}" = "" ] || [ "$cache_sum" = "$3" ]; then
+            _REPORT_CACHE_HITS=$((_REPORT_CACHE_HITS + 1))
+            return 0
+        fi
+        echowarn "The cached copy of $fetch_src does not match the expected checksum. Discarding it."
+        __cache_forget "$fetch_src"
+    fi
+
+    # Download next to the destination, so that a failed download never leaves partial content there
+    fetch_part="${1}.part"
+    rm -f "$fetch_part"
+    fetch_attempt=1
+    fetch_resume=$BS_FALSE
+    while :; do
+        fetch_part_size=0
+        [ -f "$fetch_part" ] && fetch_part_size=$(wc -c < "$fetch_part")
+
+        if __download_url "$fetch_part" "$fetch_src" "$fetch_resume" || {
+                ! __fetch_client_error && __fetch_url_failover "$fetch_part" "$fetch_src" "$fetch_resume"; }; then
+            if [ "${3:-}" = "" ] || [ "$(__sha256sum "$fetch_part")" = "$3" ]; then
+                break
+            fi
+            echowarn "$fetch_src failed checksum verification"
+            rm -f "$fetch_part"
+        fi
+
+        if __fetch_client_error; then
+            rm -f "$fetch_part"
+            echoerror "$fetch_src failed to download to $1, the server answered with HTTP ${_FETCH_HTTP_STATUS}"
+            return 1
+        fi
+        if [ "$fetch_attempt" -gt "$_FETCH_RETRIES" ]; then
+            rm -f "$fetch_part"
+            echoerror "$fetch_src failed to download to $1"
+            return 1
+        fi
+
+        # Resume the partial download, unless the last attempt didn't add anything to it, like when the server
+        # doesn't support resuming, in which case start over
+        if [ -s "$fetch_part" ] && [ "$(wc -c < "$fetch_part")" -gt "$fetch_part_size" ]; then
+            fetch_resume=$BS_TRUE
+        else
+            rm -f "$fetch_part"
+            fetch_resume=$BS_FALSE
+        fi
+
+        fetch_delay=$(__fetch_backoff "$fetch_attempt")
+        fetch_attempt=$((fetch_attempt + 1))
+        _REPORT_DOWNLOAD_RETRIES=$((_REPORT_DOWNLOAD_RETRIES + 1))
+        echowarn "Failed to download $fetch_src, retrying in ${fetch_delay} seconds (attempt ${fetch_attempt} of $((_FETCH_RETRIES + 1)))"
+        sleep "$fetch_delay"
+    done
+    mv -f "$fetch_part" "$1" || return 1
+
+    _REPORT_DOWNLOADS=$((_REPORT_DOWNLOADS + 1))
+    _REPORT_DOWNLOADED_BYTES=$((_REPORT_DOWNLOADED_BYTES + $(wc -c < "$1")))
+    __cache_store "$1" "$fetch_src"
+    return 0
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#         NAME:  __fetch_url_failover
+#  DESCRIPTION:  When a URL of the -R mirror in use failed to download, other than with an HTTP client error which
+#                the other mirrors would answer too, try the same path on the other mirrors. The first one it
+#                downloads from becomes the mirror in use, for the later downloads and repository configurations,
+#                and the failed one is tried last from then on.
+#   PARAMETERS:  path, url, resume
+#----------------------------------------------------------------------------------------------------------------------
+__fetch_url_failover() {
+    case "$2" in
+        *://"${_REPO_URL}"/*) ;;
+        *) return 1 ;;
+    esac
+
+    failover_failed="$_REPO_URL"
+    for failover_mirror in $_REPO_MIRRORS; do
+        [ "$failover_mirror" = "$failover_failed" ] && continue
+        __download_url "$1" "${2%%://*}://${failover_mirror}/${2#*://"${failover_failed}"/}" "${3:-$BS_FALSE}" || continue
+
+        failover_order="$failover_mirror"
+        for failover_other in $_REPO_MIRRORS; do
+            [ "$failover_other" = "$failover_mirror" ] && continue
+            [ "$failover_other" = "$failover_failed" ] && continue
+            failover_order="${failover_order} ${failover_other}"
+        done
+        _REPO_MIRRORS="${failover_order} ${failover_failed}"
+        _REPO_URL="$failover_mirror"
+        echowarn "Failed to download $2 from the ${failover_failed} mirror, switched to the ${_REPO_URL} mirror"
+        return 0
+    done
+    return 1
 }
 
 #---  FUNCTION  -------------------------------------------------------------------------------------------------------
@@ -944,6 +1676,8 @@ __fetch_verify() {
     if rm -f "$fetch_verify_tmpf"; then
         return 0
     fi
+    # Don't keep serving a cached copy which does not verify
+    __cache_forget "$(__repo_mirror_url "$fetch_verify_url")"
     echo "Failed verification of $fetch_verify_url"
     return 1
 }
@@ -960,6 +1694,120 @@ __check_url_exists() {
     return 1
   fi
 }
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __probe_mirror
+#   DESCRIPTION:  Time fetching BS_MIRROR_PROBE_PATH from a mirror. Prints the milliseconds it took, or nothing if
+#                 the mirror didn't answer within BS_MIRROR_PROBE_TIMEOUT seconds.
+#    PARAMETERS:  mirror
+#----------------------------------------------------------------------------------------------------------------------
+__probe_mirror() {
+    probe_url="${HTTP_VAL}://${1}/${_MIRROR_PROBE_PATH}"
+    probe_start=$(__monotonic_ms)
+    if __check_command_exists curl; then
+        # shellcheck disable=SC2086
+        curl $_CURL_ARGS -L -s -f --max-time "$_MIRROR_PROBE_TIMEOUT" -o /dev/null "$probe_url" || return 1
+    elif __check_command_exists wget; then
+        # shellcheck disable=SC2086
+        wget $_WGET_ARGS -q -t 1 -T "$_MIRROR_PROBE_TIMEOUT" -O /dev/null "$probe_url" || return 1
+    elif __check_command_exists fetch; then
+        # shellcheck disable=SC2086
+        fetch $_FETCH_ARGS -q -T "$_MIRROR_PROBE_TIMEOUT" -o /dev/null "$probe_url" || return 1
+    else
+        return 1
+    fi
+    echo $(( $(__monotonic_ms) - probe_start ))
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __select_repo_mirror
+#   DESCRIPTION:  Probe the -R mirrors concurrently and order them by how fast they answered, the ones which
+#                 didn't answer last. The fastest one becomes _REPO_URL, the others are failed over to.
+#----------------------------------------------------------------------------------------------------------------------
+__select_repo_mirror() {
+    select_dir=$(mktemp -d /tmp/salt-mirrors.XXXXXX) || return 1
+    select_jobs=""
+    select_count=0
+    for select_mirror in $_REPO_MIRRORS; do
+        select_count=$((select_count + 1))
+        __probe_mirror "$select_mirror" > "${select_dir}/${select_count}" 2>/dev/null &
+        select_jobs="${select_jobs} $!"
+    done
+    # Only wait for the probes, the logging tee runs in the background too
+    for select_job in $select_jobs; do
+        wait "$select_job"
+    done
+
+    select_ranked=""
+    select_dead=""
+    select_count=0
+    for select_mirror in $_REPO_MIRRORS; do
+        select_count=$((select_count + 1))
+        select_ms=$(cat "${select_dir}/${select_count}")
+        if [ "$select_ms" = "" ]; then
+            echowarn "The ${select_mirror} mirror did not answer within ${_MIRROR_PROBE_TIMEOUT} seconds"
+            select_dead="${select_dead} ${select_mirror}"
+        else
+            echodebug "The ${select_mirror} mirror answered in ${select_ms}ms"
+            select_ranked="${select_ranked}${select_ms} ${select_mirror}
+"
+        fi
+    done
+    rm -rf "$select_dir"
+
+    select_ranked=$(printf '%s' "$select_ranked" | sort -n | awk '{ print $2 }' | tr '\n' ' ')
+    # shellcheck disable=SC2086
+    _REPO_MIRRORS=$(echo $select_ranked $select_dead)
+    _REPO_URL=${_REPO_MIRRORS%% *}
+    echoinfo "Using the ${_REPO_URL} mirror, out of: ${_REPO_MIRRORS}"
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __use_repo_mirrors
+#   DESCRIPTION:  Pick the -R mirror to use, once, right before the first download or repository configuration which
+#                 needs one. The planned packages are installed first if no downloader is installed yet, since the
+#                 probes need one.
+#----------------------------------------------------------------------------------------------------------------------
+__use_repo_mirrors() {
+    [ "$_REPO_MIRRORS_SELECTED" -eq $BS_TRUE ] && return 0
+    if [ "$_REPO_MIRRORS" = "$_REPO_URL" ] || [ "$_REPO_MIRRORS" = "" ]; then
+        return 0
+    fi
+
+    if [ "$_PKG_PLAN" != "" ] && ! __downloader_available; then
+        __pkg_plan_flush || return 1
+    fi
+    # Without a downloader there is nothing to probe with, try again on the next call
+    __downloader_available || return 0
+
+    _REPO_MIRRORS_SELECTED=$BS_TRUE
+    __select_repo_mirror
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __repo_mirror_url
+#   DESCRIPTION:  Print a URL of any of the -R mirrors as the same URL on the mirror in use. URLs of other hosts are
+#                 printed as they are, and 1 is returned for them.
+#    PARAMETERS:  url
+#----------------------------------------------------------------------------------------------------------------------
+__repo_mirror_url() {
+    mirror_url_match=""
+    for mirror_url_mirror in $_REPO_MIRRORS; do
+        case "$1" in
+            *://"${mirror_url_mirror}"/*)
+                # Mirrors can be paths on the same host, the longest one is the mirror of the URL
+                if [ ${#mirror_url_mirror} -gt ${#mirror_url_match} ]; then
+                    mirror_url_match="$mirror_url_mirror"
+                fi
+                ;;
+        esac
+    done
+    if [ "$mirror_url_match" = "" ]; then
+        echo "$1"
+        return 1
+    fi
+    echo "${1%%://*}://${_REPO_URL}/${1#*://"${mirror_url_match}"/}"
+}
+
 #---  FUNCTION  -------------------------------------------------------------------------------------------------------
 #          NAME:  __gather_hardware_info
 #   DESCRIPTION:  Discover hardware information
@@ -1048,15 +1896,6 @@ __derive_debian_numeric_version() {
 }
 
 
-#---  FUNCTION  -------------------------------------------------------------------------------------------------------
-#          NAME:  __unquote_string
-#   DESCRIPTION:  Strip single or double quotes from the provided string.
-#----------------------------------------------------------------------------------------------------------------------
-__unquote_string() {
-    # shellcheck disable=SC1117
-    echo "$*" | sed -e "s/^\([\"\']\)\(.*\)\1\$/\2/g"
-}
-
 #---  FUNCTION  -------------------------------------------------------------------------------------------------------
 #          NAME:  __camelcase_split
 #   DESCRIPTION:  Convert 'CamelCased' strings to 'Camel Cased'
@@ -1079,38 +1918,65 @@ __strip_duplicates() {
 #                 enough.
 #----------------------------------------------------------------------------------------------------------------------
 __sort_release_files() {
-    KNOWN_RELEASE_FILES=$(echo "(arch|alpine|centos|debian|ubuntu|fedora|redhat|suse|\
+    KNOWN_RELEASE_FILES="(arch|alpine|centos|debian|ubuntu|fedora|redhat|suse|\
         mandrake|mandriva|gentoo|slackware|turbolinux|unitedlinux|void|lsb|system|\
-        oracle|os|almalinux|rocky)(-|_)(release|version)" | sed -E 's:[[:space:]]::g')
-    primary_release_files=""
-    secondary_release_files=""
-    # Sort know VS un-known files first
-    for release_file in $(echo "${@}" | sed -E 's:[[:space:]]:\n:g' | sort -f | uniq); do
-        match=$(echo "$release_file" | grep -E -i "${KNOWN_RELEASE_FILES}")
-        if [ "${match}" != "" ]; then
-            primary_release_files="${primary_release_files} ${release_file}"
-        else
-            secondary_release_files="${secondary_release_files} ${release_file}"
-        fi
-    done
+        oracle|os|almalinux|rocky)(-|_)(release|version)"
+
+    # Sort know VS un-known files first, then by know files importance in a single awk pass. Max important goes
+    # last in the max_prio list, least important goes last in the min_prio list.
+    echo "${@}" | sed -E 's:[[:space:]]:\n:g' | sort -f | uniq | awk \
+        -v known="${KNOWN_RELEASE_FILES}" \
+        -v max_prio="redhat-release centos-release oracle-release fedora-release almalinux-release rocky-release" \
+        -v min_prio="lsb-release" '
+        BEGIN { gsub(/[ \t]/, "", known) }
+        $0 == "" { next }
+        tolower($0) ~ known { primary[++primary_count] = $0; next }
+        { secondary[++secondary_count] = $0 }
+        END {
+            entries = split(max_prio, entry, " ")
+            for (i = 1; i <= entries; i++) {
+                for (j = 1; j <= primary_count; j++) {
+                    if (primary[j] != entry[i]) continue
+                    for (k = j; k > 1; k--) primary[k] = primary[k - 1]
+                    primary[1] = entry[i]
+                    break
+                }
+            }
+            entries = split(min_prio, entry, " ")
+            for (i = 1; i <= entries; i++) {
+                for (j = 1; j <= primary_count; j++) {
+                    if (primary[j] != entry[i]) continue
+                    for (k = j; k < primary_count; k++) primary[k] = primary[k + 1]
+                    primary[primary_count] = entry[i]
+                    break
+                }
+            }
+            for (i = 1; i <= primary_count; i++) print primary[i]
+            for (i = 1; i <= secondary_count; i++) print secondary[i]
+        }'
+}
 
-    # Now let's sort by know files importance, max important goes last in the max_prio list
-    max_prio="redhat-release centos-release oracle-release fedora-release almalinux-release rocky-release"
-    for entry in $max_prio; do
-        if [ "$(echo "${primary_release_files}" | grep "$entry")" != "" ]; then
-            primary_release_files=$(echo "${primary_release_files}" | sed -e "s:\\(.*\\)\\($entry\\)\\(.*\\):\\2 \\1 \\3:g")
-        fi
-    done
-    # Now, least important goes last in the min_prio list
-    min_prio="lsb-release"
-    for entry in $min_prio; do
-        if [ "$(echo "${primary_release_files}" | grep "$entry")" != "" ]; then
-            primary_release_files=$(echo "${primary_release_files}" | sed -e "s:\\(.*\\)\\($entry\\)\\(.*\\):\\1 \\3 \\2:g")
-        fi
-    done
 
-    # Echo the results collapsing multiple white-space into a single white-space
-    echo "${primary_release_files} ${secondary_release_files}" | sed -E 's:[[:space:]]+:\n:g'
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __parse_os_release
+#   DESCRIPTION:  Read /etc/os-release in a single pass, without forking, into OS_RELEASE_ID and
+#                 OS_RELEASE_VERSION_ID. Returns 1 if the file does not exist.
+#----------------------------------------------------------------------------------------------------------------------
+__parse_os_release() {
+    OS_RELEASE_ID=""
+    OS_RELEASE_VERSION_ID=""
+
+    [ -f /etc/os-release ] || return 1
+
+    while IFS='=' read -r os_release_key os_release_value; do
+        # Strip the surrounding quotes
+        os_release_value=${os_release_value#[\"\']}
+        os_release_value=${os_release_value%[\"\']}
+        case "$os_release_key" in
+            ID         ) OS_RELEASE_ID="$os_release_value" ;;
+            VERSION_ID ) OS_RELEASE_VERSION_ID="$os_release_value" ;;
+        esac
+    done < /etc/os-release
 }
 
 
@@ -1237,8 +2103,9 @@ __gather_linux_system_info() {
                 done < "/etc/${rsource}"
                 ;;
             os                 )
-                nn="$(__unquote_string "$(grep '^ID=' /etc/os-release | sed -e 's/^ID=\(.*\)$/\1/g')")"
-                rv="$(__unquote_string "$(grep '^VERSION_ID=' /etc/os-release | sed -e 's/^VERSION_ID=\(.*\)$/\1/g')")"
+                __parse_os_release
+                nn="${OS_RELEASE_ID}"
+                rv="${OS_RELEASE_VERSION_ID}"
                 [ "${rv}" != "" ] && v=$(__parse_version_string "$rv") || v=""
                 case $(echo "${nn}" | tr '[:upper:]' '[:lower:]') in
                     alpine      )
@@ -1318,6 +2185,67 @@ __install_python() {
 }
 
 
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __detection_fingerprint
+#   DESCRIPTION:  Fingerprint the inputs of the Linux distribution detection, the names, modification times, sizes
+#                 and contents of the release files in /etc and whether the lsb_release binary is available
+#----------------------------------------------------------------------------------------------------------------------
+__detection_fingerprint() {
+    # shellcheck disable=SC2035,SC2086
+    (
+        cd /etc || exit 1
+        command -v lsb_release
+        release_files=$(/bin/ls -d *[_-]release *[_-]version upstream-release/lsb-release 2>/dev/null)
+        if [ "$release_files" != "" ]; then
+            /bin/ls -ldLn $release_files
+            cat $release_files
+        fi
+    ) 2>/dev/null | cksum | awk '{ print $1 "-" $2 }'
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __detection_cache_load
+#   DESCRIPTION:  Load DISTRO_NAME and DISTRO_VERSION from the detection cache in BS_CACHE_DIR, if it was written
+#                 for the same release files fingerprint
+#----------------------------------------------------------------------------------------------------------------------
+__detection_cache_load() {
+    [ "$_CACHE_DIR" = "null" ] && return 1
+    [ -f "${_CACHE_DIR}/detection" ] || return 1
+
+    {
+        read -r cached_fingerprint
+        IFS= read -r cached_distro_name
+        IFS= read -r cached_distro_version
+    } < "${_CACHE_DIR}/detection" || return 1
+
+    if [ "$cached_fingerprint" != "$_DETECTION_FINGERPRINT" ] || [ "$cached_distro_name" = "" ]; then
+        echodebug "The release files changed since the detection was cached"
+        return 1
+    fi
+
+    DISTRO_NAME="$cached_distro_name"
+    DISTRO_VERSION="$cached_distro_version"
+    _DETECTION_CACHED=$BS_TRUE
+    echodebug "Using the cached distribution detection: ${DISTRO_NAME} ${DISTRO_VERSION}"
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __detection_cache_store
+#   DESCRIPTION:  Store DISTRO_NAME and DISTRO_VERSION in the detection cache in BS_CACHE_DIR
+#----------------------------------------------------------------------------------------------------------------------
+__detection_cache_store() {
+    [ "$_CACHE_DIR" = "null" ] && return 0
+    [ "$DISTRO_NAME" = "" ] && return 0
+
+    printf '%s\n%s\n%s\n' "$_DETECTION_FINGERPRINT" "$DISTRO_NAME" "$DISTRO_VERSION" \
+        > "${_CACHE_DIR}/detection.$$" && mv -f "${_CACHE_DIR}/detection.$$" "${_CACHE_DIR}/detection" || {
+        rm -f "${_CACHE_DIR}/detection.$$"
+        echowarn "Failed to store the distribution detection in the cache"
+    }
+    return 0
+}
+
+
 #---  FUNCTION  -------------------------------------------------------------------------------------------------------
 #          NAME:  __gather_sunos_system_info
 #   DESCRIPTION:  Discover SunOS system info
@@ -1420,7 +2348,11 @@ __gather_osx_system_info() {
 __gather_system_info() {
     case ${OS_NAME_L} in
         linux )
-            __gather_linux_system_info
+            _DETECTION_FINGERPRINT=$(__detection_fingerprint)
+            if ! __detection_cache_load; then
+                __gather_linux_system_info
+                __detection_cache_store
+            fi
             ;;
         sunos )
             __gather_sunos_system_info
@@ -1883,7 +2815,7 @@ __check_end_of_life_versions() {
 }
 
 
-__gather_system_info
+__timed detect __gather_system_info
 
 echo
 echoinfo "System Information:"
@@ -2063,6 +2995,170 @@ __function_defined() {
 }
 
 
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __pkg_plan_add
+#   DESCRIPTION:  Add packages to the package plan instead of installing them right away. Returns 1 if the caller
+#                 must install them now, because batching is off, the plan is being flushed, the call passes
+#                 package manager options or the plan belongs to another package manager wrapper. On dry runs,
+#                 those calls are only printed.
+#    PARAMETERS:  install function, packages
+#----------------------------------------------------------------------------------------------------------------------
+__pkg_plan_add() {
+    [ "$_PKG_PLAN_ACTIVE" -eq $BS_TRUE ] || return 1
+    [ "$_PKG_PLAN_FLUSHING" -eq $BS_TRUE ] && return 1
+
+    pkg_plan_batchable=$BS_TRUE
+    [ "$_PKG_PLAN_FUNC" != "" ] && [ "$_PKG_PLAN_FUNC" != "$1" ] && pkg_plan_batchable=$BS_FALSE
+    pkg_plan_func=$1
+    shift
+    [ $# -eq 0 ] && return 1
+    for pkg_plan_package in "$@"; do
+        case "$pkg_plan_package" in
+            -*) pkg_plan_batchable=$BS_FALSE ;;
+        esac
+    done
+
+    if [ "$pkg_plan_batchable" -eq $BS_FALSE ]; then
+        [ "$_PKG_DRY_RUN" -eq $BS_TRUE ] || return 1
+        # On dry runs, this call is a transaction of its own
+        __pkg_plan_flush
+        echoinfo "Package plan: ${pkg_plan_func} $*"
+        return 0
+    fi
+
+    _PKG_PLAN_FUNC="$pkg_plan_func"
+    _PKG_PLAN="${_PKG_PLAN} $*"
+    echodebug "Added to the package plan: $*"
+    return 0
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __pkg_plan_flush
+#   DESCRIPTION:  Install the packages collected in the package plan in a single transaction. On dry runs, only
+#                 print the transaction.
+#----------------------------------------------------------------------------------------------------------------------
+__pkg_plan_flush() {
+    [ "$_PKG_PLAN" = "" ] && return 0
+
+    # shellcheck disable=SC2086
+    pkg_plan_flush_packages=$(__strip_duplicates ${_PKG_PLAN} | tr '\n' ' ')
+    pkg_plan_flush_packages=${pkg_plan_flush_packages% }
+    pkg_plan_flush_func="$_PKG_PLAN_FUNC"
+    _PKG_PLAN=""
+    _PKG_PLAN_FUNC=""
+
+    if [ "$_PKG_DRY_RUN" -eq $BS_TRUE ]; then
+        echoinfo "Package plan: ${pkg_plan_flush_func} ${pkg_plan_flush_packages}"
+        return 0
+    fi
+
+    echoinfo "Installing the planned packages in one transaction: ${pkg_plan_flush_packages}"
+    _PKG_PLAN_FLUSHING=$BS_TRUE
+    # shellcheck disable=SC2086
+    ${pkg_plan_flush_func} ${pkg_plan_flush_packages}
+    pkg_plan_flush_status=$?
+    _PKG_PLAN_FLUSHING=$BS_FALSE
+    return $pkg_plan_flush_status
+}
+
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __pkg_lock_holders
+#   DESCRIPTION:  Print the PIDs of the processes holding the locks of a package manager, one per line
+#    PARAMETERS:  package manager, apt, rpm or zypp
+#----------------------------------------------------------------------------------------------------------------------
+__pkg_lock_holders() {
+    # dpkg, apt and rpm lock files they keep open, yum, dnf and zypper write their PID to a file
+    case "$1" in
+        apt)
+            lock_open_files="/var/lib/dpkg/lock-frontend /var/lib/dpkg/lock /var/lib/apt/lists/lock"
+            lock_open_files="${lock_open_files} /var/cache/apt/archives/lock"
+            lock_pid_files=""
+            ;;
+        rpm)
+            lock_open_files="/var/lib/rpm/.rpm.lock /usr/lib/sysimage/rpm/.rpm.lock /var/run/.tdnf-instance-lockfile"
+            lock_pid_files="/var/run/yum.pid /var/cache/dnf/rpmdb_lock.pid /var/cache/dnf/metadata_lock.pid"
+            lock_pid_files="${lock_pid_files} /var/cache/dnf/download_lock.pid"
+            ;;
+        zypp)
+            lock_open_files=""
+            lock_pid_files="/run/zypp.pid /var/run/zypp.pid"
+            ;;
+    esac
+
+    {
+        for lock_file in $lock_pid_files; do
+            [ -f "$lock_file" ] || continue
+            lock_pid=$(head -n 1 "$lock_file" 2>/dev/null | tr -cd '0-9')
+            # A PID file can outlive its process
+            if [ "$lock_pid" != "" ] && [ -d "/proc/${lock_pid}" ]; then
+                echo "$lock_pid"
+            fi
+        done
+        for lock_file in $lock_open_files; do
+            [ -e "$lock_file" ] || continue
+            if __check_command_exists fuser; then
+                fuser "$lock_file" 2>/dev/null
+            else
+                find /proc/[0-9]*/fd -lname "$lock_file" 2>/dev/null | cut -d/ -f3
+            fi
+        done
+    } | tr -s ' \t' '\n' | grep -v -x -e '' -e "$$" | sort -u
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __wait_for_pkg_lock
+#   DESCRIPTION:  Wait until no other process holds the locks of a package manager, for up to BS_PKG_LOCK_TIMEOUT
+#                 seconds, or until the given __monotonic_ms deadline when the wait is one of several sharing it.
+#                 The processes holding them are logged, and only watched for exiting, which is cheaper than
+#                 looking for the lock holders again or retrying the package manager.
+#    PARAMETERS:  package manager, apt, rpm or zypp, deadline (optional)
+#----------------------------------------------------------------------------------------------------------------------
+__wait_for_pkg_lock() {
+    lock_start=$(__monotonic_ms)
+    lock_deadline=${2:-$(( lock_start + _PKG_LOCK_TIMEOUT * 1000 ))}
+    lock_logged=""
+
+    while :; do
+        lock_holders=$(__pkg_lock_holders "$1")
+        [ "$lock_holders" = "" ] && break
+
+        for lock_pid in $lock_holders; do
+            case " ${lock_logged} " in
+                *" ${lock_pid} "*) continue ;;
+            esac
+            lock_logged="${lock_logged} ${lock_pid}"
+            lock_command=$(tr '\0\n' '  ' < "/proc/${lock_pid}/cmdline" 2>/dev/null)
+            echoinfo "Waiting for the ${1} lock, held by PID ${lock_pid}: ${lock_command:-unknown}"
+        done
+
+        while :; do
+            if [ "$(__monotonic_ms)" -ge "$lock_deadline" ]; then
+                echoerror "The ${1} lock is still held after ${_PKG_LOCK_TIMEOUT} seconds. Aborting."
+                _REPORT_LOCK_WAIT=$((_REPORT_LOCK_WAIT + ($(__monotonic_ms) - lock_start) / 1000))
+                return 1
+            fi
+            lock_running=$BS_FALSE
+            for lock_pid in $lock_holders; do
+                if [ -d "/proc/${lock_pid}" ]; then
+                    lock_running=$BS_TRUE
+                    break
+                fi
+            done
+            [ "$lock_running" -eq $BS_FALSE ] && break
+            # Not every sleep implementation takes fractions of a second
+            sleep 0.25 2>/dev/null || sleep 1
+        done
+    done
+
+    if [ "$lock_logged" != "" ]; then
+        lock_waited=$(( ($(__monotonic_ms) - lock_start) / 1000 ))
+        _REPORT_LOCK_WAIT=$((_REPORT_LOCK_WAIT + lock_waited))
+        echoinfo "The ${1} lock was released after ${lock_waited} seconds"
+    fi
+    return 0
+}
+
 #---  FUNCTION  -------------------------------------------------------------------------------------------------------
 #          NAME:  __wait_for_apt
 #   DESCRIPTION:  Check if any apt, apt-get, aptitude, or dpkg processes are running before
@@ -2071,27 +3167,35 @@ __function_defined() {
 #                 process is finished so the script doesn't exit on a locked proc.
 #----------------------------------------------------------------------------------------------------------------------
 __wait_for_apt(){
-    # Timeout set at 15 minutes
-    WAIT_TIMEOUT=900
+    # Install the planned packages before the package sources change
+    __pkg_plan_flush || return 1
+
+    # Give up on a lock held for longer than BS_PKG_LOCK_TIMEOUT, however the wait is split up
+    apt_deadline=$(( $(__monotonic_ms) + _PKG_LOCK_TIMEOUT * 1000 ))
+
+    __wait_for_pkg_lock apt "$apt_deadline" || return 1
 
     # Run our passed in apt command
     "${@}" 2>"$APT_ERR"
     APT_RETURN=$?
 
-    # Make sure we're not waiting on a lock
+    # The lock can still be taken between the wait and apt starting, or by a process we could not tell holds it
     while [ $APT_RETURN -ne 0 ] && grep -q '^E: Could not get lock' "$APT_ERR"; do
-        echoinfo "Aware of the lock. Patiently waiting $WAIT_TIMEOUT more seconds..."
-        sleep 1
-        WAIT_TIMEOUT=$((WAIT_TIMEOUT - 1))
-
-        if [ "$WAIT_TIMEOUT" -eq 0 ]; then
+        apt_now=$(__monotonic_ms)
+        if [ "$apt_now" -ge "$apt_deadline" ]; then
             echoerror "Apt, apt-get, aptitude, or dpkg process is taking too long."
             echoerror "Bootstrap script cannot proceed. Aborting."
             return 1
-        else
-            "${@}" 2>"$APT_ERR"
-            APT_RETURN=$?
         fi
+
+        echoinfo "Aware of the lock. Patiently waiting $(( (apt_deadline - apt_now + 999) / 1000 )) more seconds..."
+        sleep 1
+        _REPORT_LOCK_RETRIES=$((_REPORT_LOCK_RETRIES + 1))
+        _REPORT_LOCK_WAIT=$((_REPORT_LOCK_WAIT + 1))
+
+        __wait_for_pkg_lock apt "$apt_deadline" || return 1
+        "${@}" 2>"$APT_ERR"
+        APT_RETURN=$?
     done
 
     return $APT_RETURN
@@ -2103,6 +3207,7 @@ __wait_for_apt(){
 #    PARAMETERS:  packages
 #----------------------------------------------------------------------------------------------------------------------
 __apt_get_install_noinput() {
+    __pkg_plan_add __apt_get_install_noinput "${@}" && return 0
     __wait_for_apt apt-get install -y -o DPkg::Options::=--force-confold "${@}"; return $?
 }   # ----------  end of function __apt_get_install_noinput  ----------
 
@@ -2183,6 +3288,9 @@ __rpm_import_gpg() {
 #   DESCRIPTION:  (DRY) yum install with noinput options
 #----------------------------------------------------------------------------------------------------------------------
 __yum_install_noinput() {
+    __pkg_plan_add __yum_install_noinput "${@}" && return 0
+    __pkg_plan_flush || return 1
+    __wait_for_pkg_lock rpm || return 1
 
     if [ "$DISTRO_NAME_L" = "oracle_linux" ]; then
         # We need to install one package at a time because --enablerepo=X disables ALL OTHER REPOS!!!!
@@ -2199,6 +3307,9 @@ __yum_install_noinput() {
 #   DESCRIPTION:  (DRY) dnf install with noinput options
 #----------------------------------------------------------------------------------------------------------------------
 __dnf_install_noinput() {
+    __pkg_plan_add __dnf_install_noinput "${@}" && return 0
+    __pkg_plan_flush || return 1
+    __wait_for_pkg_lock rpm || return 1
 
     dnf -y install "${@}" || return $?
 }   # ----------  end of function __dnf_install_noinput  ----------
@@ -2208,10 +3319,78 @@ __dnf_install_noinput() {
 #   DESCRIPTION:  (DRY) tdnf install with noinput options
 #----------------------------------------------------------------------------------------------------------------------
 __tdnf_install_noinput() {
+    __pkg_plan_add __tdnf_install_noinput "${@}" && return 0
+    __pkg_plan_flush || return 1
+    __wait_for_pkg_lock rpm || return 1
 
     tdnf -y install "${@}" || return $?
 }   # ----------  end of function __tdnf_install_noinput  ----------
 
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __git_refresh_mirror
+#   DESCRIPTION:  Create the bare mirror of the Salt repository in BS_GIT_MIRROR_DIR, or incrementally refresh it.
+#                 A mirror which cannot be refreshed is still used, as a reference it only saves downloads.
+#----------------------------------------------------------------------------------------------------------------------
+__git_refresh_mirror() {
+    [ "$_GIT_MIRROR_DIR" = "null" ] && return 0
+
+    if [ -f "${_GIT_MIRROR_DIR}/HEAD" ]; then
+        echoinfo "Refreshing the git mirror ${_GIT_MIRROR_DIR}"
+        git --git-dir="${_GIT_MIRROR_DIR}" remote update --prune || \
+            echowarn "Failed to refresh the git mirror ${_GIT_MIRROR_DIR}, using it as is"
+    else
+        echoinfo "Creating the git mirror ${_GIT_MIRROR_DIR} of ${_SALT_REPO_URL}"
+        if ! git clone --mirror "$_SALT_REPO_URL" "$_GIT_MIRROR_DIR"; then
+            echowarn "Failed to create the git mirror ${_GIT_MIRROR_DIR}, not using it"
+            rm -rf "$_GIT_MIRROR_DIR"
+            return 1
+        fi
+    fi
+    return 0
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __shell_quote
+#   DESCRIPTION:  Echo the argument single quoted, so that evaluating it gives back the same word
+#----------------------------------------------------------------------------------------------------------------------
+__shell_quote() {
+    printf "'%s'" "$(printf '%s' "$1" | sed "s/'/'\\\\''/g")"
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __git_clone_args
+#   DESCRIPTION:  Echo the extra `git clone` arguments for the reference directory, the mirror and partial clones,
+#                 quoted for `eval set --`
+#----------------------------------------------------------------------------------------------------------------------
+__git_clone_args() {
+    git_clone_references=""
+    if [ "$_GIT_MIRROR_DIR" != "null" ] && [ -f "${_GIT_MIRROR_DIR}/HEAD" ]; then
+        git_clone_references="--reference $(__shell_quote "$_GIT_MIRROR_DIR") "
+    fi
+    if [ "$_GIT_REFERENCE_DIR" != "null" ]; then
+        if [ -d "$_GIT_REFERENCE_DIR" ]; then
+            git_clone_references="${git_clone_references}--reference $(__shell_quote "$_GIT_REFERENCE_DIR") "
+        else
+            echowarn "The git reference directory ${_GIT_REFERENCE_DIR} does not exist, not using it" >&2
+        fi
+    fi
+    if [ "$git_clone_references" != "" ]; then
+        # Copy the borrowed objects into the clone, a kept checkout must not break when the mirror is pruned
+        if git clone -h 2>&1 | grep -q -e '--dissociate'; then
+            printf -- '%s--dissociate ' "$git_clone_references"
+        else
+            echowarn "Cloning from a git reference or mirror requires git 2.3 or newer, not using them" >&2
+        fi
+    fi
+    if [ "$_GIT_PARTIAL_CLONE" -eq $BS_TRUE ]; then
+        if git clone -h 2>&1 | grep -q -e '--filter'; then
+            printf -- '--filter=blob:none '
+        else
+            echowarn "Partial clones require git 2.19 or newer, doing a full clone" >&2
+        fi
+    fi
+}
+
 #---  FUNCTION  -------------------------------------------------------------------------------------------------------
 #          NAME:  __git_clone_and_checkout
 #   DESCRIPTION:  (DRY) Helper function to clone and checkout salt to a
@@ -2266,6 +3445,12 @@ __git_clone_and_checkout() {
             git pull --rebase || return 1
         fi
     else
+        __git_refresh_mirror
+        __GIT_CLONE_ARGS=$(__git_clone_args)
+        [ "$__GIT_CLONE_ARGS" != "" ] && echodebug "Extra git clone arguments: ${__GIT_CLONE_ARGS}"
+        # The reference directories might contain spaces, keep each argument a single word
+        eval "set -- ${__GIT_CLONE_ARGS}"
+
         if [ "$_FORCE_SHALLOW_CLONE" -eq "${BS_TRUE}" ]; then
             echoinfo "Forced shallow cloning of git repository."
             __SHALLOW_CLONE=$BS_TRUE
@@ -2284,7 +3469,7 @@ __git_clone_and_checkout() {
             if [ "$(git clone 2>&1 | grep 'single-branch')" != "" ]; then
                 # The "--single-branch" option is supported, attempt shallow cloning
                 echoinfo "Attempting to shallow clone $GIT_REV from Salt's repository ${_SALT_REPO_URL}"
-                if git clone --depth 1 --branch "$GIT_REV" "$_SALT_REPO_URL" "$__SALT_CHECKOUT_REPONAME"; then
+                if git clone --depth 1 --branch "$GIT_REV" "$@" "$_SALT_REPO_URL" "$__SALT_CHECKOUT_REPONAME"; then
                     # shellcheck disable=SC2164
                     cd "${_SALT_GIT_CHECKOUT_DIR}"
                     __SHALLOW_CLONE=$BS_TRUE
@@ -2301,7 +3486,12 @@ __git_clone_and_checkout() {
         fi
 
         if [ "$__SHALLOW_CLONE" -eq $BS_FALSE ]; then
-            git clone "$_SALT_REPO_URL" "$__SALT_CHECKOUT_REPONAME" || return 1
+            if ! git clone "$@" "$_SALT_REPO_URL" "$__SALT_CHECKOUT_REPONAME"; then
+                [ "$__GIT_CLONE_ARGS" = "" ] && return 1
+                echowarn "Failed to clone using ${__GIT_CLONE_ARGS}, retrying a regular clone"
+                rm -rf "${_SALT_GIT_CHECKOUT_DIR}"
+                git clone "$_SALT_REPO_URL" "$__SALT_CHECKOUT_REPONAME" || return 1
+            fi
             # shellcheck disable=SC2164
             cd "${_SALT_GIT_CHECKOUT_DIR}"
 
@@ -2822,6 +4012,24 @@ __install_pip_deps() {
     pip install -U -r ${requirements_file} ${__PIP_PACKAGES}
 }   # ----------  end of function __install_pip_deps  ----------
 
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __salt_wheel_cache_dir
+#   DESCRIPTION:  Echo the directory in BS_CACHE_DIR holding the Salt wheels built from the current checkout. The
+#                 key covers the checked out commit, the python version and the build arguments. Returns 1 if the
+#                 cache is disabled or the checkout has local changes.
+#    PARAMETERS:  python version
+#----------------------------------------------------------------------------------------------------------------------
+__salt_wheel_cache_dir() {
+    [ "$_CACHE_DIR" = "null" ] && return 1
+
+    wheel_cache_head=$(git rev-parse HEAD 2>/dev/null) || return 1
+    [ "$(git status --porcelain 2>/dev/null)" = "" ] || return 1
+
+    wheel_cache_key=$(printf '%s\n' "$1" "$_PIP_DOWNLOAD_ARGS" "$_POST_NEON_PIP_INSTALL_ARGS" "$_SALT_ETC_DIR" \
+        "$_SALT_CACHE_DIR" "${SETUP_PY_INSTALL_ARGS:-}" | __sha256sum | cut -c -12)
+    echo "${_CACHE_DIR}/wheels/${wheel_cache_head}-${wheel_cache_key}"
+}
+
 #---  FUNCTION  -------------------------------------------------------------------------------------------------------
 #          NAME:  __install_salt_from_repo_post_neon
 #   DESCRIPTION:  Return 0 or 1 if successfully able to install. Can provide a different python version to
@@ -2912,24 +4120,48 @@ EOM
     cd "${_SALT_GIT_CHECKOUT_DIR}" || return 1
 
     mkdir /tmp/git/deps
-    echoinfo "Downloading Salt Dependencies from PyPi"
-    echodebug "Running '${_pip_cmd} download -d /tmp/git/deps ${_PIP_DOWNLOAD_ARGS} .'"
-    ${_pip_cmd} download -d /tmp/git/deps ${_PIP_DOWNLOAD_ARGS} . || (echo "Failed to download salt dependencies" && return 1)
+
+    if [ "$_ECHO_DEBUG" -eq $BS_TRUE ]; then
+        SETUP_PY_INSTALL_ARGS="-v"
+    fi
+
+    # Reuse the wheels built earlier for the same commit
+    _wheel_cache_dir=$(__salt_wheel_cache_dir "${_py_version}") || _wheel_cache_dir=""
+    if [ "$_wheel_cache_dir" != "" ] && [ -f "${_wheel_cache_dir}/complete" ]; then
+        echoinfo "Using the Salt wheels cached in ${_wheel_cache_dir}"
+        touch "${_wheel_cache_dir}"
+        cp "${_wheel_cache_dir}"/deps/* /tmp/git/deps/ 2>/dev/null
+    else
+        echoinfo "Downloading Salt Dependencies from PyPi"
+        echodebug "Running '${_pip_cmd} download -d /tmp/git/deps ${_PIP_DOWNLOAD_ARGS} .'"
+        ${_pip_cmd} download -d /tmp/git/deps ${_PIP_DOWNLOAD_ARGS} . || (echo "Failed to download salt dependencies" && return 1)
+        if [ "$_wheel_cache_dir" != "" ]; then
+            rm -rf "${_wheel_cache_dir}"
+            mkdir -p "${_wheel_cache_dir}/deps" && cp /tmp/git/deps/* "${_wheel_cache_dir}/deps/" 2>/dev/null
+        fi
+    fi
 
     echoinfo "Installing Downloaded Salt Dependencies"
     echodebug "Running '${_pip_cmd} install --ignore-installed ${_POST_NEON_PIP_INSTALL_ARGS} /tmp/git/deps/*'"
     ${_pip_cmd} install --ignore-installed ${_POST_NEON_PIP_INSTALL_ARGS} /tmp/git/deps/* || return 1
     rm -f /tmp/git/deps/*
 
-    echoinfo "Building Salt Python Wheel"
+    if [ "$_wheel_cache_dir" != "" ] && [ -f "${_wheel_cache_dir}/complete" ]; then
+        cp "${_wheel_cache_dir}"/salt*.whl /tmp/git/deps/ || return 1
+    else
+        echoinfo "Building Salt Python Wheel"
 
-    if [ "$_ECHO_DEBUG" -eq $BS_TRUE ]; then
-        SETUP_PY_INSTALL_ARGS="-v"
-    fi
+        echodebug "Running '${_py_exe} setup.py --salt-config-dir=$_SALT_ETC_DIR --salt-cache-dir=${_SALT_CACHE_DIR} ${SETUP_PY_INSTALL_ARGS} bdist_wheel'"
+        ${_py_exe} setup.py --salt-config-dir="$_SALT_ETC_DIR" --salt-cache-dir="${_SALT_CACHE_DIR}" ${SETUP_PY_INSTALL_ARGS} bdist_wheel || return 1
+        mv dist/salt*.whl /tmp/git/deps/ || return 1
 
-    echodebug "Running '${_py_exe} setup.py --salt-config-dir=$_SALT_ETC_DIR --salt-cache-dir=${_SALT_CACHE_DIR} ${SETUP_PY_INSTALL_ARGS} bdist_wheel'"
-    ${_py_exe} setup.py --salt-config-dir="$_SALT_ETC_DIR" --salt-cache-dir="${_SALT_CACHE_DIR}" ${SETUP_PY_INSTALL_ARGS} bdist_wheel || return 1
-    mv dist/salt*.whl /tmp/git/deps/ || return 1
+        if [ "$_wheel_cache_dir" != "" ] && cp /tmp/git/deps/salt*.whl "${_wheel_cache_dir}/"; then
+            touch "${_wheel_cache_dir}/complete"
+            echodebug "Cached the Salt wheels in ${_wheel_cache_dir}"
+            # Drop the wheels of commits not installed for a while
+            find "${_CACHE_DIR}/wheels" -mindepth 1 -maxdepth 1 -type d -mmin +"${_CACHE_TTL}" -exec rm -rf {} + 2>/dev/null
+        fi
+    fi
 
     cd "${__SALT_GIT_CHECKOUT_PARENT_DIR}" || return 1
 
@@ -3083,6 +4315,17 @@ __install_saltstack_ubuntu_repository() {
         UBUNTU_CODENAME=${DISTRO_CODENAME}
     fi
 
+    __PY_VERSION_REPO="apt"
+    if [ -n "$_PY_EXE" ] && [ "$_PY_MAJOR_VERSION" -eq 3 ]; then
+        __PY_VERSION_REPO="py3"
+    fi
+
+    # SaltStack's stable Ubuntu repository:
+    SALTSTACK_UBUNTU_URL="${HTTP_VAL}://${_REPO_URL}/${__PY_VERSION_REPO}/ubuntu/${UBUNTU_VERSION}/${__REPO_ARCH}/${STABLE_REV}"
+
+    # Download the key while the packages below install
+    __prefetch_url "$SALTSTACK_UBUNTU_URL/salt-archive-keyring.gpg"
+
     # Install downloader backend for GPG keys fetching
     __PACKAGES='wget'
 
@@ -3099,17 +4342,11 @@ __install_saltstack_ubuntu_repository() {
     # shellcheck disable=SC2086,SC2090
     __apt_get_install_noinput ${__PACKAGES} || return 1
 
-    __PY_VERSION_REPO="apt"
-    if [ -n "$_PY_EXE" ] && [ "$_PY_MAJOR_VERSION" -eq 3 ]; then
-        __PY_VERSION_REPO="py3"
-    fi
-
-    # SaltStack's stable Ubuntu repository:
-    SALTSTACK_UBUNTU_URL="${HTTP_VAL}://${_REPO_URL}/${__PY_VERSION_REPO}/ubuntu/${UBUNTU_VERSION}/${__REPO_ARCH}/${STABLE_REV}"
-    echo "$__REPO_ARCH_DEB $SALTSTACK_UBUNTU_URL $UBUNTU_CODENAME main" > /etc/apt/sources.list.d/salt.list
-
     __apt_key_fetch "$SALTSTACK_UBUNTU_URL/salt-archive-keyring.gpg" || return 1
 
+    # Point the source at the mirror the key was fetched from, it might have failed over to another one
+    echo "$__REPO_ARCH_DEB $(__repo_mirror_url "$SALTSTACK_UBUNTU_URL") $UBUNTU_CODENAME main" > /etc/apt/sources.list.d/salt.list
+
     __wait_for_apt apt-get update || return 1
 }
 
@@ -3125,6 +4362,24 @@ __install_saltstack_ubuntu_onedir_repository() {
         UBUNTU_CODENAME=${DISTRO_CODENAME}
     fi
 
+    __PY_VERSION_REPO="apt"
+    if [ -n "$_PY_EXE" ] && [ "$_PY_MAJOR_VERSION" -eq 3 ]; then
+        __PY_VERSION_REPO="py3"
+    fi
+
+    # SaltStack's stable Ubuntu repository:
+    SALTSTACK_UBUNTU_URL="${HTTP_VAL}://${_REPO_URL}/${_ONEDIR_DIR}/${__PY_VERSION_REPO}/ubuntu/${UBUNTU_VERSION}/${__REPO_ARCH}/${ONEDIR_REV}/"
+    if [ "${ONEDIR_REV}" = "nightly" ] ; then
+        SALTSTACK_UBUNTU_URL="${HTTP_VAL}://${_REPO_URL}/${_ONEDIR_NIGHTLY_DIR}/${__PY_VERSION_REPO}/ubuntu/${UBUNTU_VERSION}/${__REPO_ARCH}/"
+    fi
+
+    # Download the key this revision uses first while the packages below install
+    if [ "$(echo "${ONEDIR_REV}" | grep -E '(3004|3005|latest|nightly)')" != "" ]; then
+        __prefetch_url "${SALTSTACK_UBUNTU_URL}salt-archive-keyring.gpg"
+    else
+        __prefetch_url "${SALTSTACK_UBUNTU_URL}SALT-PROJECT-GPG-PUBKEY-2023.gpg"
+    fi
+
     # Install downloader backend for GPG keys fetching
     __PACKAGES='wget'
 
@@ -3138,20 +4393,8 @@ __install_saltstack_ubuntu_onedir_repository() {
         __PACKAGES="${__PACKAGES} apt-transport-https ca-certificates"
     fi
 
-    # shellcheck disable=SC2086,SC2090
-    __apt_get_install_noinput ${__PACKAGES} || return 1
-
-    __PY_VERSION_REPO="apt"
-    if [ -n "$_PY_EXE" ] && [ "$_PY_MAJOR_VERSION" -eq 3 ]; then
-        __PY_VERSION_REPO="py3"
-    fi
-
-    # SaltStack's stable Ubuntu repository:
-    SALTSTACK_UBUNTU_URL="${HTTP_VAL}://${_REPO_URL}/${_ONEDIR_DIR}/${__PY_VERSION_REPO}/ubuntu/${UBUNTU_VERSION}/${__REPO_ARCH}/${ONEDIR_REV}/"
-    if [ "${ONEDIR_REV}" = "nightly" ] ; then
-        SALTSTACK_UBUNTU_URL="${HTTP_VAL}://${_REPO_URL}/${_ONEDIR_NIGHTLY_DIR}/${__PY_VERSION_REPO}/ubuntu/${UBUNTU_VERSION}/${__REPO_ARCH}/"
-    fi
-    echo "$__REPO_ARCH_DEB $SALTSTACK_UBUNTU_URL $UBUNTU_CODENAME main" > /etc/apt/sources.list.d/salt.list
+    # shellcheck disable=SC2086,SC2090
+    __apt_get_install_noinput ${__PACKAGES} || return 1
 
     if [ "$(echo "${ONEDIR_REV}" | grep -E '(3004|3005)')" != "" ]; then
       __apt_key_fetch "${SALTSTACK_UBUNTU_URL}salt-archive-keyring.gpg" || return 1
@@ -3162,6 +4405,9 @@ __install_saltstack_ubuntu_onedir_repository() {
       __apt_key_fetch "${SALTSTACK_UBUNTU_URL}SALT-PROJECT-GPG-PUBKEY-2023.gpg" || return 1
     fi
 
+    # Point the source at the mirror the key was fetched from, it might have failed over to another one
+    echo "$__REPO_ARCH_DEB $(__repo_mirror_url "$SALTSTACK_UBUNTU_URL") $UBUNTU_CODENAME main" > /etc/apt/sources.list.d/salt.list
+
     __wait_for_apt apt-get update || return 1
 }
 
@@ -3222,7 +4468,7 @@ install_ubuntu_deps() {
 }
 
 install_ubuntu_stable_deps() {
-    if [ "${_SLEEP}" -eq "${__DEFAULT_SLEEP}" ] && [ "$DISTRO_MAJOR_VERSION" -lt 16 ]; then
+    if [ "$_SLEEP_PASSED" -eq $BS_FALSE ] && [ "$DISTRO_MAJOR_VERSION" -lt 16 ]; then
         # The user did not pass a custom sleep value as an argument, let's increase the default value
         echodebug "On Ubuntu systems we increase the default sleep value to 10."
         echodebug "See https://github.com/saltstack/salt/issues/12248 for more info."
@@ -3270,7 +4516,7 @@ install_ubuntu_git_deps() {
         __apt_get_install_noinput ca-certificates
     fi
 
-    __git_clone_and_checkout || return 1
+    __timed git_clone __git_clone_and_checkout || return 1
 
     if [ -n "$_PY_EXE" ] && [ "$_PY_MAJOR_VERSION" -eq 3 ]; then
         PY_PKG_VER=3
@@ -3338,7 +4584,7 @@ install_ubuntu_git_deps() {
 }
 
 install_ubuntu_onedir_deps() {
-    if [ "${_SLEEP}" -eq "${__DEFAULT_SLEEP}" ] && [ "$DISTRO_MAJOR_VERSION" -lt 16 ]; then
+    if [ "$_SLEEP_PASSED" -eq $BS_FALSE ] && [ "$DISTRO_MAJOR_VERSION" -lt 16 ]; then
         # The user did not pass a custom sleep value as an argument, let's increase the default value
         echodebug "On Ubuntu systems we increase the default sleep value to 10."
         echodebug "See https://github.com/saltstack/salt/issues/12248 for more info."
@@ -3643,6 +4889,12 @@ __install_saltstack_debian_repository() {
         __PY_VERSION_REPO="py3"
     fi
 
+    # amd64 is just a part of repository URI, 32-bit pkgs are hosted under the same location
+    SALTSTACK_DEBIAN_URL="${HTTP_VAL}://${_REPO_URL}/${__PY_VERSION_REPO}/debian/${DEBIAN_RELEASE}/${__REPO_ARCH}"
+
+    # Download the key while the packages below install
+    __prefetch_url "$SALTSTACK_DEBIAN_URL/SALT-PROJECT-GPG-PUBKEY-2023.gpg"
+
     # Install downloader backend for GPG keys fetching
     __PACKAGES='wget'
 
@@ -3659,12 +4911,11 @@ __install_saltstack_debian_repository() {
     # shellcheck disable=SC2086,SC2090
     __apt_get_install_noinput ${__PACKAGES} || return 1
 
-    # amd64 is just a part of repository URI, 32-bit pkgs are hosted under the same location
-    SALTSTACK_DEBIAN_URL="${HTTP_VAL}://${_REPO_URL}/${__PY_VERSION_REPO}/debian/${DEBIAN_RELEASE}/${__REPO_ARCH}"
-    echo "$__REPO_ARCH_DEB $SALTSTACK_DEBIAN_URL $DEBIAN_CODENAME main" > "/etc/apt/sources.list.d/salt.list"
-
     __apt_key_fetch "$SALTSTACK_DEBIAN_URL/SALT-PROJECT-GPG-PUBKEY-2023.gpg" || return 1
 
+    # Point the source at the mirror the key was fetched from, it might have failed over to another one
+    echo "$__REPO_ARCH_DEB $(__repo_mirror_url "$SALTSTACK_DEBIAN_URL") $DEBIAN_CODENAME main" > "/etc/apt/sources.list.d/salt.list"
+
     __wait_for_apt apt-get update || return 1
 }
 
@@ -3677,6 +4928,19 @@ __install_saltstack_debian_onedir_repository() {
         __PY_VERSION_REPO="py3"
     fi
 
+    # amd64 is just a part of repository URI, 32-bit pkgs are hosted under the same location
+    SALTSTACK_DEBIAN_URL="${HTTP_VAL}://${_REPO_URL}/${_ONEDIR_DIR}/${__PY_VERSION_REPO}/debian/${DEBIAN_RELEASE}/${__REPO_ARCH}/${ONEDIR_REV}/"
+    if [ "${ONEDIR_REV}" = "nightly" ] ; then
+        SALTSTACK_DEBIAN_URL="${HTTP_VAL}://${_REPO_URL}/${_ONEDIR_NIGHTLY_DIR}/${__PY_VERSION_REPO}/debian/${DEBIAN_RELEASE}/${__REPO_ARCH}/"
+    fi
+
+    # Download the key this revision uses first while the packages below install
+    if [ "$(echo "${ONEDIR_REV}" | grep -E '(3004|3005|latest|nightly)')" != "" ]; then
+        __prefetch_url "${SALTSTACK_DEBIAN_URL}salt-archive-keyring.gpg"
+    else
+        __prefetch_url "${SALTSTACK_DEBIAN_URL}SALT-PROJECT-GPG-PUBKEY-2023.gpg"
+    fi
+
     # Install downloader backend for GPG keys fetching
     __PACKAGES='wget'
 
@@ -3693,13 +4957,6 @@ __install_saltstack_debian_onedir_repository() {
     # shellcheck disable=SC2086,SC2090
     __apt_get_install_noinput ${__PACKAGES} || return 1
 
-    # amd64 is just a part of repository URI, 32-bit pkgs are hosted under the same location
-    SALTSTACK_DEBIAN_URL="${HTTP_VAL}://${_REPO_URL}/${_ONEDIR_DIR}/${__PY_VERSION_REPO}/debian/${DEBIAN_RELEASE}/${__REPO_ARCH}/${ONEDIR_REV}/"
-    if [ "${ONEDIR_REV}" = "nightly" ] ; then
-        SALTSTACK_DEBIAN_URL="${HTTP_VAL}://${_REPO_URL}/${_ONEDIR_NIGHTLY_DIR}/${__PY_VERSION_REPO}/debian/${DEBIAN_RELEASE}/${__REPO_ARCH}/"
-    fi
-    echo "$__REPO_ARCH_DEB $SALTSTACK_DEBIAN_URL $DEBIAN_CODENAME main" > "/etc/apt/sources.list.d/salt.list"
-
     if [ "$(echo "${ONEDIR_REV}" | grep -E '(3004|3005)')" != "" ]; then
       __apt_key_fetch "${SALTSTACK_DEBIAN_URL}salt-archive-keyring.gpg" || return 1
     elif [ "$(echo "${ONEDIR_REV}" | grep -E '(latest|nightly)')" != "" ]; then
@@ -3709,6 +4966,9 @@ __install_saltstack_debian_onedir_repository() {
       __apt_key_fetch "${SALTSTACK_DEBIAN_URL}SALT-PROJECT-GPG-PUBKEY-2023.gpg" || return 1
     fi
 
+    # Point the source at the mirror the key was fetched from, it might have failed over to another one
+    echo "$__REPO_ARCH_DEB $(__repo_mirror_url "$SALTSTACK_DEBIAN_URL") $DEBIAN_CODENAME main" > "/etc/apt/sources.list.d/salt.list"
+
     __wait_for_apt apt-get update || return 1
 }
 
@@ -3827,7 +5087,7 @@ install_debian_git_pre() {
         __apt_get_install_noinput ca-certificates
     fi
 
-    __git_clone_and_checkout || return 1
+    __timed git_clone __git_clone_and_checkout || return 1
 
     # Let's trigger config_salt()
     if [ "$_TEMP_CONFIG_DIR" = "null" ]; then
@@ -3893,7 +5153,7 @@ install_debian_8_git_deps() {
         __apt_get_install_noinput ca-certificates
     fi
 
-    __git_clone_and_checkout || return 1
+    __timed git_clone __git_clone_and_checkout || return 1
 
     __PACKAGES="libzmq3 libzmq3-dev lsb-release python-apt python-crypto python-jinja2"
     __PACKAGES="${__PACKAGES} python-m2crypto python-msgpack python-requests python-systemd"
@@ -4266,6 +5526,9 @@ __install_saltstack_fedora_onedir_repository() {
             FETCH_URL="${HTTP_VAL}://${_REPO_URL}/${_ONEDIR_NIGHTLY_DIR}/${__PY_VERSION_REPO}/fedora/${DISTRO_MAJOR_VERSION}/${CPU_ARCH_L}/"
         fi
 
+        # Download the repository file and the key at once
+        __prefetch_url "${FETCH_URL}.repo" "${FETCH_URL}/${GPG_KEY}"
+
         __fetch_url "${REPO_FILE}" "${FETCH_URL}.repo"
 
         __rpm_import_gpg "${FETCH_URL}/${GPG_KEY}" || return 1
@@ -4401,7 +5664,7 @@ install_fedora_git_deps() {
         __PACKAGES=""
     fi
 
-    __git_clone_and_checkout || return 1
+    __timed git_clone __git_clone_and_checkout || return 1
 
     if [ "${_POST_NEON_INSTALL}" -eq $BS_FALSE ]; then
 
@@ -4658,14 +5921,25 @@ __install_saltstack_rhel_repository() {
         gpg_key="SALTSTACK-GPG-KEY.pub"
     fi
 
-    gpg_key_urls=""
-    for key in $gpg_key; do
-        gpg_key_urls=$(printf "${base_url}${key},%s" "$gpg_key_urls")
-    done
-
     repo_file="/etc/yum.repos.d/salt.repo"
 
     if [ ! -s "$repo_file" ] || [ "$_FORCE_OVERWRITE" -eq $BS_TRUE ]; then
+        fetch_url="${HTTP_VAL}://${_REPO_URL}/${__PY_VERSION_REPO}/redhat/${DISTRO_MAJOR_VERSION}/${CPU_ARCH_L}/${repo_rev}/"
+        # Download all the keys at once
+        for key in $gpg_key; do
+            __prefetch_url "${fetch_url}${key}"
+        done
+        for key in $gpg_key; do
+            __rpm_import_gpg "${fetch_url}${key}" || return 1
+        done
+
+        # Point the repository at the mirror the keys were fetched from, it might have failed over to another one
+        base_url=$(__repo_mirror_url "$base_url")
+        gpg_key_urls=""
+        for key in $gpg_key; do
+            gpg_key_urls=$(printf "${base_url}${key},%s" "$gpg_key_urls")
+        done
+
         cat <<_eof > "$repo_file"
 [saltstack]
 name=SaltStack ${repo_rev} Release Channel for RHEL/CentOS \$releasever
@@ -4677,11 +5951,6 @@ enabled=1
 enabled_metadata=1
 _eof
 
-        fetch_url="${HTTP_VAL}://${_REPO_URL}/${__PY_VERSION_REPO}/redhat/${DISTRO_MAJOR_VERSION}/${CPU_ARCH_L}/${repo_rev}/"
-        for key in $gpg_key; do
-            __rpm_import_gpg "${fetch_url}${key}" || return 1
-        done
-
         yum clean metadata || return 1
     elif [ "$repo_rev" != "latest" ]; then
         echowarn "salt.repo already exists, ignoring salt version argument."
@@ -4719,14 +5988,28 @@ __install_saltstack_rhel_onedir_repository() {
         gpg_key="SALT-PROJECT-GPG-PUBKEY-2023.pub"
     fi
 
-    gpg_key_urls=""
-    for key in $gpg_key; do
-        gpg_key_urls=$(printf "${base_url}${key},%s" "$gpg_key_urls")
-    done
-
     repo_file="/etc/yum.repos.d/salt.repo"
 
     if [ ! -s "$repo_file" ] || [ "$_FORCE_OVERWRITE" -eq $BS_TRUE ]; then
+        fetch_url="${HTTP_VAL}://${_REPO_URL}/${_ONEDIR_DIR}/${__PY_VERSION_REPO}/redhat/${DISTRO_MAJOR_VERSION}/${CPU_ARCH_L}/${ONEDIR_REV}/"
+        if [ "${ONEDIR_REV}" = "nightly" ] ; then
+            fetch_url="${HTTP_VAL}://${_REPO_URL}/${_ONEDIR_NIGHTLY_DIR}/${__PY_VERSION_REPO}/redhat/${DISTRO_MAJOR_VERSION}/${CPU_ARCH_L}/"
+        fi
+        # Download all the keys at once
+        for key in $gpg_key; do
+            __prefetch_url "${fetch_url}${key}"
+        done
+        for key in $gpg_key; do
+            __rpm_import_gpg "${fetch_url}${key}" || return 1
+        done
+
+        # Point the repository at the mirror the keys were fetched from, it might have failed over to another one
+        base_url=$(__repo_mirror_url "$base_url")
+        gpg_key_urls=""
+        for key in $gpg_key; do
+            gpg_key_urls=$(printf "${base_url}${key},%s" "$gpg_key_urls")
+        done
+
         cat <<_eof > "$repo_file"
 [saltstack]
 name=SaltStack ${repo_rev} Release Channel for RHEL/CentOS \$releasever
@@ -4738,14 +6021,6 @@ enabled=1
 enabled_metadata=1
 _eof
 
-        fetch_url="${HTTP_VAL}://${_REPO_URL}/${_ONEDIR_DIR}/${__PY_VERSION_REPO}/redhat/${DISTRO_MAJOR_VERSION}/${CPU_ARCH_L}/${ONEDIR_REV}/"
-        if [ "${ONEDIR_REV}" = "nightly" ] ; then
-            fetch_url="${HTTP_VAL}://${_REPO_URL}/${_ONEDIR_NIGHTLY_DIR}/${__PY_VERSION_REPO}/redhat/${DISTRO_MAJOR_VERSION}/${CPU_ARCH_L}/"
-        fi
-        for key in $gpg_key; do
-            __rpm_import_gpg "${fetch_url}${key}" || return 1
-        done
-
         yum clean metadata || return 1
     elif [ "$repo_rev" != "latest" ]; then
         echowarn "salt.repo already exists, ignoring salt version argument."
@@ -4901,7 +6176,7 @@ install_centos_git_deps() {
         __yum_install_noinput git || return 1
     fi
 
-    __git_clone_and_checkout || return 1
+    __timed git_clone __git_clone_and_checkout || return 1
 
     __PACKAGES=""
 
@@ -5972,7 +7247,7 @@ install_alpine_linux_git_deps() {
         apk -U add git  || return 1
     fi
 
-    __git_clone_and_checkout || return 1
+    __timed git_clone __git_clone_and_checkout || return 1
 
     if [ "${_POST_NEON_INSTALL}" -eq $BS_FALSE ]; then
         apk -U add python2 py-virtualenv py2-crypto py2-m2crypto py2-setuptools \
@@ -6164,6 +7439,7 @@ install_amazon_linux_ami_deps() {
     fi
 
     if [ $_DISABLE_REPOS -eq $BS_FALSE ] || [ "$_CUSTOM_REPO_URL" != "null" ]; then
+        __use_repo_mirrors || return 1
         __REPO_FILENAME="salt.repo"
 
         # Set a few vars to make life easier.
@@ -6234,7 +7510,7 @@ install_amazon_linux_ami_git_deps() {
         __yum_install_noinput git || return 1
     fi
 
-    __git_clone_and_checkout || return 1
+    __timed git_clone __git_clone_and_checkout || return 1
 
     if [ "${_POST_NEON_INSTALL}" -eq $BS_FALSE ]; then
         __PACKAGES=""
@@ -6303,7 +7579,7 @@ install_amazon_linux_ami_2_git_deps() {
         __yum_install_noinput git || return 1
     fi
 
-    __git_clone_and_checkout || return 1
+    __timed git_clone __git_clone_and_checkout || return 1
 
     if [ "${_POST_NEON_INSTALL}" -eq $BS_FALSE ]; then
 
@@ -6399,6 +7675,7 @@ install_amazon_linux_ami_2_deps() {
     fi
 
     if [ $_DISABLE_REPOS -eq $BS_FALSE ] || [ "$_CUSTOM_REPO_URL" != "null" ]; then
+        __use_repo_mirrors || return 1
         __REPO_FILENAME="salt.repo"
         __PY_VERSION_REPO="yum"
         PY_PKG_VER=""
@@ -6485,6 +7762,7 @@ install_amazon_linux_ami_2_onedir_deps() {
     fi
 
     if [ $_DISABLE_REPOS -eq $BS_FALSE ] || [ "$_CUSTOM_REPO_URL" != "null" ]; then
+        __use_repo_mirrors || return 1
         __REPO_FILENAME="salt.repo"
         __PY_VERSION_REPO="yum"
         PY_PKG_VER=""
@@ -6693,7 +7971,7 @@ install_arch_linux_git_deps() {
         pacman -Sy --noconfirm --needed git  || return 1
     fi
 
-    __git_clone_and_checkout || return 1
+    __timed git_clone __git_clone_and_checkout || return 1
 
     if [ "${_POST_NEON_INSTALL}" -eq $BS_FALSE ]; then
         pacman -R --noconfirm python2-distribute
@@ -6926,10 +8204,13 @@ __install_saltstack_photon_onedir_repository() {
             FETCH_URL="${HTTP_VAL}://${_REPO_URL}/${_ONEDIR_NIGHTLY_DIR}/${__PY_VERSION_REPO}/photon/${DISTRO_MAJOR_VERSION}/${CPU_ARCH_L}/"
         fi
 
-        __fetch_url "${REPO_FILE}" "${FETCH_URL}.repo"
-
         GPG_KEY="SALT-PROJECT-GPG-PUBKEY-2023.pub"
 
+        # Download the repository file and the key at once
+        __prefetch_url "${FETCH_URL}.repo" "${FETCH_URL}/${GPG_KEY}"
+
+        __fetch_url "${REPO_FILE}" "${FETCH_URL}.repo"
+
         __rpm_import_gpg "${FETCH_URL}/${GPG_KEY}" || return 1
 
         tdnf makecache || return 1
@@ -7006,7 +8287,7 @@ install_photon_git_deps() {
         __PACKAGES=""
     fi
 
-    __git_clone_and_checkout || return 1
+    __timed git_clone __git_clone_and_checkout || return 1
 
     if [ "${_POST_NEON_INSTALL}" -eq $BS_FALSE ]; then
 
@@ -7245,7 +8526,7 @@ install_freebsd_git_deps() {
     if ! __check_command_exists git; then
         /usr/local/sbin/pkg install -y git || return 1
     fi
-    __git_clone_and_checkout || return 1
+    __timed git_clone __git_clone_and_checkout || return 1
 
     if [ "${_POST_NEON_INSTALL}" -eq $BS_FALSE ]; then
 
@@ -7435,7 +8716,7 @@ install_openbsd_git_deps() {
     if ! __check_command_exists git; then
         pkg_add -I -v git || return 1
     fi
-    __git_clone_and_checkout || return 1
+    __timed git_clone __git_clone_and_checkout || return 1
 
     if [ "${_POST_NEON_INSTALL}" -eq $BS_TRUE ]; then
         pkg_add -I -v py3-pip py3-setuptools
@@ -7587,7 +8868,7 @@ install_smartos_git_deps() {
         pkgin -y install git || return 1
     fi
 
-    __git_clone_and_checkout || return 1
+    __timed git_clone __git_clone_and_checkout || return 1
 
     if [ "${_POST_NEON_INSTALL}" -eq $BS_FALSE ]; then
 
@@ -7791,12 +9072,13 @@ __version_lte() {
 }
 
 __zypper() {
+    # Install the planned packages before the package sources change
+    __pkg_plan_flush || return 1
+
     # Check if any zypper process is running before calling zypper again.
     # This is useful when a zypper call is part of a boot process and will
     # wait until the zypper process is finished, such as on AWS AMIs.
-    while pgrep -l zypper; do
-        sleep 1
-    done
+    __wait_for_pkg_lock zypp || return 1
 
     zypper --non-interactive "${@}"
     # Return codes between 100 and 104 are only informations, not errors
@@ -7808,6 +9090,9 @@ __zypper() {
 }
 
 __zypper_install() {
+    __pkg_plan_add __zypper_install "${@}" && return 0
+    __pkg_plan_flush || return 1
+
     if [ "${__ZYPPER_REQUIRES_REPLACE_FILES}" = "-1" ]; then
         __version_lte "1.10.4" "$(zypper --version | awk '{ print $2 }')"
     fi
@@ -7880,7 +9165,7 @@ install_opensuse_git_deps() {
         __zypper_install git  || return 1
     fi
 
-    __git_clone_and_checkout || return 1
+    __timed git_clone __git_clone_and_checkout || return 1
 
     if [ "${_POST_NEON_INSTALL}" -eq $BS_FALSE ]; then
         __zypper_install patch || return 1
@@ -8122,7 +9407,7 @@ install_opensuse_15_git_deps() {
         __zypper_install git  || return 1
     fi
 
-    __git_clone_and_checkout || return 1
+    __timed git_clone __git_clone_and_checkout || return 1
 
     if [ -n "$_PY_EXE" ] && [ "$_PY_MAJOR_VERSION" -eq 2 ]; then
         PY_PKG_VER=2
@@ -8311,7 +9596,7 @@ install_suse_12_git_deps() {
         __zypper_install git-core  || return 1
     fi
 
-    __git_clone_and_checkout || return 1
+    __timed git_clone __git_clone_and_checkout || return 1
 
     __PACKAGES=""
     # shellcheck disable=SC2089
@@ -8422,7 +9707,7 @@ install_suse_11_git_deps() {
         __zypper_install git  || return 1
     fi
 
-    __git_clone_and_checkout || return 1
+    __timed git_clone __git_clone_and_checkout || return 1
 
     __PACKAGES=""
     # shellcheck disable=SC2089
@@ -8685,7 +9970,7 @@ install_gentoo_git_deps() {
     echoinfo "Running emerge -v1 setuptools"
     __emerge -v1 setuptools || return 1
 
-    __git_clone_and_checkout || return 1
+    __timed git_clone __git_clone_and_checkout || return 1
     __gentoo_post_dep || return 1
 }
 
@@ -8973,6 +10258,7 @@ daemons_running_voidlinux() {
 #
 
 __macosx_get_packagesite() {
+    __use_repo_mirrors || return 1
     DARWIN_ARCH="x86_64"
 
     __PY_VERSION_REPO="py2"
@@ -8984,23 +10270,53 @@ __macosx_get_packagesite() {
     SALTPKGCONFURL="https://${_REPO_URL}/osx/${PKG}"
 }
 
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __macosx_fetch_repo_json
+#   DESCRIPTION:  Download the repo.json listing the macOS onedir packages, once, into _MACOS_REPO_JSON
+#----------------------------------------------------------------------------------------------------------------------
+__macosx_fetch_repo_json() {
+    [ "$_MACOS_REPO_JSON" != "null" ] && return 0
+
+    repo_json=$(mktemp /tmp/salt-repo-json.XXXXXX) || return 1
+    if ! __fetch_url "$repo_json" "${HTTP_VAL}://${_REPO_URL}/${_ONEDIR_DIR}/${__PY_VERSION_REPO}/macos/repo.json"; then
+        rm -f "$repo_json"
+        echoerror "Failed to download the list of the macOS packages"
+        return 1
+    fi
+    _MACOS_REPO_JSON="$repo_json"
+    return 0
+}
+
 __parse_repo_json_python() {
 
   # Using latest, grab the right
   # version from the repo.json
-  _JSON_VERSION=$(python - <<-EOF
-import json, urllib.request
-url = "https://repo.saltproject.io/salt/py3/macos/repo.json"
-response = urllib.request.urlopen(url)
-data = json.loads(response.read())
+  "${_PY_EXE:-python3}" - "$_MACOS_REPO_JSON" <<-EOF
+import json, sys
+with open(sys.argv[1]) as rfh:
+    data = json.load(rfh)
 version = data["${_ONEDIR_REV}"][list(data["${_ONEDIR_REV}"])[0]]['version']
 print(version)
 EOF
-)
-echo "${_JSON_VERSION}"
+}
+
+__parse_repo_json_sha256_python() {
+
+  # The SHA256 sum of the package, as listed in the repo.json,
+  # or nothing if it's not listed there
+  "${_PY_EXE:-python3}" - "$_MACOS_REPO_JSON" <<-EOF
+import json, sys
+with open(sys.argv[1]) as rfh:
+    data = json.load(rfh)
+for release in ("${_ONEDIR_REV}", "${_PKG_VERSION}"):
+    if "${PKG}" in data.get(release, {}):
+        print(data[release]["${PKG}"].get("SHA256", ""))
+        break
+EOF
 }
 
 __macosx_get_packagesite_onedir() {
+    __use_repo_mirrors || return 1
     DARWIN_ARCH="x86_64"
 
     __PY_VERSION_REPO="py2"
@@ -9008,19 +10324,27 @@ __macosx_get_packagesite_onedir() {
         __PY_VERSION_REPO="py3"
     fi
 
-    if [ "$(echo "$_ONEDIR_REV" | grep -E '^(latest)$')" != "" ]; then
-      _PKG_VERSION=$(__parse_repo_json_python)
-    elif [ "$(echo "$_ONEDIR_REV" | grep -E '^([3-9][0-9]{3}(\.[0-9]*))')" != "" ]; then
+    __macosx_fetch_repo_json || return 1
+
+    if [ "$(echo "$_ONEDIR_REV" | grep -E '^([3-9][0-9]{3}(\.[0-9]*))')" != "" ]; then
       _PKG_VERSION=$_ONEDIR_REV
-    else
-      _PKG_VERSION=$(__parse_repo_json_python)
+    elif ! _PKG_VERSION=$(__parse_repo_json_python) || [ "$_PKG_VERSION" = "" ]; then
+      echoerror "Failed to find the ${_ONEDIR_REV} Salt version in the list of the macOS packages"
+      return 1
     fi
     if [ "$(echo "$_ONEDIR_REV" | grep -E '^(3005)')" != "" ]; then
       PKG="salt-${_PKG_VERSION}-macos-${DARWIN_ARCH}.pkg"
     else
       PKG="salt-${_PKG_VERSION}-${__PY_VERSION_REPO}-${DARWIN_ARCH}.pkg"
     fi
-    SALTPKGCONFURL="https://${_REPO_URL}/${_ONEDIR_DIR}/${__PY_VERSION_REPO}/macos/${ONEDIR_REV}/${PKG}"
+    SALTPKGCONFURL="${HTTP_VAL}://${_REPO_URL}/${_ONEDIR_DIR}/${__PY_VERSION_REPO}/macos/${ONEDIR_REV}/${PKG}"
+    if ! SALTPKGSHA256=$(__parse_repo_json_sha256_python); then
+      echoerror "Failed to read the SHA256 sum of ${PKG} from the list of the macOS packages"
+      return 1
+    fi
+    if [ "$SALTPKGSHA256" = "" ]; then
+      echowarn "${PKG} is not listed with a SHA256 sum, its download can't be verified"
+    fi
 }
 
 # Using a separate conf step to head for idempotent install...
@@ -9063,7 +10387,7 @@ install_macosx_git_deps() {
     # Install PIP
     $_PYEXE /tmp/get-pip.py || return 1
 
-    __git_clone_and_checkout || return 1
+    __timed git_clone __git_clone_and_checkout || return 1
 
     if [ "${_POST_NEON_INSTALL}" -eq $BS_TRUE ]; then
         return 0
@@ -9093,7 +10417,7 @@ install_macosx_stable() {
 install_macosx_onedir() {
     install_macosx_onedir_deps || return 1
 
-    __fetch_url "/tmp/${PKG}" "${SALTPKGCONFURL}" || return 1
+    __fetch_url "/tmp/${PKG}" "${SALTPKGCONFURL}" "${SALTPKGSHA256:-}" || return 1
 
     /usr/sbin/installer -pkg "/tmp/${PKG}" -target / || return 1
 
@@ -9176,7 +10500,7 @@ config_salt() {
     # If the configuration directory is not passed, return
     [ "$_TEMP_CONFIG_DIR" = "null" ] && return
 
-    if [ "$_CONFIG_ONLY" -eq $BS_TRUE ]; then
+    if [ "$_CONFIG_ONLY" -eq $BS_TRUE ] && [ "$_BOOTSTRAP_MODE" != "personalize" ]; then
         echowarn "Passing -C (config only) option implies -F (forced overwrite)."
 
         if [ "$_FORCE_OVERWRITE" -ne $BS_TRUE ]; then
@@ -9315,6 +10639,8 @@ config_salt() {
 
     if [ "$_CONFIG_ONLY" -eq $BS_TRUE ] && [ $CONFIGURED_ANYTHING -eq $BS_FALSE ]; then
         echowarn "No configuration or keys were copied over. No configuration was done!"
+        # A personalized image still has its daemons to enable and start
+        [ "$_BOOTSTRAP_MODE" = "personalize" ] && return 0
         exit 0
     fi
 
@@ -9360,6 +10686,154 @@ preseed_master() {
 #
 #######################################################################################################################
 
+#######################################################################################################################
+#
+#   Daemons readiness functions
+#
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __check_daemon_running
+#   DESCRIPTION:  Check if a Salt daemon is running, through systemd if it manages the daemon, its pid file or its
+#                 process, be it a onedir or a regular installation.
+#    PARAMETERS:  daemon name, i.e. master, minion or syndic
+#----------------------------------------------------------------------------------------------------------------------
+__check_daemon_running() {
+    if [ -d /run/systemd/system ] && systemctl is-active --quiet "salt-${1}.service" 2>/dev/null; then
+        return 0
+    fi
+
+    for pid_file in "/var/run/salt-${1}.pid" "/run/salt-${1}.pid"; do
+        if [ -s "$pid_file" ] && kill -0 "$(cat "$pid_file")" 2>/dev/null; then
+            return 0
+        fi
+    done
+
+    if [ -f "/opt/saltstack/salt/run/run" ]; then
+        salt_path="/opt/saltstack/salt/run/run ${1}"
+    else
+        salt_path="salt-${1}"
+    fi
+    if __check_command_exists pgrep; then
+        [ "$(pgrep -f "${salt_path}")" != "" ] && return 0
+    else
+        # shellcheck disable=SC2009
+        [ "$(ps wwwaux | grep -v grep | grep "${salt_path}")" != "" ] && return 0
+    fi
+
+    return 1
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __wait_for_daemons
+#   DESCRIPTION:  Poll the passed daemons running check function, backing off exponentially, until it succeeds twice
+#                 in a row, a second apart, or BS_DAEMONS_READY_TIMEOUT seconds have passed.
+#    PARAMETERS:  daemons running check function
+#----------------------------------------------------------------------------------------------------------------------
+__wait_for_daemons() {
+    wait_deadline=$(( $(__monotonic_ms) + _DAEMONS_READY_TIMEOUT * 1000 ))
+    wait_delay_ms=250
+    wait_confirmed=$BS_FALSE
+
+    while :; do
+        if "$1" >/dev/null 2>&1; then
+            [ "$wait_confirmed" -eq $BS_TRUE ] && break
+            # A daemon crashing right after it started passes a single check, systemd reports
+            # it active as soon as it's forked
+            wait_confirmed=$BS_TRUE
+            echodebug "The Salt daemons are running, checking again in 1s that they stay up"
+            sleep 1
+            continue
+        fi
+        wait_confirmed=$BS_FALSE
+
+        wait_remaining_ms=$(( wait_deadline - $(__monotonic_ms) ))
+        if [ "$wait_remaining_ms" -le 0 ]; then
+            echowarn "The Salt daemons are not running after ${_DAEMONS_READY_TIMEOUT} seconds"
+            return 1
+        fi
+        if [ "$wait_delay_ms" -gt "$wait_remaining_ms" ]; then
+            wait_delay_ms=$wait_remaining_ms
+        fi
+        echodebug "The Salt daemons are not running yet, checking again in ${wait_delay_ms}ms"
+        # Not every sleep implementation takes fractions of a second
+        sleep "$((wait_delay_ms / 1000)).$(printf '%03d' $((wait_delay_ms % 1000)))" 2>/dev/null || sleep 1
+        if [ "$wait_delay_ms" -lt 4000 ]; then
+            wait_delay_ms=$((wait_delay_ms * 2))
+        fi
+    done
+
+    echodebug "The Salt daemons are running"
+    return 0
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __salt_daemons
+#   DESCRIPTION:  Print the Salt daemons being bootstrapped, one per line
+#----------------------------------------------------------------------------------------------------------------------
+__salt_daemons() {
+    [ "$_INSTALL_MASTER" -eq $BS_TRUE ] && echo master
+    [ "$_INSTALL_MINION" -eq $BS_TRUE ] && echo minion
+    [ "$_INSTALL_SYNDIC" -eq $BS_TRUE ] && echo syndic
+    return 0
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __prepare_image
+#   DESCRIPTION:  Stop the Salt daemons, which some packages start on install, keep them from starting on boot and
+#                 remove the identity they generated meanwhile: the minion id, the keys and the accepted minion keys.
+#                 Every host started from the image gets its own in the personalize mode.
+#----------------------------------------------------------------------------------------------------------------------
+__prepare_image() {
+    for fname in $(__salt_daemons); do
+        if __check_command_exists systemctl; then
+            systemctl stop "salt-${fname}.service" >/dev/null 2>&1
+            systemctl disable "salt-${fname}.service" >/dev/null 2>&1
+        elif [ -f "/etc/init.d/salt-${fname}" ]; then
+            "/etc/init.d/salt-${fname}" stop >/dev/null 2>&1
+            if __check_command_exists update-rc.d; then
+                update-rc.d -f "salt-${fname}" remove >/dev/null 2>&1
+            elif __check_command_exists chkconfig; then
+                chkconfig "salt-${fname}" off >/dev/null 2>&1
+            fi
+        fi
+    done
+
+    rm -f "${_SALT_ETC_DIR}/minion_id" "${_SALT_ETC_DIR}/minion.d/99-master-address.conf" \
+        "${_PKI_DIR}/minion/minion.pem" "${_PKI_DIR}/minion/minion.pub" "${_PKI_DIR}/minion/minion_master.pub" \
+        "${_PKI_DIR}/master/master.pem" "${_PKI_DIR}/master/master.pub" || return 1
+    for keys_dir in minions minions_pre minions_rejected minions_denied; do
+        [ -d "${_PKI_DIR}/master/${keys_dir}" ] || continue
+        find "${_PKI_DIR}/master/${keys_dir}" -type f -exec rm -f {} + || return 1
+    done
+    return 0
+}
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __enable_daemons
+#   DESCRIPTION:  Start the Salt daemons of a personalized image on boot again
+#----------------------------------------------------------------------------------------------------------------------
+__enable_daemons() {
+    for fname in $(__salt_daemons); do
+        if __check_command_exists systemctl; then
+            if ! systemctl enable "salt-${fname}.service" >/dev/null 2>&1; then
+                echoerror "Failed to enable salt-${fname}. Was the image prepared with the same -M, -N and -S options?"
+                return 1
+            fi
+        elif [ -f "/etc/init.d/salt-${fname}" ]; then
+            if __check_command_exists update-rc.d; then
+                update-rc.d "salt-${fname}" defaults >/dev/null 2>&1 || return 1
+            elif __check_command_exists chkconfig; then
+                chkconfig "salt-${fname}" on >/dev/null 2>&1 || return 1
+            fi
+        fi
+    done
+    return 0
+}
+#
+#   Ended daemons readiness functions
+#
+#######################################################################################################################
+
 #######################################################################################################################
 #
 #   This function checks if all of the installed daemons are running or not.
@@ -9377,14 +10851,8 @@ daemons_running_onedir() {
         [ $fname = "master" ] && [ "$_INSTALL_MASTER" -eq $BS_FALSE ] && continue
         [ $fname = "syndic" ] && [ "$_INSTALL_SYNDIC" -eq $BS_FALSE ] && continue
 
-        if [ -f "/opt/saltstack/salt/run/run" ]; then
-            salt_path="/opt/saltstack/salt/run/run ${fname}"
-        else
-            salt_path="salt-${fname}"
-        fi
-        process_running=$(pgrep -f "${salt_path}")
-        if [ "${process_running}" = "" ]; then
-            echoerror "${salt_path} was not found running"
+        if ! __check_daemon_running "${fname}"; then
+            echoerror "salt-${fname} was not found running"
             FAILED_DAEMONS=$((FAILED_DAEMONS + 1))
         fi
     done
@@ -9420,7 +10888,7 @@ daemons_running() {
                 echoerror "salt-$fname was not found running"
                 FAILED_DAEMONS=$((FAILED_DAEMONS + 1))
             fi
-        elif [ "$(ps wwwaux | grep -v grep | grep salt-$fname)" = "" ]; then
+        elif ! __check_daemon_running "${fname}"; then
             echoerror "salt-$fname was not found running"
             FAILED_DAEMONS=$((FAILED_DAEMONS + 1))
         fi
@@ -9433,6 +10901,136 @@ daemons_running() {
 #
 #######################################################################################################################
 
+#######################################################################################################################
+#
+#   Offline Bundle Install Functions
+#
+
+#---  FUNCTION  -------------------------------------------------------------------------------------------------------
+#          NAME:  __extract_offline_bundle
+#   DESCRIPTION:  Extract the offline bundle, verify its packages against the bundled checksums and import the
+#                 bundled signing keys.
+#----------------------------------------------------------------------------------------------------------------------
+__extract_offline_bundle() {
+    [ "$_OFFLINE_BUNDLE_DIR" != "null" ] && return 0
+
+    if [ -d "$_OFFLINE_BUNDLE" ]; then
+        _OFFLINE_BUNDLE_DIR="$_OFFLINE_BUNDLE"
+    else
+        _OFFLINE_BUNDLE_TMPDIR=$(mktemp -d /tmp/salt-bundle.XXXXXX) || return 1
+        echoinfo "Extracting the offline bundle $_OFFLINE_BUNDLE"
+        if ! tar -xzf "$_OFFLINE_BUNDLE" -C "$_OFFLINE_BUNDLE_TMPDIR"; then
+            echoerror "Failed to extract the offline bundle $_OFFLINE_BUNDLE"
+            return 1
+        fi
+        _OFFLINE_BUNDLE_DIR="$_OFFLINE_BUNDLE_TMPDIR"
+    fi
+
+    if [ ! -f "${_OFFLINE_BUNDLE_DIR}/manifest.json" ] || [ ! -f "${_OFFLINE_BUNDLE_DIR}/SHA256SUMS" ]; then
+        echoerror "$_OFFLINE_BUNDLE is not an offline bundle"
+        return 1
+    fi
+
+    _OFFLINE_BUNDLE_FORMAT=$(sed -n 's/^ *"format": "\([a-z]*\)".*/\1/p' "${_OFFLINE_BUNDLE_DIR}/manifest.json")
+    echodebug "Offline bundle manifest: $(tr -d '\n' < "${_OFFLINE_BUNDLE_DIR}/manifest.json" | tr -s ' ')"
+
+    if [ "$_OFFLINE_BUNDLE_FORMAT" = "deb" ] && ! __check_command_exists dpkg; then
+        echoerror "The offline bundle holds deb packages but dpkg is not available on ${DISTRO_NAME}"
+        return 1
+    elif [ "$_OFFLINE_BUNDLE_FORMAT" = "rpm" ] && ! __check_command_exists rpm; then
+        echoerror "The offline bundle holds rpm packages but rpm is not available on ${DISTRO_NAME}"
+        return 1
+    elif [ "$_OFFLINE_BUNDLE_FORMAT" != "deb" ] && [ "$_OFFLINE_BUNDLE_FORMAT" != "rpm" ]; then
+        echoerror "Unknown offline bundle package format: ${_OFFLINE_BUNDLE_FORMAT}"
+        return 1
+    fi
+
+    while read -r bundle_sum bundle_file; do
+        if [ "$(__sha256sum "${_OFFLINE_BUNDLE_DIR}/${bundle_file}")" != "$bundle_sum" ]; then
+            echoerror "${bundle_file} failed checksum verification, the offline bundle is corrupt"
+            return 1
+        fi
+    done < "${_OFFLINE_BUNDLE_DIR}/SHA256SUMS"
+
+    if [ "$_OFFLINE_BUNDLE_FORMAT" = "rpm" ]; then
+        for bundle_key in "${_OFFLINE_BUNDLE_DIR}"/keys/*; do
+            [ -f "$bundle_key" ] || continue
+            rpm --import "$bundle_key" || return 1
+        done
+    fi
+
+    return 0
+}
+
+install_offline_bundle_deps() {
+    __extract_offline_bundle || return 1
+
+    if [ "$_OFFLINE_BUNDLE_DISTRO_DEPS_FUNC" = "null" ]; then
+        echowarn "Don't know how to install the dependencies of Salt on ${DISTRO_NAME}, make sure they are installed"
+        return 0
+    fi
+
+    # Repositories are disabled, this only installs the packages the onedir ones expect
+    # from the distribution, together with the extra packages
+    echoinfo "Installing the distribution dependencies with ${_OFFLINE_BUNDLE_DISTRO_DEPS_FUNC}"
+    $_OFFLINE_BUNDLE_DISTRO_DEPS_FUNC || return 1
+
+    return 0
+}
+
+install_offline_bundle() {
+    __extract_offline_bundle || return 1
+
+    __PACKAGES=""
+    for bundle_pkg in "${_OFFLINE_BUNDLE_DIR}"/packages/*; do
+        [ -f "$bundle_pkg" ] || continue
+
+        if [ "$_OFFLINE_BUNDLE_FORMAT" = "deb" ]; then
+            bundle_pkg_name=$(dpkg-deb -f "$bundle_pkg" Package)
+        else
+            bundle_pkg_name=$(rpm -qp --qf '%{NAME}' "$bundle_pkg" 2>/dev/null)
+        fi
+
+        # Skip if not meant to be installed
+        case "$bundle_pkg_name" in
+            salt-minion)       [ "$_INSTALL_MINION" -eq $BS_FALSE ] && continue ;;
+            salt-syndic)       [ "$_INSTALL_SYNDIC" -eq $BS_FALSE ] && continue ;;
+            salt-cloud)        [ "$_INSTALL_CLOUD" -eq $BS_FALSE ] && continue ;;
+            salt-master|salt-api|salt-ssh)
+                               [ "$_INSTALL_MASTER" -eq $BS_FALSE ] && continue ;;
+        esac
+
+        __PACKAGES="${__PACKAGES} ${bundle_pkg}"
+    done
+
+    if [ "$__PACKAGES" = "" ]; then
+        echoerror "The offline bundle does not hold any of the requested Salt packages"
+        return 1
+    fi
+
+    echoinfo "Installing from the offline bundle:${__PACKAGES}"
+    if [ "$_OFFLINE_BUNDLE_FORMAT" = "deb" ]; then
+        export DEBIAN_FRONTEND=noninteractive
+        # shellcheck disable=SC2086
+        __apt_get_install_noinput ${__PACKAGES} || return 1
+    elif __check_command_exists dnf; then
+        # shellcheck disable=SC2086
+        dnf -y --disablerepo='*' install ${__PACKAGES} || return 1
+    elif __check_command_exists yum; then
+        # shellcheck disable=SC2086
+        yum -y --disablerepo='*' localinstall ${__PACKAGES} || return 1
+    else
+        # shellcheck disable=SC2086
+        rpm -Uvh --replacepkgs ${__PACKAGES} || return 1
+    fi
+
+    return 0
+}
+#
+#   Ended Offline Bundle Install Functions
+#
+#######################################################################################################################
+
 #======================================================================================================================
 # LET'S PROCEED WITH OUR INSTALLATION
 #======================================================================================================================
@@ -9582,6 +11180,17 @@ for FUNC_NAME in $(__strip_duplicates "$CHECK_SERVICES_FUNC_NAMES"); do
 done
 echodebug "CHECK_SERVICES_FUNC=${CHECK_SERVICES_FUNC}"
 
+# Offline bundles replace the Salt repository setup and installation, the distribution
+# dependencies are installed by the usual function once the bundle is extracted
+if [ "$_OFFLINE_BUNDLE" != "null" ]; then
+    if [ ${_NO_DEPS} -eq $BS_FALSE ]; then
+        _OFFLINE_BUNDLE_DISTRO_DEPS_FUNC="$DEPS_INSTALL_FUNC"
+        DEPS_INSTALL_FUNC="install_offline_bundle_deps"
+    fi
+    INSTALL_FUNC="install_offline_bundle"
+    echodebug "Installing from the offline bundle, DEPS_INSTALL_FUNC=${DEPS_INSTALL_FUNC} INSTALL_FUNC=${INSTALL_FUNC}"
+fi
+
 if [ ${_NO_DEPS} -eq $BS_FALSE ] && [ "$DEPS_INSTALL_FUNC" = "null" ]; then
     echoerror "No dependencies installation function found. Exiting..."
     exit 1
@@ -9593,11 +11202,23 @@ if [ "$INSTALL_FUNC" = "null" ]; then
 fi
 
 
+# Collect the packages of package based installs and install them in as few transactions as possible
+if [ "$_PKG_DRY_RUN" -eq $BS_TRUE ]; then
+    _PKG_BATCH=$BS_TRUE
+fi
+if [ "$_PKG_BATCH" -eq $BS_TRUE ]; then
+    if [ "$ITYPE" = "git" ] || [ "$_CONFIG_ONLY" -eq $BS_TRUE ]; then
+        echowarn "Package batching only applies to package based installations, not batching"
+    else
+        _PKG_PLAN_ACTIVE=$BS_TRUE
+    fi
+fi
+
 # Install dependencies
 if [ ${_NO_DEPS} -eq $BS_FALSE ] && [ $_CONFIG_ONLY -eq $BS_FALSE ]; then
     # Only execute function is not in config mode only
     echoinfo "Running ${DEPS_INSTALL_FUNC}()"
-    if ! ${DEPS_INSTALL_FUNC}; then
+    if ! __timed deps ${DEPS_INSTALL_FUNC}; then
         echoerror "Failed to run ${DEPS_INSTALL_FUNC}()!!!"
         exit 1
     fi
@@ -9605,7 +11226,7 @@ fi
 
 
 if [ "${ITYPE}" = "git" ] && [ ${_NO_DEPS} -eq ${BS_TRUE} ]; then
-    if ! __git_clone_and_checkout; then
+    if ! __timed git_clone __git_clone_and_checkout; then
         echo "Failed to clone and checkout git repository."
         exit 1
     fi
@@ -9618,10 +11239,14 @@ if [ "$_CUSTOM_MASTER_CONFIG" != "null" ] || [ "$_CUSTOM_MINION_CONFIG" != "null
         _TEMP_CONFIG_DIR="$_SALT_ETC_DIR"
     fi
 
-    if [ ${_NO_DEPS} -eq $BS_FALSE ] && [ $_CONFIG_ONLY -eq $BS_TRUE ]; then
+    # A prepared image has them already, unless Python can't write YAML without them
+    if [ "$_BOOTSTRAP_MODE" = "personalize" ] && \
+            "${_PY_EXE:-python}" -c "import yaml" >/dev/null 2>&1; then
+        echodebug "Not installing the dependencies to write the configuration on a prepared image"
+    elif [ ${_NO_DEPS} -eq $BS_FALSE ] && [ $_CONFIG_ONLY -eq $BS_TRUE ]; then
         # Execute function to satisfy dependencies for configuration step
         echoinfo "Running ${DEPS_INSTALL_FUNC}()"
-        if ! ${DEPS_INSTALL_FUNC}; then
+        if ! __timed deps ${DEPS_INSTALL_FUNC}; then
             echoerror "Failed to run ${DEPS_INSTALL_FUNC}()!!!"
             exit 1
         fi
@@ -9631,7 +11256,7 @@ fi
 # Configure Salt
 if [ "$CONFIG_SALT_FUNC" != "null" ] && [ "$_TEMP_CONFIG_DIR" != "null" ]; then
     echoinfo "Running ${CONFIG_SALT_FUNC}()"
-    if ! ${CONFIG_SALT_FUNC}; then
+    if ! __timed config ${CONFIG_SALT_FUNC}; then
         echoerror "Failed to run ${CONFIG_SALT_FUNC}()!!!"
         exit 1
     fi
@@ -9654,7 +11279,7 @@ fi
 # Pre-seed master keys
 if [ "$PRESEED_MASTER_FUNC" != "null" ] && [ "$_TEMP_KEYS_DIR" != "null" ]; then
     echoinfo "Running ${PRESEED_MASTER_FUNC}()"
-    if ! ${PRESEED_MASTER_FUNC}; then
+    if ! __timed preseed ${PRESEED_MASTER_FUNC}; then
         echoerror "Failed to run ${PRESEED_MASTER_FUNC}()!!!"
         exit 1
     fi
@@ -9664,16 +11289,30 @@ fi
 if [ "$_CONFIG_ONLY" -eq $BS_FALSE ]; then
     # Only execute function is not in config mode only
     echoinfo "Running ${INSTALL_FUNC}()"
-    if ! ${INSTALL_FUNC}; then
+    if ! __timed install ${INSTALL_FUNC}; then
         echoerror "Failed to run ${INSTALL_FUNC}()!!!"
         exit 1
     fi
 fi
 
+# Install the packages left in the package plan
+if [ "$_PKG_PLAN_ACTIVE" -eq $BS_TRUE ]; then
+    if ! __timed packages __pkg_plan_flush; then
+        echoerror "Failed to install the planned packages!!!"
+        exit 1
+    fi
+    _PKG_PLAN_ACTIVE=$BS_FALSE
+
+    if [ "$_PKG_DRY_RUN" -eq $BS_TRUE ]; then
+        echoinfo "Dry run, not going any further"
+        exit 0
+    fi
+fi
+
 # Run any post install function. Only execute function if not in config mode only
 if [ "$POST_INSTALL_FUNC" != "null" ] && [ "$_CONFIG_ONLY" -eq $BS_FALSE ]; then
     echoinfo "Running ${POST_INSTALL_FUNC}()"
-    if ! ${POST_INSTALL_FUNC}; then
+    if ! __timed post ${POST_INSTALL_FUNC}; then
         echoerror "Failed to run ${POST_INSTALL_FUNC}()!!!"
         exit 1
     fi
@@ -9682,18 +11321,38 @@ fi
 # Run any check services function, Only execute function if not in config mode only
 if [ "$CHECK_SERVICES_FUNC" != "null" ] && [ "$_CONFIG_ONLY" -eq $BS_FALSE ]; then
     echoinfo "Running ${CHECK_SERVICES_FUNC}()"
-    if ! ${CHECK_SERVICES_FUNC}; then
+    if ! __timed check_services ${CHECK_SERVICES_FUNC}; then
         echoerror "Failed to run ${CHECK_SERVICES_FUNC}()!!!"
         exit 1
     fi
 fi
 
+# Leave the prepared image without identity, nor daemons starting before it's personalized
+if [ "$_BOOTSTRAP_MODE" = "prepare" ]; then
+    echoinfo "Running __prepare_image()"
+    if ! __timed prepare_image __prepare_image; then
+        echoerror "Failed to run __prepare_image()!!!"
+        exit 1
+    fi
+fi
+
+# The daemons of a prepared image are not started on boot until it's personalized
+if [ "$_BOOTSTRAP_MODE" = "personalize" ] && [ ${_START_DAEMONS} -eq $BS_TRUE ]; then
+    echoinfo "Running __enable_daemons()"
+    if ! __timed enable_daemons __enable_daemons; then
+        echoerror "Failed to run __enable_daemons()!!!"
+        exit 1
+    fi
+fi
+
 # Run any start daemons function
 if [ "$STARTDAEMONS_INSTALL_FUNC" != "null" ] && [ ${_START_DAEMONS} -eq $BS_TRUE ]; then
     echoinfo "Running ${STARTDAEMONS_INSTALL_FUNC}()"
-    echodebug "Waiting ${_SLEEP} seconds for processes to settle before checking for them"
-    sleep ${_SLEEP}
-    if ! ${STARTDAEMONS_INSTALL_FUNC}; then
+    if [ "$_SLEEP_PASSED" -eq $BS_TRUE ]; then
+        echodebug "Waiting ${_SLEEP} seconds for processes to settle before checking for them"
+        __timed settle sleep ${_SLEEP}
+    fi
+    if ! __timed restart_daemons ${STARTDAEMONS_INSTALL_FUNC}; then
         echoerror "Failed to run ${STARTDAEMONS_INSTALL_FUNC}()!!!"
         exit 1
     fi
@@ -9702,9 +11361,13 @@ fi
 # Check if the installed daemons are running or not
 if [ "$DAEMONS_RUNNING_FUNC" != "null" ] && [ ${_START_DAEMONS} -eq $BS_TRUE ]; then
     echoinfo "Running ${DAEMONS_RUNNING_FUNC}()"
-    echodebug "Waiting ${_SLEEP} seconds for processes to settle before checking for them"
-    sleep ${_SLEEP}  # Sleep a little bit to let daemons start
-    if ! ${DAEMONS_RUNNING_FUNC}; then
+    if [ "$_SLEEP_PASSED" -eq $BS_TRUE ]; then
+        echodebug "Waiting ${_SLEEP} seconds for processes to settle before checking for them"
+        __timed settle sleep ${_SLEEP}  # Sleep a little bit to let daemons start
+    fi
+    # Return as soon as the daemons are up, the check below reports the ones which are not
+    __timed wait_for_daemons __wait_for_daemons "${DAEMONS_RUNNING_FUNC}"
+    if ! __timed daemons_running ${DAEMONS_RUNNING_FUNC}; then
         echoerror "Failed to run ${DAEMONS_RUNNING_FUNC}()!!!"
 
         for fname in api master minion syndic; do
@@ -9745,7 +11408,9 @@ if [ "$_AUTO_ACCEPT_MINION_KEYS" -eq "$BS_TRUE" ]; then
 fi
 
 # Done!
-if [ "$_CONFIG_ONLY" -eq $BS_FALSE ]; then
+if [ "$_BOOTSTRAP_MODE" = "prepare" ]; then
+    echoinfo "Salt installed! Personalize the hosts started from this image with '-m personalize'"
+elif [ "$_CONFIG_ONLY" -eq $BS_FALSE ]; then
     echoinfo "Salt installed!"
 else
     echoinfo "Salt configured!"
@@ -1,29 +1,152 @@
 import logging
 import os
+import pathlib
 import pprint
+import re
+from dataclasses import dataclass
 
 import pytest
-import testinfra
+import yaml
 
 log = logging.getLogger(__name__)
 
+REPO_ROOT = pathlib.Path(__file__).resolve().parent.parent
+# The test-kitchen instance state attributes, and the environment variables
+# `kitchen verify` exports them as
+STATE_ENVIRON = {
+    "hostname": "KITCHEN_HOSTNAME",
+    "port": "KITCHEN_PORT",
+    "username": "KITCHEN_USERNAME",
+    "password": "KITCHEN_PASSWORD",
+    "ssh_key": "KITCHEN_SSH_KEY",
+    "container_id": "KITCHEN_CONTAINER_ID",
+}
+
+
+@dataclass(frozen=True)
+class KitchenInstance:
+    name: str
+    suite: str
+    environ: tuple
+
+    @property
+    def env(self):
+        return dict(self.environ)
+
+    @property
+    def windows(self):
+        return "windows" in self.name
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--kitchen-instance",
+        action="append",
+        default=[],
+        help=(
+            "Verify this converged test-kitchen instance, from its state under .kitchen/. "
+            "Can be passed multiple times. Defaults to the instance `kitchen verify` runs "
+            "pytest for. Combine with `-n <workers> --dist loadgroup` to verify them concurrently."
+        ),
+    )
+
+
+def kitchen_suites():
+    """
+    The suite names of the test-kitchen configuration in use.
+
+    Parsed with a regex because some of the configurations are ERB templates.
+    """
+    suites = set()
+    for config in (
+        os.environ.get("KITCHEN_YAML", "kitchen.yml"),
+        os.environ.get("KITCHEN_LOCAL_YAML"),
+    ):
+        if not config or not (REPO_ROOT / config).is_file():
+            continue
+        section = re.search(
+            r"^suites:\n((?:[ \t].*\n|\n)*)", (REPO_ROOT / config).read_text(), re.M
+        )
+        if section:
+            suites.update(re.findall(r"^  - name: (\S+)", section.group(1), re.M))
+    return suites
+
+
+def load_kitchen_instance(name, suites):
+    state = yaml.safe_load((REPO_ROOT / ".kitchen" / f"{name}.yml").read_text()) or {}
+    # Instance names are "<suite>-<platform>", and a suite name can be the prefix of another
+    suite = max(
+        (suite for suite in suites if name.startswith(f"{suite}-")), key=len, default=""
+    )
+    environ = {
+        env: str(state[attr]) for attr, env in STATE_ENVIRON.items() if attr in state
+    }
+    environ.update(KITCHEN_INSTANCE=name, KITCHEN_SUITE=suite)
+    if "KITCHEN_LOCAL_YAML" in os.environ:
+        environ["KITCHEN_LOCAL_YAML"] = os.environ["KITCHEN_LOCAL_YAML"]
+    return KitchenInstance(name, suite, tuple(sorted(environ.items())))
+
+
+def pytest_generate_tests(metafunc):
+    if "kitchen_instance" not in metafunc.fixturenames:
+        return
+    names = metafunc.config.getoption("kitchen_instance")
+    if names:
+        suites = kitchen_suites()
+        instances = [load_kitchen_instance(name, suites) for name in names]
+    else:
+        environ = {
+            key: value
+            for key, value in os.environ.items()
+            if key.startswith("KITCHEN_")
+        }
+        instances = [
+            KitchenInstance(
+                environ.get("KITCHEN_INSTANCE", ""),
+                environ.get("KITCHEN_SUITE", ""),
+                tuple(sorted(environ.items())),
+            )
+        ]
+    metafunc.parametrize(
+        "kitchen_instance",
+        instances,
+        ids=[instance.name for instance in instances],
+        scope="session",
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    # Keep all the tests of an instance on the same pytest-xdist worker, so that each
+    # worker only opens one connection to it
+    if not config.pluginmanager.hasplugin("xdist"):
+        return
+    for item in items:
+        callspec = getattr(item, "callspec", None)
+        if callspec is not None and "kitchen_instance" in callspec.params:
+            item.add_marker(
+                pytest.mark.xdist_group(callspec.params["kitchen_instance"].name)
+            )
+
 
 @pytest.fixture(scope="session")
-def host():
+def host(kitchen_instance):
+    # Imported here so that the unit tests do not need testinfra installed
+    import testinfra
+
+    env = kitchen_instance.env
     if (
         os.environ.get("RUNNER_OS", "") == "macOS"
-        and os.environ.get("KITCHEN_LOCAL_YAML", "") == "kitchen.macos.yml"
+        and env.get("KITCHEN_LOCAL_YAML", "") == "kitchen.macos.yml"
     ):
         # Adjust the `PATH` so that the `salt-call` executable can be found
         os.environ["PATH"] = "/opt/salt/bin{}{}".format(os.pathsep, os.environ["PATH"])
         return testinfra.get_host("local://", sudo=True)
 
-    if os.environ.get("KITCHEN_USERNAME") == "vagrant" or "windows" in os.environ.get(
-        "KITCHEN_INSTANCE"
-    ):
-        if "windows" in os.environ.get("KITCHEN_INSTANCE"):
+    # testinfra caches hosts by their spec, so every test of an instance shares one backend
+    if env.get("KITCHEN_USERNAME") == "vagrant" or kitchen_instance.windows:
+        if kitchen_instance.windows:
             _url = "winrm://{KITCHEN_USERNAME}:{KITCHEN_PASSWORD}@{KITCHEN_HOSTNAME}:{KITCHEN_PORT}".format(
-                **os.environ
+                **env
             )
             return testinfra.get_host(
                 _url,
@@ -31,29 +154,43 @@ def host():
             )
         return testinfra.get_host(
             "paramiko://{KITCHEN_USERNAME}@{KITCHEN_HOSTNAME}:{KITCHEN_PORT}".format(
-                **os.environ
+                **env
             ),
-            ssh_identity_file=os.environ.get("KITCHEN_SSH_KEY"),
+            ssh_identity_file=env.get("KITCHEN_SSH_KEY"),
         )
     return testinfra.get_host(
-        "docker://{KITCHEN_USERNAME}@{KITCHEN_CONTAINER_ID}".format(**os.environ)
+        "docker://{KITCHEN_USERNAME}@{KITCHEN_CONTAINER_ID}".format(**env)
     )
 
 
+@pytest.fixture(scope="session")
+def grains(host, kitchen_instance):
+    """
+    All the grains of the instance, queried once rather than once per test.
+    """
+    if kitchen_instance.windows:
+        ret = host.salt("grains.items", "--timeout=120")
+    else:
+        with host.sudo():
+            ret = host.salt("grains.items", "--timeout=120")
+    log.debug("Grains of %s:\n%s", kitchen_instance.name, pprint.pformat(ret))
+    return ret
+
+
 @pytest.fixture(scope="session")
 def target_python_version():
     return 3
 
 
 @pytest.fixture(scope="session")
-def target_salt_version():
+def target_salt_version(kitchen_instance):
     bootstrap_types = ("git", "stable", "old", "stable", "onedir", "onedir_rc")
 
     # filter out any bootstrap types and then join
     target_salt = ".".join(
         [
             item
-            for item in os.environ["KITCHEN_SUITE"].split("-")
+            for item in kitchen_instance.suite.split("-")
             if item not in bootstrap_types
         ]
     )
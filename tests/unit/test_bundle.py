@@ -0,0 +1,480 @@
+import gzip
+import hashlib
+import http.server
+import json
+import stat
+import subprocess
+import tarfile
+import threading
+from unittest import mock
+
+import pytest
+
+import tools.analyze
+import tools.bundle
+import tools.utils
+
+# The functions install_offline_bundle needs, sourced from bootstrap-salt.sh
+FUNCTIONS = (
+    "echoerror",
+    "echoinfo",
+    "echowarn",
+    "echodebug",
+    "__check_command_exists",
+    "__sha256sum",
+    "__extract_offline_bundle",
+    "install_offline_bundle_deps",
+    "install_offline_bundle",
+)
+APT_PACKAGES = """\
+Package: salt-common
+Version: 3006.1
+Depends: python3 (>= 3.6) | python3-minimal, adduser
+Filename: pool/main/s/salt/salt-common_3006.1_amd64.deb
+SHA256: {salt-common_3006.1_amd64.deb}
+
+Package: salt-minion
+Version: 3006.0
+Depends: salt-common (= 3006.0)
+Filename: pool/main/s/salt/salt-minion_3006.0_amd64.deb
+
+Package: salt-minion
+Version: 3006.1
+Depends: salt-common (= 3006.1), dctrl-tools
+Filename: pool/main/s/salt/salt-minion_3006.1_amd64.deb
+SHA256: {salt-minion_3006.1_amd64.deb}
+
+Package: salt-master
+Version: 3006.1
+Depends: salt-common (= 3006.1)
+Filename: pool/main/s/salt/salt-master_3006.1_amd64.deb
+SHA256: {salt-master_3006.1_amd64.deb}
+"""
+PRIMARY_PACKAGE = """\
+<package type="rpm">
+  <name>{name}</name>
+  <version epoch="0" ver="{ver}" rel="0"/>
+  <checksum type="sha256">{sha256}</checksum>
+  <location href="{href}"/>
+  <size package="{size}"/>
+  <format>
+    <rpm:requires>{requires}</rpm:requires>
+  </format>
+</package>
+"""
+
+
+class Repository(http.server.ThreadingHTTPServer):
+    """
+    A local stand-in for the Salt package repository.
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), RepositoryHandler)
+        self.files = {}
+
+    @property
+    def host(self):
+        return f"127.0.0.1:{self.server_address[1]}"
+
+
+class RepositoryHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = self.server.files.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def repository():
+    server = Repository()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def package_body(filename):
+    return f"not really {filename}\n".encode() * 64
+
+
+def serve_apt(repository, base):
+    bodies = {
+        filename: package_body(filename)
+        for filename in (
+            "salt-common_3006.1_amd64.deb",
+            "salt-minion_3006.0_amd64.deb",
+            "salt-minion_3006.1_amd64.deb",
+            "salt-master_3006.1_amd64.deb",
+        )
+    }
+    for filename, body in bodies.items():
+        repository.files[f"{base}pool/main/s/salt/{filename}"] = body
+    packages = APT_PACKAGES.replace("{", "{{").replace("}", "}}")
+    for filename, body in bodies.items():
+        packages = packages.replace(
+            "{{" + filename + "}}", hashlib.sha256(body).hexdigest()
+        )
+    repository.files[
+        f"{base}dists/jammy/main/binary-amd64/Packages.gz"
+    ] = gzip.compress(packages.format().encode())
+    repository.files[f"{base}dists/jammy/Release"] = b"Codename: jammy\n"
+    repository.files[f"{base}SALT-PROJECT-GPG-PUBKEY-2023.gpg"] = b"deb key"
+    return bodies
+
+
+def serve_yum(repository, base):
+    bodies = {}
+    entries = []
+    for name, requires in (
+        ("salt", ("openssl",)),
+        ("salt-minion", ("salt", "systemd")),
+        ("salt-master", ("salt",)),
+    ):
+        href = f"Packages/{name}-3006.1-0.x86_64.rpm"
+        body = package_body(href)
+        bodies[name] = body
+        repository.files[base + href] = body
+        entries.append(
+            PRIMARY_PACKAGE.format(
+                name=name,
+                ver="3006.1",
+                sha256=hashlib.sha256(body).hexdigest(),
+                href=href,
+                size=len(body),
+                requires="".join(
+                    f'<rpm:entry name="{require}"/>' for require in requires
+                ),
+            )
+        )
+    primary = (
+        f'<metadata xmlns="{tools.bundle.RPM_NS["common"]}" '
+        f'xmlns:rpm="{tools.bundle.RPM_NS["rpm"]}" packages="{len(entries)}">\n'
+        + "".join(entries)
+        + "</metadata>\n"
+    )
+    repository.files[base + "repodata/0123-primary.xml.gz"] = gzip.compress(
+        primary.encode()
+    )
+    repository.files[base + "repodata/repomd.xml"] = (
+        f'<repomd xmlns="{tools.bundle.RPM_NS["repo"]}">'
+        '<data type="primary"><location href="repodata/0123-primary.xml.gz"/></data>'
+        "</repomd>"
+    ).encode()
+    repository.files[base + "SALT-PROJECT-GPG-PUBKEY-2023.pub"] = b"rpm key"
+    return bodies
+
+
+def build(repository, distro, version, arch, salt_version, packages, output):
+    resolved = tools.bundle.resolve_repository(
+        distro, version, arch, salt_version, repo_url=repository.host, http="http"
+    )
+    builder = tools.bundle.BundleBuilder(mock.MagicMock(), resolved)
+    # Bypass any proxy of the environment, the repository listens on localhost
+    builder.session.trust_env = False
+    return builder.build(packages, output)
+
+
+def read_bundle(path):
+    with tarfile.open(path) as tar:
+        return {
+            member.name: tar.extractfile(member).read()
+            for member in tar.getmembers()
+            if member.isfile()
+        }
+
+
+def check_sums(files):
+    sums = {}
+    for line in files["SHA256SUMS"].decode().splitlines():
+        sha256, path = line.split("  ")
+        assert hashlib.sha256(files[path]).hexdigest() == sha256
+        sums[path] = sha256
+    return sums
+
+
+@pytest.mark.parametrize(
+    "salt_version,rev",
+    (
+        ("latest", "latest"),
+        ("nightly", "nightly"),
+        ("3006", "3006"),
+        ("3005.0", "minor/3005"),
+        ("3005.1", "minor/3005.1"),
+        ("3006.1", "minor/3006.1"),
+        ("3006.0rc1", "minor/3006.0rc1"),
+    ),
+)
+def test_onedir_rev(salt_version, rev):
+    assert tools.bundle.onedir_rev(salt_version) == rev
+
+
+def test_onedir_rev_unknown():
+    with pytest.raises(ValueError):
+        tools.bundle.onedir_rev("2019.2.8")
+
+
+@pytest.mark.parametrize(
+    "args,url,keys",
+    (
+        (
+            ("ubuntu", "22.04", "amd64", "3006.1"),
+            "https://repo.saltproject.io/salt/py3/ubuntu/22.04/amd64/minor/3006.1/",
+            ["SALT-PROJECT-GPG-PUBKEY-2023.gpg"],
+        ),
+        (
+            ("ubuntu", "21.04", "amd64", "latest"),
+            "https://repo.saltproject.io/salt/py3/ubuntu/20.04/amd64/latest/",
+            ["salt-archive-keyring.gpg", "SALT-PROJECT-GPG-PUBKEY-2023.gpg"],
+        ),
+        (
+            ("debian", "11.7", "arm64", "3005.1"),
+            "https://repo.saltproject.io/salt/py3/debian/11/arm64/minor/3005.1/",
+            ["salt-archive-keyring.gpg"],
+        ),
+        (
+            ("rockylinux", "9.2", "x86_64", "nightly"),
+            "https://repo.saltproject.io/salt-dev/salt/py3/redhat/9/x86_64/",
+            ["SALTSTACK-GPG-KEY2.pub"],
+        ),
+        (
+            ("amazon", "2", "aarch64", "3006"),
+            "https://repo.saltproject.io/salt/py3/amazon/2/aarch64/3006/",
+            ["SALT-PROJECT-GPG-PUBKEY-2023.pub"],
+        ),
+    ),
+)
+def test_resolve_repository(args, url, keys):
+    repository = tools.bundle.resolve_repository(*args)
+    assert repository.url == url
+    assert repository.keys == keys
+
+
+def test_resolve_repository_rc_and_mirror():
+    repository = tools.bundle.resolve_repository(
+        "centos", "7", "x86_64", "3006.0rc1", repo_url="mirror:8080", rc=True
+    )
+    assert repository.distro == "redhat"
+    assert repository.package_format == "rpm"
+    assert repository.url == (
+        "https://mirror:8080/salt_rc/salt/py3/redhat/7/x86_64/minor/3006.0rc1/"
+    )
+
+
+@pytest.mark.parametrize(
+    "args", (("arch", "", "x86_64", "latest"), ("ubuntu", "14.04", "amd64", "3006"))
+)
+def test_resolve_repository_unsupported(args):
+    with pytest.raises(ValueError):
+        tools.bundle.resolve_repository(*args)
+
+
+def test_select_packages():
+    available = [
+        tools.bundle.Package("salt-minion", "3006.1", "a", depends=["salt-common"]),
+        tools.bundle.Package("salt-minion", "3006.10", "b", depends=["salt-common"]),
+        tools.bundle.Package("salt-minion", "3006.9", "c", depends=["salt-common"]),
+        tools.bundle.Package("salt-common", "3006.10", "d", depends=["libc6"]),
+        tools.bundle.Package("salt-master", "3006.10", "e"),
+    ]
+    selected = tools.bundle.select_packages(available, ["salt-minion"])
+    assert [(p.name, p.version) for p in selected] == [
+        ("salt-common", "3006.10"),
+        ("salt-minion", "3006.10"),
+    ]
+
+    with pytest.raises(ValueError):
+        tools.bundle.select_packages(available, ["salt-minion", "salt-cloud"])
+    selected = tools.bundle.select_packages(
+        available, ["salt-minion", "salt-cloud"], strict=False
+    )
+    assert [p.name for p in selected] == ["salt-common", "salt-minion"]
+
+
+def test_build_apt_bundle(repository, tmp_path):
+    base = "/salt/py3/ubuntu/22.04/amd64/minor/3006.1/"
+    bodies = serve_apt(repository, base)
+    output = tmp_path / "bundle.tar.gz"
+
+    manifest = build(
+        repository, "ubuntu", "22.04", "amd64", "3006.1", ["salt-minion"], output
+    )
+
+    files = read_bundle(output)
+    assert json.loads(files["manifest.json"]) == manifest
+    assert manifest["source"] == f"http://{repository.host}{base}"
+    assert manifest["onedir_rev"] == "minor/3006.1"
+    assert manifest["format"] == "deb"
+    assert manifest["keys"] == ["SALT-PROJECT-GPG-PUBKEY-2023.gpg"]
+    # The newest salt-minion and the dependency found in the Salt repository
+    assert [(p["name"], p["version"]) for p in manifest["packages"]] == [
+        ("salt-common", "3006.1"),
+        ("salt-minion", "3006.1"),
+    ]
+    sums = check_sums(files)
+    assert sums == {p["file"]: p["sha256"] for p in manifest["packages"]}
+    assert files["packages/salt-minion_3006.1_amd64.deb"] == (
+        bodies["salt-minion_3006.1_amd64.deb"]
+    )
+    assert files["keys/SALT-PROJECT-GPG-PUBKEY-2023.gpg"] == b"deb key"
+    assert "metadata/dists/jammy/main/binary-amd64/Packages.gz" in files
+    assert "metadata/dists/jammy/Release" in files
+
+
+def test_build_yum_bundle(repository, tmp_path):
+    base = "/salt/py3/redhat/9/x86_64/latest/"
+    bodies = serve_yum(repository, base)
+    output = tmp_path / "bundle.tar.gz"
+
+    manifest = build(
+        repository, "almalinux", "9.2", "x86_64", "latest", ["salt-minion"], output
+    )
+
+    files = read_bundle(output)
+    assert json.loads(files["manifest.json"]) == manifest
+    assert manifest["source"] == f"http://{repository.host}{base}"
+    assert (manifest["distro"], manifest["version"]) == ("redhat", "9")
+    assert manifest["format"] == "rpm"
+    assert [p["name"] for p in manifest["packages"]] == ["salt", "salt-minion"]
+    sums = check_sums(files)
+    assert sorted(sums) == [
+        "packages/salt-3006.1-0.x86_64.rpm",
+        "packages/salt-minion-3006.1-0.x86_64.rpm",
+    ]
+    assert files["packages/salt-3006.1-0.x86_64.rpm"] == bodies["salt"]
+    assert files["keys/SALT-PROJECT-GPG-PUBKEY-2023.pub"] == b"rpm key"
+    assert "metadata/repodata/repomd.xml" in files
+    assert "metadata/repodata/0123-primary.xml.gz" in files
+
+
+def test_build_checksum_mismatch(repository, tmp_path):
+    base = "/salt/py3/ubuntu/22.04/amd64/minor/3006.1/"
+    serve_apt(repository, base)
+    repository.files[f"{base}pool/main/s/salt/salt-common_3006.1_amd64.deb"] = b"x"
+    output = tmp_path / "bundle.tar.gz"
+
+    with pytest.raises(ValueError, match="does not match the repository metadata"):
+        build(repository, "ubuntu", "22.04", "amd64", "3006.1", ["salt-minion"], output)
+    assert not output.exists()
+
+
+@pytest.fixture(scope="module")
+def functions():
+    script = tools.analyze.Script.parse(
+        (tools.utils.REPO_ROOT / "bootstrap-salt.sh").read_text()
+    )
+    return "\n".join(
+        "\n".join(script.lines[function.start - 1 : function.end])
+        for function in (script.functions[name] for name in FUNCTIONS)
+    )
+
+
+@pytest.fixture
+def path(tmp_path):
+    # dpkg-deb reads the package name out of the file name of the fixture packages
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    for name, body in (
+        ("dpkg", "exit 0"),
+        ("dpkg-deb", 'basename "$2" | cut -d_ -f1'),
+    ):
+        stub = bindir / name
+        stub.write_text(f"#!/bin/sh\n{body}\n")
+        stub.chmod(stub.stat().st_mode | stat.S_IXUSR)
+    return f"{bindir}:/usr/local/bin:/usr/bin:/bin"
+
+
+def install(functions, path, bundle, *options, func="install_offline_bundle"):
+    code = functions + (
+        '\n__apt_get_install_noinput() { echo "INSTALL $*"; }\n'
+        "BS_TRUE=1\nBS_FALSE=0\n_ECHO_DEBUG=$BS_FALSE\n"
+        "_INSTALL_MINION=$BS_TRUE\n_INSTALL_MASTER=$BS_FALSE\n"
+        "_INSTALL_SYNDIC=$BS_FALSE\n_INSTALL_CLOUD=$BS_FALSE\n"
+        "_OFFLINE_BUNDLE_DIR=null\n_OFFLINE_BUNDLE_TMPDIR=null\n"
+        f"_OFFLINE_BUNDLE='{bundle}'\n"
+        + "".join(f"{option}\n" for option in options)
+        + f'{func}\nret=$?\nrm -rf "$_OFFLINE_BUNDLE_TMPDIR"\nexit $ret\n'
+    )
+    return subprocess.run(
+        ["sh", "-c", code], env={"PATH": path}, capture_output=True, text=True
+    )
+
+
+def test_install_offline_bundle(repository, tmp_path, functions, path):
+    serve_apt(repository, "/salt/py3/ubuntu/22.04/amd64/minor/3006.1/")
+    output = tmp_path / "bundle.tar.gz"
+    build(
+        repository,
+        "ubuntu",
+        "22.04",
+        "amd64",
+        "3006.1",
+        ["salt-minion", "salt-master"],
+        output,
+    )
+
+    ret = install(functions, path, output)
+    assert ret.returncode == 0, ret.stderr
+    installed = ret.stdout.split("INSTALL ")[1].split()
+    # salt-master is left out, it wasn't asked for
+    assert [name.rsplit("/", 1)[-1] for name in installed] == [
+        "salt-common_3006.1_amd64.deb",
+        "salt-minion_3006.1_amd64.deb",
+    ]
+
+    ret = install(functions, path, output, "_INSTALL_MASTER=$BS_TRUE")
+    assert "salt-master_3006.1_amd64.deb" in ret.stdout
+
+    # A corrupted package is refused
+    extracted = tmp_path / "extracted"
+    extracted.mkdir()
+    with tarfile.open(output) as tar:
+        tar.extractall(extracted)
+    extracted.joinpath("packages", "salt-minion_3006.1_amd64.deb").write_bytes(b"x")
+    ret = install(functions, path, extracted)
+    assert ret.returncode == 1
+    assert "failed checksum verification" in ret.stderr
+    assert "INSTALL" not in ret.stdout
+
+
+def test_install_offline_bundle_deps(repository, tmp_path, functions, path):
+    serve_apt(repository, "/salt/py3/ubuntu/22.04/amd64/minor/3006.1/")
+    output = tmp_path / "bundle.tar.gz"
+    build(repository, "ubuntu", "22.04", "amd64", "3006.1", ["salt-minion"], output)
+
+    # The distribution dependencies are installed once the bundle is verified
+    ret = install(
+        functions,
+        path,
+        output,
+        'install_ubuntu_onedir_deps() { echo "DEPS _DISABLE_REPOS=$_DISABLE_REPOS"; }',
+        "_DISABLE_REPOS=$BS_TRUE",
+        "_OFFLINE_BUNDLE_DISTRO_DEPS_FUNC=install_ubuntu_onedir_deps",
+        func="install_offline_bundle_deps",
+    )
+    assert ret.returncode == 0, ret.stderr
+    assert "DEPS _DISABLE_REPOS=1" in ret.stdout
+
+    ret = install(
+        functions,
+        path,
+        output,
+        "DISTRO_NAME=Foo",
+        "_OFFLINE_BUNDLE_DISTRO_DEPS_FUNC=null",
+        func="install_offline_bundle_deps",
+    )
+    assert ret.returncode == 0, ret.stderr
+    assert "make sure they are installed" in ret.stdout
@@ -0,0 +1,164 @@
+import argparse
+import hashlib
+import http.server
+import importlib.util
+import json
+import threading
+import urllib.parse
+
+import pytest
+
+import tools.utils
+
+CUT_RELEASE_PY = (
+    tools.utils.REPO_ROOT / ".github" / "workflows" / "scripts" / "cut-release.py"
+)
+
+
+@pytest.fixture(scope="module")
+def cut_release():
+    spec = importlib.util.spec_from_file_location("cut_release", CUT_RELEASE_PY)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class GitHubStub(http.server.ThreadingHTTPServer):
+    """
+    A local stand-in for the paginated, ETag aware, GitHub API listings.
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), GitHubStubHandler)
+        self.tags = []
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class GitHubStubHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, body, headers=()):
+        data = json.dumps(body).encode()
+        etag = f'"{hashlib.sha256(data).hexdigest()}"'
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            status, data = 304, b""
+        with self.server.lock:
+            self.server.requests.append((self.path, status))
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        if status == 200:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path.endswith("/releases/latest"):
+            self.send_json(404, {"message": "Not Found"})
+            return
+        if not url.path.endswith("/tags"):
+            self.send_json(404, {"message": "Not Found"})
+            return
+        per_page = int(query.get("per_page", ["30"])[0])
+        page = int(query.get("page", ["1"])[0])
+        pages = max(1, -(-len(self.server.tags) // per_page))
+        items = self.server.tags[(page - 1) * per_page : page * per_page]
+        headers = []
+        if pages > 1:
+            last = f"{self.server.url}{url.path}?per_page={per_page}&page={pages}"
+            headers.append(("Link", f'<{last}>; rel="last"'))
+        self.send_json(200, [{"name": name} for name in items], headers)
+
+
+@pytest.fixture
+def github(monkeypatch):
+    monkeypatch.setenv("GITHUB_TOKEN", "token")
+    server = GitHubStub()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def session(cut_release, github, tmp_path, monkeypatch):
+    session = cut_release.Session(endpoint=github.url, cache_dir=tmp_path, workers=4)
+    monkeypatch.setattr(cut_release.Session, "_instance", session)
+    return session
+
+
+def test_get_paginated(session, github):
+    github.tags = [f"v2023.1.{idx}" for idx in range(250)]
+
+    tags = [tag["name"] for tag in session.get_paginated("/repos/o/r/tags")]
+
+    assert tags == github.tags
+    assert sorted(github.requests) == sorted(
+        [
+            ("/repos/o/r/tags?per_page=100", 200),
+            ("/repos/o/r/tags?per_page=100&page=2", 200),
+            ("/repos/o/r/tags?per_page=100&page=3", 200),
+        ]
+    )
+
+    # The pages seen before are revalidated, and unchanged ones served from the cache
+    github.requests.clear()
+    tags = [tag["name"] for tag in session.get_paginated("/repos/o/r/tags")]
+    assert tags == github.tags
+    assert {status for _, status in github.requests} == {304}
+
+
+def test_get_paginated_single_page(session, github):
+    github.tags = ["v1", "v2"]
+    assert session.get_paginated("/repos/o/r/tags") == [
+        {"name": "v1"},
+        {"name": "v2"},
+    ]
+    assert len(github.requests) == 1
+
+
+def test_version_key(cut_release):
+    tags = ["v2023.11.16", "v2023.2.1", "v2023.11.16rc1", "2023.11.3", "v2022.10.04"]
+    assert sorted(tags, key=cut_release.version_key) == [
+        "v2022.10.04",
+        "v2023.2.1",
+        "2023.11.3",
+        "v2023.11.16rc1",
+        "v2023.11.16",
+    ]
+
+
+def test_get_latest_release_from_tags(cut_release, session, github):
+    github.tags = ["latest", "v2023.2.1", "v2023.11.16rc1", "v2023.10.9"] + [
+        f"v2022.1.{idx}" for idx in range(150)
+    ]
+    options = argparse.Namespace(repo="o/r")
+    assert cut_release.get_latest_release(options) == "v2023.11.16rc1"
+
+
+def test_get_latest_release_without_version_tags(
+    cut_release, session, github, monkeypatch, capsys
+):
+    github.tags = ["latest", "stable"]
+    options = argparse.Namespace(repo="o/r")
+    assert cut_release.get_latest_release(options) is None
+
+    monkeypatch.setattr("sys.argv", ["cut-release.py", "--repo", "o/r"])
+    with pytest.raises(SystemExit) as exc:
+        cut_release.main()
+    assert exc.value.code == 1
+    assert (
+        "Pass the previous release tag with --previous-tag" in capsys.readouterr().err
+    )
@@ -0,0 +1,125 @@
+import shlex
+import shutil
+import stat
+import subprocess
+
+import pytest
+
+import tools.analyze
+import tools.utils
+
+RELEASE_FILES = tools.utils.REPO_ROOT / "tests" / "unit" / "files" / "release"
+# The functions __gather_linux_system_info needs, sourced from bootstrap-salt.sh
+FUNCTIONS = (
+    "__parse_version_string",
+    "__derive_debian_numeric_version",
+    "__camelcase_split",
+    "__sort_release_files",
+    "__parse_os_release",
+    "__gather_linux_system_info",
+)
+# What __gather_linux_system_info detects from the release files of each distribution
+EXPECTED = {
+    "almalinux-8": ("AlmaLinux", "8.8"),
+    "almalinux-9": ("AlmaLinux", "9.2"),
+    "amazon-2": ("Amazon Linux AMI", "2"),
+    "arch": ("Arch Linux", ""),
+    "centos-7": ("CentOS", "7.9"),
+    "centos-stream8": ("CentOS", "8"),
+    "centos-stream9": ("CentOS", "9"),
+    "debian-10": ("Debian", "10.13"),
+    "debian-11": ("Debian", "11.7"),
+    "fedora-36": ("Fedora", "36"),
+    "fedora-37": ("Fedora", "37"),
+    "fedora-38": ("Fedora", "38"),
+    "gentoo": ("Gentoo", "2.14"),
+    "gentoo-systemd": ("Gentoo", "2.14"),
+    "opensuse-15": ("opensuse", "15.5"),
+    "opensuse-tumbleweed": ("opensuse", "20230920"),
+    "oraclelinux-7": ("Oracle Linux", "7.9"),
+    "oraclelinux-8": ("Oracle Linux", "8.8"),
+    "photon-3": ('"VMware Photon OS"', "3.0"),
+    "photon-4": ('"VMware Photon OS"', "4.0"),
+    "rockylinux-8": ("Rocky Linux", "8.8"),
+    "rockylinux-9": ("Rocky Linux", "9.2"),
+    "ubuntu-2004": ("Ubuntu", "20.04"),
+    "ubuntu-2204": ("Ubuntu", "22.04"),
+}
+
+
+@pytest.fixture(scope="module")
+def functions():
+    script = tools.analyze.Script.parse(
+        (tools.utils.REPO_ROOT / "bootstrap-salt.sh").read_text()
+    )
+    return "\n".join(
+        "\n".join(script.lines[function.start - 1 : function.end])
+        for function in (script.functions[name] for name in FUNCTIONS)
+    )
+
+
+@pytest.fixture
+def path(tmp_path):
+    # Hide any lsb_release binary of the host running the tests
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    lsb_release = bindir / "lsb_release"
+    lsb_release.write_text("#!/bin/sh\nexit 1\n")
+    lsb_release.chmod(lsb_release.stat().st_mode | stat.S_IXUSR)
+    return f"{bindir}:/usr/local/bin:/usr/bin:/bin"
+
+
+def run(code, path):
+    ret = subprocess.run(
+        ["sh", "-c", code],
+        env={"PATH": path},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return ret.stdout
+
+
+def detect(functions, etc, path):
+    # Point the functions at the release files of the fixture instead of /etc
+    code = functions.replace("/etc", str(etc))
+    code += '\n__gather_linux_system_info\nprintf "%s|%s" "$DISTRO_NAME" "$DISTRO_VERSION"\n'
+    return tuple(run(code, path).split("|"))
+
+
+def test_corpus_covers_the_tested_distributions():
+    generate = tools.analyze.load_generate_py()
+    assert sorted(generate.LINUX_DISTROS) == sorted(EXPECTED)
+    assert sorted(path.name for path in RELEASE_FILES.iterdir()) == sorted(EXPECTED)
+
+
+@pytest.mark.parametrize("distro", sorted(EXPECTED))
+def test_gather_linux_system_info(functions, path, distro):
+    assert detect(functions, RELEASE_FILES / distro, path) == EXPECTED[distro]
+
+
+@pytest.mark.parametrize(
+    "awk", (["mawk"], ["gawk"], ["busybox", "awk"]), ids=("mawk", "gawk", "busybox")
+)
+def test_sort_release_files_awk(functions, tmp_path, path, awk):
+    # Older awk implementations, like mawk 1.3.3 on Debian 10, lack the POSIX character classes
+    if shutil.which(awk[0]) is None:
+        pytest.skip(f"{awk[0]} is not installed")
+    wrapper = tmp_path / "bin" / "awk"
+    wrapper.write_text(f'#!/bin/sh\nexec {shlex.join(awk)} "$@"\n')
+    wrapper.chmod(wrapper.stat().st_mode | stat.S_IXUSR)
+
+    assert detect(functions, RELEASE_FILES / "oraclelinux-8", path) == (
+        EXPECTED["oraclelinux-8"]
+    )
+    code = functions + (
+        "\n__sort_release_files "
+        "'lsb-release os-release foo-release oracle-release redhat-release'"
+    )
+    assert run(code, path).split() == [
+        "oracle-release",
+        "redhat-release",
+        "os-release",
+        "lsb-release",
+        "foo-release",
+    ]
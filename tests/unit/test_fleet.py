@@ -0,0 +1,165 @@
+import asyncio
+import json
+import stat
+from unittest import mock
+
+import pytest
+
+import tools.fleet
+
+# Stand-ins for ssh and scp which run everything on the local host. They accept the
+# same command lines as the real ones and ignore the options and the target host.
+FAKE_SSH = """\
+#!/bin/sh
+while [ $# -gt 2 ]; do shift; done
+exec sh -c "$2"
+"""
+FAKE_SCP = """\
+#!/bin/sh
+while [ "$1" != "-r" ]; do shift; done
+shift
+if [ "$1" = "-P" ]; then shift 2; fi
+for destination; do :; done
+destination=${destination#*:}
+while [ $# -gt 1 ]; do cp -r "$1" "$destination/"; shift; done
+"""
+# Records its arguments and working files, then exits with $FAKE_EXIT_CODE
+FAKE_BOOTSTRAP = """\
+#!/bin/sh
+echo "bootstrapping with: $*"
+echo "$*" > "$FAKE_RECORD_DIR/args"
+dirname "$0" > "$FAKE_RECORD_DIR/remote_dir"
+if [ -n "$BS_REPORT_FILE" ]; then
+    echo '{"exit_code": 0}' > "$BS_REPORT_FILE"
+fi
+sleep "${FAKE_SLEEP:-0}"
+exit "${FAKE_EXIT_CODE:-0}"
+"""
+
+
+def _executable(path, contents):
+    path.write_text(contents)
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    return path
+
+
+@pytest.fixture
+def remote_tmp(tmp_path, monkeypatch):
+    # The fake "remote" hosts create their temporary directories in here
+    path = tmp_path / "remote"
+    path.mkdir()
+    monkeypatch.setenv("TMPDIR", str(path))
+    return path
+
+
+@pytest.fixture
+def record_dir(tmp_path, monkeypatch):
+    path = tmp_path / "record"
+    path.mkdir()
+    monkeypatch.setenv("FAKE_RECORD_DIR", str(path))
+    return path
+
+
+@pytest.fixture
+def runner_factory(tmp_path):
+    transport = tools.fleet.Transport(
+        ssh=str(_executable(tmp_path / "ssh", FAKE_SSH)),
+        scp=str(_executable(tmp_path / "scp", FAKE_SCP)),
+    )
+    script = _executable(tmp_path / "bootstrap-salt.sh", FAKE_BOOTSTRAP)
+
+    def factory(**kwargs):
+        kwargs.setdefault("bootstrap_args", ["onedir"])
+        return tools.fleet.FleetBootstrap(
+            mock.MagicMock(),
+            transport=transport,
+            script=script,
+            log_dir=tmp_path / "logs",
+            stream=False,
+            **kwargs,
+        )
+
+    return factory
+
+
+def test_parse_inventory(tmp_path):
+    inventory = tmp_path / "hosts"
+    inventory.write_text("# comment\nroot@one:2222\n\ntwo  # trailing comment\n")
+    hosts = tools.fleet.parse_inventory(inventory)
+    assert [(host.target, host.name) for host in hosts] == [
+        ("root@one", "one:2222"),
+        ("two", "two"),
+    ]
+
+    inventory = tmp_path / "hosts.json"
+    inventory.write_text(json.dumps(["one", {"host": "two", "args": ["-x"]}]))
+    hosts = tools.fleet.parse_inventory(inventory)
+    assert [(host.hostname, host.args) for host in hosts] == [
+        ("one", []),
+        ("two", ["-x"]),
+    ]
+
+
+def test_bootstrap(tmp_path, remote_tmp, record_dir, runner_factory):
+    config_dir = tmp_path / "conf"
+    config_dir.mkdir()
+    (config_dir / "minion").write_text("master: salt\n")
+    runner = runner_factory(config_dir=config_dir, reports=True)
+
+    (result,) = asyncio.run(runner.run([tools.fleet.Host("one", args=["-x"])]))
+
+    assert result.status == "ok"
+    assert result.returncode == 0
+    assert "bootstrapping with:" in result.log_file.read_text()
+    assert json.loads(result.report_file.read_text()) == {"exit_code": 0}
+    remote_dir = (record_dir / "remote_dir").read_text().strip()
+    assert remote_dir.startswith(f"{remote_tmp}/salt-bootstrap.")
+    assert (record_dir / "args").read_text().split() == [
+        "-c",
+        f"{remote_dir}/conf",
+        "onedir",
+        "-x",
+    ]
+    # The pushed files are removed once done
+    assert list(remote_tmp.iterdir()) == []
+
+
+def test_bootstrap_private_directories(remote_tmp, record_dir, runner_factory):
+    # Every run gets its own directory, only accessible by the user, even when
+    # several hosts are bootstrapped in the same second
+    runner = runner_factory(concurrency=2)
+    modes = {}
+    real_run = runner._run
+
+    async def _run(cmdline, log_fh, prefix):
+        for path in remote_tmp.iterdir():
+            modes[path.name] = stat.S_IMODE(path.stat().st_mode)
+        return await real_run(cmdline, log_fh, prefix)
+
+    runner._run = _run
+    results = asyncio.run(
+        runner.run([tools.fleet.Host("one"), tools.fleet.Host("two")])
+    )
+
+    assert [result.status for result in results] == ["ok", "ok"]
+    assert len(modes) == 2
+    assert set(modes.values()) == {0o700}
+    assert list(remote_tmp.iterdir()) == []
+
+
+def test_bootstrap_failure_and_timeout(
+    remote_tmp, record_dir, runner_factory, monkeypatch
+):
+    monkeypatch.setenv("FAKE_EXIT_CODE", "3")
+    (result,) = asyncio.run(runner_factory().run([tools.fleet.Host("one")]))
+    assert result.status == "failed"
+    assert result.returncode == 3
+    assert list(remote_tmp.iterdir()) == []
+
+    monkeypatch.setenv("FAKE_EXIT_CODE", "0")
+    monkeypatch.setenv("FAKE_SLEEP", "5")
+    (result,) = asyncio.run(runner_factory(timeout=1).run([tools.fleet.Host("one")]))
+    assert result.status == "timeout"
+    assert "Timed out after 1 seconds" in result.log_file.read_text()
+    # The pushed files are removed after a timeout too
+    assert list(remote_tmp.iterdir()) == []
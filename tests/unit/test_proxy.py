@@ -0,0 +1,273 @@
+import hashlib
+import http.server
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+import tools.proxy
+
+# Bypass any proxy of the environment, the servers all listen on localhost
+OPENER = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+PACKAGE = "/salt/py3/onedir/latest/salt-3006.1-onedir-linux-x86_64.tar.xz"
+REPO_JSON = "/salt/py3/onedir/repo.json"
+
+
+class Upstream(http.server.ThreadingHTTPServer):
+    """
+    A local stand-in for the Salt package repository, counting the requests it gets.
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), UpstreamHandler)
+        self.files = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        # When set, the bodies are sent in two halves, the second one once released
+        self.hold = None
+        self.error = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, path, status=None):
+        return len(
+            [
+                request
+                for request in self.requests
+                if request[0] == path and (status is None or request[1] == status)
+            ]
+        )
+
+
+class UpstreamHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status, headers=(), body=b""):
+        with self.server.lock:
+            self.server.requests.append((self.path, status))
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+    def do_GET(self):
+        if self.server.error is not None:
+            self.respond(self.server.error)
+            return
+        body = self.server.files.get(self.path)
+        if body is None:
+            self.respond(404)
+            return
+        etag = f'"{hashlib.sha256(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.respond(304)
+            return
+        self.respond(200, [("ETag", etag), ("Content-Type", "text/plain")], body)
+        if self.server.hold is None:
+            self.wfile.write(body)
+            return
+        self.wfile.write(body[: len(body) // 2])
+        self.server.hold.wait(10)
+        self.wfile.write(body[len(body) // 2 :])
+
+
+@pytest.fixture
+def upstream():
+    server = Upstream()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        if server.hold is not None:
+            server.hold.set()
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def proxy(upstream, tmp_path):
+    cache = tools.proxy.Cache(tmp_path / "cache", 1024 * 1024)
+    with tools.proxy.RepoProxy(
+        cache, upstream=upstream.url, address=("127.0.0.1", 0), timeout=5
+    ) as server:
+        yield server
+
+
+def wait_for_fills(server):
+    # The clients get the whole file slightly before it's moved into the cache
+    deadline = time.monotonic() + 10
+    while server.fills and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def get(server, path, headers=None):
+    url = f"http://127.0.0.1:{server.server_address[1]}{path}"
+    request = urllib.request.Request(url, headers=headers or {})
+    try:
+        with OPENER.open(request, timeout=10) as response:
+            ret = response.status, response.headers, response.read()
+    except urllib.error.HTTPError as exc:
+        ret = exc.code, exc.headers, exc.read()
+    wait_for_fills(server)
+    return ret
+
+
+def closed_port_url():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def test_is_metadata():
+    assert tools.proxy.is_metadata(REPO_JSON)
+    assert tools.proxy.is_metadata("/salt/py3/ubuntu/22.04/amd64/latest/InRelease")
+    assert tools.proxy.is_metadata("/salt/py3/redhat/9/x86_64/latest/repodata/")
+    assert not tools.proxy.is_metadata(PACKAGE)
+
+
+def test_concurrent_requests_download_once(proxy, upstream):
+    body = bytes(range(256)) * 2048
+    upstream.files[PACKAGE] = body
+    upstream.hold = threading.Event()
+    url = f"http://127.0.0.1:{proxy.server_address[1]}{PACKAGE}"
+    started = threading.Semaphore(0)
+    results = []
+
+    def client():
+        with OPENER.open(url, timeout=10) as response:
+            started.release()
+            results.append(response.read())
+
+    clients = [threading.Thread(target=client) for _ in range(5)]
+    for thread in clients:
+        thread.start()
+    # Every client got the response headers while upstream is still sending the file
+    for _ in clients:
+        assert started.acquire(timeout=10)
+    upstream.hold.set()
+    for thread in clients:
+        thread.join(10)
+    wait_for_fills(proxy)
+
+    assert results == [body] * 5
+    assert upstream.count(PACKAGE) == 1
+    assert proxy.misses == 1
+
+    # Later requests are served from the cache
+    assert get(proxy, PACKAGE)[2] == body
+    assert upstream.count(PACKAGE) == 1
+    assert proxy.hits == 1
+    assert proxy.upstream_bytes == len(body)
+
+
+def test_range_requests(proxy, upstream):
+    upstream.files[PACKAGE] = b"0123456789"
+    assert get(proxy, PACKAGE)[0] == 200
+
+    status, headers, body = get(proxy, PACKAGE, {"Range": "bytes=2-5"})
+    assert (status, body) == (206, b"2345")
+    assert headers["Content-Range"] == "bytes 2-5/10"
+
+    # Resuming a partial download
+    status, headers, body = get(proxy, PACKAGE, {"Range": "bytes=7-"})
+    assert (status, body) == (206, b"789")
+    assert headers["Content-Range"] == "bytes 7-9/10"
+
+    status, headers, _ = get(proxy, PACKAGE, {"Range": "bytes=10-"})
+    assert status == 416
+    assert headers["Content-Range"] == "bytes */10"
+    assert upstream.count(PACKAGE) == 1
+
+
+def test_metadata_revalidation(proxy, upstream):
+    upstream.files[REPO_JSON] = b'{"latest": {}}'
+    assert get(proxy, REPO_JSON)[2] == b'{"latest": {}}'
+
+    # Fresh metadata is served from the cache
+    assert get(proxy, REPO_JSON)[2] == b'{"latest": {}}'
+    assert upstream.count(REPO_JSON) == 1
+
+    # Once past its TTL it's revalidated, and kept while upstream didn't change it
+    proxy.metadata_ttl = 0
+    assert get(proxy, REPO_JSON)[2] == b'{"latest": {}}'
+    assert upstream.count(REPO_JSON, 304) == 1
+
+    upstream.files[REPO_JSON] = b'{"latest": {"3006.1": {}}}'
+    assert get(proxy, REPO_JSON)[2] == b'{"latest": {"3006.1": {}}}'
+    assert upstream.count(REPO_JSON, 200) == 2
+
+
+@pytest.mark.parametrize("failure", ("unreachable", "server-error"))
+def test_metadata_stale_on_upstream_failure(proxy, upstream, failure):
+    upstream.files[REPO_JSON] = b'{"latest": {}}'
+    assert get(proxy, REPO_JSON)[2] == b'{"latest": {}}'
+    proxy.metadata_ttl = 0
+    if failure == "unreachable":
+        proxy.upstream = closed_port_url()
+    else:
+        upstream.error = 503
+
+    # The stale copy is served rather than failing the client
+    for _ in range(2):
+        status, _, body = get(proxy, REPO_JSON)
+        assert (status, body) == (200, b'{"latest": {}}')
+    # What isn't cached can't be served
+    assert get(proxy, PACKAGE)[0] == (502 if failure == "unreachable" else 503)
+
+    # And once upstream is back, it's revalidated again
+    proxy.upstream = upstream.url
+    upstream.error = None
+    upstream.files[REPO_JSON] = b'{"latest": {"3006.1": {}}}'
+    assert get(proxy, REPO_JSON)[2] == b'{"latest": {"3006.1": {}}}'
+
+
+def test_client_errors_are_passed_on(proxy, upstream):
+    assert get(proxy, PACKAGE)[0] == 404
+    assert get(proxy, "/salt/../x")[0] == 404
+    assert upstream.requests == [(PACKAGE, 404), ("/x", 404)]
+    # Nothing is cached
+    assert get(proxy, PACKAGE)[0] == 404
+    assert upstream.count(PACKAGE) == 2
+
+
+def test_cache_eviction(tmp_path):
+    directory = tmp_path / "cache"
+    cache = tools.proxy.Cache(directory, max_size=10)
+
+    def store(path, body):
+        source = cache.temporary_path(path)
+        source.write_bytes(body)
+        cache.store(path, source, {"headers": {}, "validated_at": 0})
+
+    store("/one", b"1111")
+    store("/two", b"2222")
+    # Using a file makes it the most recently used one
+    fileobj, _ = cache.open("/one")
+    fileobj.close()
+    store("/three", b"3333")
+
+    assert cache.open("/two") is None
+    assert cache.metadata("/two") is None
+    assert cache.size == 8
+    assert sorted(path.name for path in directory.iterdir()) == sorted(
+        f"{cache.key(path)}{suffix}"
+        for path in ("/one", "/three")
+        for suffix in ("", ".json")
+    )
+
+    # The cache is loaded back after a restart, and a file larger than it is kept alone
+    cache = tools.proxy.Cache(directory, max_size=10)
+    assert set(cache.entries) == {cache.key("/one"), cache.key("/three")}
+    store("/large", b"x" * 20)
+    assert list(cache.entries) == [cache.key("/large")]
+    fileobj, _ = cache.open("/large")
+    with fileobj:
+        assert fileobj.read() == b"x" * 20
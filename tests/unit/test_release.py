@@ -0,0 +1,170 @@
+import hashlib
+import pathlib
+import threading
+from unittest import mock
+
+import pytest
+from botocore.exceptions import ClientError
+
+import tools.release
+
+BUCKET = "salt-bootstrap-test"
+
+
+class FakeS3:
+    """
+    An in-memory stand-in for the parts of a boto3 S3 client the uploads use.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def put(self, key, body, metadata=None):
+        self.objects[key] = {
+            "Body": body,
+            "ETag": f'"{hashlib.md5(body).hexdigest()}"',
+            "Metadata": dict(metadata or {}),
+        }
+
+    def get_object(self, Bucket, Key):
+        obj = self.objects[Key]
+        return {"Body": obj["Body"], "Metadata": obj["Metadata"]}
+
+    def head_object(self, Bucket, Key):
+        with self._lock:
+            self.calls.append(("head_object", Key))
+            if Key not in self.objects:
+                raise ClientError(
+                    {"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject"
+                )
+            obj = self.objects[Key]
+            return {"ETag": obj["ETag"], "Metadata": obj["Metadata"]}
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs, Config, Callback):
+        with open(Filename, "rb") as rfh:
+            body = rfh.read()
+        with self._lock:
+            self.calls.append(("upload_file", Key))
+            self.put(Key, body, ExtraArgs.get("Metadata"))
+        Callback(len(body))
+
+    def copy_object(self, Bucket, Key, CopySource, Metadata, MetadataDirective):
+        with self._lock:
+            self.calls.append(("copy_object", Key))
+            self.put(Key, self.objects[CopySource["Key"]]["Body"], Metadata)
+
+
+class MotoS3:
+    """
+    A boto3 S3 client backed by moto, when it is installed.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.client.create_bucket(Bucket=BUCKET)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def put(self, key, body, metadata=None):
+        self.client.put_object(
+            Bucket=BUCKET, Key=key, Body=body, Metadata=dict(metadata or {})
+        )
+
+    def get_object(self, Bucket, Key):
+        ret = self.client.get_object(Bucket=Bucket, Key=Key)
+        return {"Body": ret["Body"].read(), "Metadata": ret["Metadata"]}
+
+
+@pytest.fixture(params=("fake", "moto"))
+def s3(request, monkeypatch):
+    if request.param == "fake":
+        yield FakeS3()
+        return
+    moto = pytest.importorskip("moto")
+    import boto3
+
+    for name, value in (
+        ("AWS_ACCESS_KEY_ID", "testing"),
+        ("AWS_SECRET_ACCESS_KEY", "testing"),
+        ("AWS_DEFAULT_REGION", "us-east-1"),
+    ):
+        monkeypatch.setenv(name, value)
+    mock_aws = getattr(moto, "mock_aws", None) or getattr(moto, "mock_s3")
+    with mock_aws():
+        yield MotoS3(boto3.client("s3", region_name="us-east-1"))
+
+
+@pytest.fixture
+def files(tmp_path):
+    script = tmp_path / "bootstrap-salt.sh"
+    script.write_text("#!/bin/sh\necho bootstrap\n")
+    checksum = tmp_path / "bootstrap-salt.sh.sha256"
+    checksum.write_text("0123456789abcdef  bootstrap-salt.sh\n")
+    return {
+        str(script): ["bootstrap/stable/bootstrap-salt.sh", "bootstrap-salt.sh"],
+        str(checksum): ["bootstrap/stable/bootstrap-salt.sh.sha256"],
+    }
+
+
+def test_upload_artifacts(s3, files):
+    ret = tools.release.upload_artifacts(s3, BUCKET, files, jobs=4)
+
+    # Each file is uploaded once, its other destinations are server side copies
+    assert sorted(ret.values()) == ["copied", "uploaded", "uploaded"]
+    assert ret["bootstrap/stable/bootstrap-salt.sh.sha256"] == "uploaded"
+    for lpath, rpaths in files.items():
+        body = pathlib.Path(lpath).read_bytes()
+        for rpath in rpaths:
+            obj = s3.get_object(Bucket=BUCKET, Key=rpath)
+            assert obj["Body"] == body
+            assert obj["Metadata"] == {"sha256": hashlib.sha256(body).hexdigest()}
+
+    # Nothing changed, nothing is sent again
+    ret = tools.release.upload_artifacts(s3, BUCKET, files, jobs=4)
+    assert set(ret.values()) == {"unchanged"}
+
+    # A stale destination is refreshed from an up to date one
+    s3.put("bootstrap-salt.sh", b"stale", {"sha256": "stale"})
+    ret = tools.release.upload_artifacts(s3, BUCKET, files, jobs=4)
+    assert ret == {
+        "bootstrap/stable/bootstrap-salt.sh": "unchanged",
+        "bootstrap-salt.sh": "copied",
+        "bootstrap/stable/bootstrap-salt.sh.sha256": "unchanged",
+    }
+    body = pathlib.Path(next(iter(files))).read_bytes()
+    assert s3.get_object(Bucket=BUCKET, Key="bootstrap-salt.sh")["Body"] == body
+
+
+def test_upload_artifacts_without_sha256_metadata(s3, files):
+    # Objects published before the sha256 metadata existed are compared by ETag
+    for lpath, rpaths in files.items():
+        for rpath in rpaths:
+            s3.put(rpath, pathlib.Path(lpath).read_bytes())
+    s3.put("bootstrap-salt.sh", b"outdated")
+
+    ret = tools.release.upload_artifacts(s3, BUCKET, files, jobs=2)
+
+    assert ret == {
+        "bootstrap/stable/bootstrap-salt.sh": "unchanged",
+        "bootstrap-salt.sh": "copied",
+        "bootstrap/stable/bootstrap-salt.sh.sha256": "unchanged",
+    }
+
+
+def test_upload_file_uploads_once():
+    s3 = FakeS3()
+    progress = mock.MagicMock()
+    lpath = __file__
+    rpaths = ["one", "two", "three"]
+
+    ret = tools.release.upload_file(s3, BUCKET, lpath, rpaths, progress, None)
+
+    assert ret == {"one": "uploaded", "two": "copied", "three": "copied"}
+    assert [call for call in s3.calls if call[0] != "head_object"] == [
+        ("upload_file", "one"),
+        ("copy_object", "two"),
+        ("copy_object", "three"),
+    ]
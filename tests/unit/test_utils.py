@@ -0,0 +1,122 @@
+import hashlib
+import json
+import shutil
+import subprocess
+import tempfile
+from unittest import mock
+
+import pytest
+
+import tools.utils
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("gpg") is None, reason="gpg is not installed"
+)
+
+
+@pytest.fixture
+def gnupghome(monkeypatch):
+    # A throwaway keyring. Kept short, gpg-agent's socket path length is limited.
+    home = tempfile.mkdtemp(prefix="gpg-")
+    monkeypatch.setenv("GNUPGHOME", home)
+    try:
+        yield home
+    finally:
+        subprocess.run(["gpgconf", "--kill", "gpg-agent"], check=False)
+        shutil.rmtree(home, ignore_errors=True)
+
+
+@pytest.fixture
+def key_id(gnupghome):
+    subprocess.run(
+        [
+            "gpg",
+            "--batch",
+            "--passphrase",
+            "",
+            "--quick-generate-key",
+            "Salt Bootstrap Test <test@example.com>",
+            "ed25519",
+            "sign",
+            "never",
+        ],
+        capture_output=True,
+        check=True,
+    )
+    return "test@example.com"
+
+
+@pytest.fixture
+def ctx():
+    # Run the commands for real, like ptscripts does
+    ctx = mock.MagicMock()
+    ctx.run.side_effect = lambda *cmdline, capture=False, **kwargs: subprocess.run(
+        cmdline, capture_output=capture, check=True
+    )
+    return ctx
+
+
+def gpg(*args):
+    return subprocess.run(["gpg", "--batch", *args], capture_output=True, check=True)
+
+
+def test_export_gpg_key(ctx, key_id, tmp_path):
+    tools.utils.export_gpg_key(ctx, key_id, tmp_path)
+
+    keyfile = tmp_path / tools.utils.GPG_KEY_FILENAME
+    assert keyfile.with_suffix(".gpg").read_bytes() == gpg("--export", key_id).stdout
+    assert (
+        keyfile.with_suffix(".pub").read_bytes()
+        == gpg("--armor", "--export", key_id).stdout
+    )
+    # Exporting again replaces the previous files
+    tools.utils.export_gpg_key(ctx, key_id, tmp_path)
+    assert (
+        keyfile.with_suffix(".pub")
+        .read_text()
+        .startswith("-----BEGIN PGP PUBLIC KEY BLOCK-----")
+    )
+
+
+def test_gpg_sign_files(ctx, key_id, tmp_path):
+    paths = []
+    for idx in range(5):
+        path = tmp_path / f"artifact-{idx}"
+        path.write_text(f"artifact {idx}\n")
+        paths.append(path)
+    # A stale signature is replaced
+    (tmp_path / "artifact-0.asc").write_text("stale")
+
+    tools.utils.gpg_sign_files(ctx, key_id, paths, jobs=3)
+
+    for path in paths:
+        gpg("--verify", f"{path}.asc", str(path))
+
+
+def test_gpg_sign_files_failure(ctx, key_id, tmp_path):
+    ctx.exit.side_effect = SystemExit
+    path = tmp_path / "artifact"
+    path.write_text("artifact\n")
+    with pytest.raises(SystemExit):
+        tools.utils.gpg_sign_files(ctx, "unknown@example.com", [path])
+    ctx.exit.assert_called_once_with(1)
+
+
+def test_write_manifest(tmp_path):
+    paths = []
+    for idx in range(3):
+        path = tmp_path / f"artifact-{idx}"
+        path.write_bytes(bytes(range(idx * 50)))
+        paths.append(path)
+    manifest = tmp_path / "manifest.json"
+
+    entries = tools.utils.write_manifest(paths, manifest, jobs=2)
+
+    assert json.loads(manifest.read_text()) == entries
+    for path in paths:
+        data = path.read_bytes()
+        assert entries[path.name] == {
+            "size": len(data),
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "sha512": hashlib.sha512(data).hexdigest(),
+        }
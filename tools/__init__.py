@@ -2,8 +2,15 @@ import logging
 
 import ptscripts
 
+ptscripts.register_tools_module("tools.analyze")
+ptscripts.register_tools_module("tools.benchmark")
+ptscripts.register_tools_module("tools.bundle")
+ptscripts.register_tools_module("tools.fleet")
 ptscripts.register_tools_module("tools.pre_commit")
+ptscripts.register_tools_module("tools.proxy")
 ptscripts.register_tools_module("tools.release")
+ptscripts.register_tools_module("tools.report")
+ptscripts.register_tools_module("tools.wheelhouse")
 
 for name in ("boto3", "botocore", "urllib3"):
     logging.getLogger(name).setLevel(logging.INFO)
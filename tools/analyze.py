@@ -0,0 +1,1026 @@
+"""
+These commands are used to statically analyze bootstrap-salt.sh.
+
+The analysis follows how the script dispatches its work. For the detected distribution and install
+type it builds the ``*_FUNC_NAMES`` candidate lists, and the first candidate which is defined is the
+function called.
+
+The ``profile`` command looks at an actual run instead, through the ``BS_PROFILE_TRACE`` trace of it.
+"""
+# pylint: disable=resource-leakage,broad-except,3rd-party-module-not-gated
+from __future__ import annotations
+
+import fnmatch
+import hashlib
+import importlib.util
+import json
+import logging
+import pathlib
+import re
+import shlex
+import sys
+from dataclasses import dataclass
+from dataclasses import field
+
+from ptscripts import command_group
+from ptscripts import Context
+from rich.table import Table
+
+import tools.utils
+
+log = logging.getLogger(__name__)
+
+# Define the command group
+analyze = command_group(
+    name="analyze",
+    help="Bootstrap Script Analysis Commands",
+    description=__doc__,
+)
+
+SCRIPT_NAME = "bootstrap-salt.sh"
+GENERATE_PY = (
+    tools.utils.REPO_ROOT / ".github" / "workflows" / "templates" / "generate.py"
+)
+
+FUNCTION_RE = re.compile(r"^([A-Za-z_][A-Za-z0-9_]*)\s*\(\)\s*\{\s*$")
+FUNCTION_END_RE = re.compile(r"^}\s*(#.*)?$")
+HEREDOC_RE = re.compile(r"<<(-?)\s*[\"']?([A-Za-z_][A-Za-z0-9_]*)[\"']?")
+CANDIDATES_RE = re.compile(r'^\s*([A-Z_]+_FUNC_NAMES)="(?:\$\1 )?([^"]*)"\s*$')
+WORD_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+HUNK_RE = re.compile(r"^@@ -(\d+)(?:,\d+)? \+(\d+)(?:,\d+)? @@")
+# The PS4 prefix of BS_PROFILE_TRACE lines: depth, timestamp, function and line number
+TRACE_RE = re.compile(r"^(\++)\|([0-9.,]+)\|([^|]*)\|(\d+)\| ?(.*)$")
+ASSIGNMENT_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\[[^]]*\])?\+?=")
+# What bash runs without forking, as they show up in xtrace output
+SHELL_BUILTINS = frozenset(
+    (
+        ". : [ [[ (( alias bg break builtin caller cd command compgen complete continue "
+        "declare dirs disown echo enable eval exec exit export false fc fg getopts hash "
+        "help history jobs kill let local logout mapfile popd printf pushd pwd read "
+        "readarray readonly return set shift shopt source suspend test times trap true "
+        "type typeset ulimit umask unalias unset wait "
+        # And the compound commands bash also traces
+        "case for select until while"
+    ).split()
+)
+
+# The DISTRO_NAME_L values the distribution detection of the script can end up with
+DISTRO_NAMES = (
+    "almalinux",
+    "alpine_linux",
+    "amazon_linux_ami",
+    "arch_linux",
+    "centos",
+    "cloud_linux",
+    "debian",
+    "fedora",
+    "freebsd",
+    "gentoo",
+    "macosx",
+    "openbsd",
+    "opensuse",
+    "oracle_linux",
+    "photon",
+    "red_hat_enterprise",
+    "red_hat_enterprise_linux",
+    "red_hat_enterprise_server",
+    "red_hat_enterprise_workstation",
+    "red_hat_linux",
+    "rocky_linux",
+    "scientific_linux",
+    "smartos",
+    "suse",
+    "ubuntu",
+    "voidlinux",
+)
+# The ITYPE values left once the install type arguments are parsed
+ITYPES = ("stable", "testing", "git", "onedir")
+# Without these the script refuses to run, unless -d skips the dependencies
+REQUIRED_FUNC_NAMES = ("DEP_FUNC_NAMES", "INSTALL_FUNC_NAMES")
+
+# The slim variants of the script published with each release, and the DISTRO_NAME_L values
+# each one keeps the functions of
+VARIANTS = {
+    "debian": ("debian", "ubuntu"),
+    "rhel": (
+        "almalinux",
+        "centos",
+        "cloud_linux",
+        "oracle_linux",
+        "red_hat_enterprise",
+        "red_hat_enterprise_linux",
+        "red_hat_enterprise_server",
+        "red_hat_enterprise_workstation",
+        "red_hat_linux",
+        "rocky_linux",
+        "scientific_linux",
+    ),
+    "fedora": ("fedora",),
+    "amazon": ("amazon_linux_ami",),
+    "suse": ("opensuse", "suse"),
+    "photon": ("photon",),
+    "arch": ("arch_linux",),
+    "gentoo": ("gentoo",),
+    "macos": ("macosx",),
+    "freebsd": ("freebsd",),
+    "openbsd": ("openbsd",),
+}
+# How a host finds its variant in the index before running anything: the ID from /etc/os-release,
+# or the lowercased 'uname -s' where there is no such file
+VARIANT_HOST_IDS = {
+    "debian": (
+        "debian",
+        "ubuntu",
+        "raspbian",
+        "devuan",
+        "kali",
+        "linuxmint",
+        "elementary",
+        "neon",
+        "pop",
+        "trisquel",
+    ),
+    "rhel": ("almalinux", "centos", "cloudlinux", "ol", "rhel", "rocky", "scientific"),
+    "fedora": ("fedora",),
+    "amazon": ("amzn",),
+    "suse": ("opensuse-leap", "opensuse-tumbleweed", "sles"),
+    "photon": ("photon",),
+    "arch": ("arch", "manjaro"),
+    "gentoo": ("gentoo",),
+    "macos": ("darwin",),
+    "freebsd": ("freebsd",),
+    "openbsd": ("openbsd",),
+}
+VARIANTS_INDEX_NAME = "bootstrap-salt-variants.json"
+
+# The DISTRO_NAME_L and DISTRO_VERSION the script detects on the CI test images
+CI_TARGETS = {
+    "almalinux-8": ("almalinux", "8"),
+    "almalinux-9": ("almalinux", "9"),
+    "amazon-2": ("amazon_linux_ami", "2"),
+    "arch": ("arch_linux", ""),
+    "centos-7": ("centos", "7"),
+    "centos-stream8": ("centos", "8"),
+    "centos-stream9": ("centos", "9"),
+    "debian-10": ("debian", "10"),
+    "debian-11": ("debian", "11"),
+    "fedora-36": ("fedora", "36"),
+    "fedora-37": ("fedora", "37"),
+    "fedora-38": ("fedora", "38"),
+    "gentoo": ("gentoo", "2"),
+    "gentoo-systemd": ("gentoo", "2"),
+    "opensuse-15": ("opensuse", "15.5"),
+    "opensuse-tumbleweed": ("opensuse", ""),
+    "oraclelinux-7": ("oracle_linux", "7"),
+    "oraclelinux-8": ("oracle_linux", "8"),
+    "photon-3": ("photon", "3.0"),
+    "photon-4": ("photon", "4.0"),
+    "rockylinux-8": ("rocky_linux", "8"),
+    "rockylinux-9": ("rocky_linux", "9"),
+    "ubuntu-2004": ("ubuntu", "20.04"),
+    "ubuntu-2204": ("ubuntu", "22.04"),
+    "macos-11": ("macosx", "11"),
+    "macos-12": ("macosx", "12"),
+    "freebsd-131": ("freebsd", "13.1"),
+    "freebsd-123": ("freebsd", "12.3"),
+    "openbsd-7": ("openbsd", "7.3"),
+}
+
+# The ITYPE each CI bootstrap type ends up dispatching with, 'stable' installs onedir packages
+CI_ITYPES = {
+    "old-stable": "stable",
+    "stable": "onedir",
+    "git": "git",
+    "onedir": "onedir",
+    "onedir-rc": "onedir",
+}
+
+# Changed files which only matter to some of the test jobs, keyed by the generate.py distro list
+PLATFORM_FILES = {
+    "bootstrap-salt.ps1": "WINDOWS",
+    "kitchen.windows.yml": "WINDOWS",
+    "kitchen.macos.yml": "OSX",
+    "kitchen.bsd.yml": "BSD",
+    "kitchen.yml": "LINUX_DISTROS",
+}
+# Changed files which matter to every test job, see the collect-changed-files job in ci.yml
+TESTED_FILES = (
+    "bootstrap-salt.*",
+    "Gemfile",
+    "kitchen*.yml",
+    "tests/*",
+    ".github/workflows/*",
+)
+UNTESTED_FILES = (".github/workflows/release.yml",)
+
+
+@dataclass(frozen=True)
+class Target:
+    """
+    A distribution, as bootstrap-salt.sh names it after detection.
+    """
+
+    name: str
+    version: str = ""
+
+    @property
+    def major(self) -> str:
+        if not self.version:
+            return ""
+        return re.match(r"^[0-9]*", self.version).group(0)
+
+    @property
+    def minor(self) -> str:
+        if not self.version:
+            return ""
+        match = re.match(r"^[0-9]*.([0-9]*)", self.version)
+        return self.version if match is None else match.group(1)
+
+    def variables(self, itype: str) -> dict[str, str]:
+        """
+        The variables the ``*_FUNC_NAMES`` candidates are built from.
+        """
+        return {
+            "DISTRO_NAME_L": self.name,
+            "PREFIXED_DISTRO_MAJOR_VERSION": f"_{self.major}" if self.major else "",
+            "PREFIXED_DISTRO_MINOR_VERSION": f"_{self.minor}" if self.minor else "",
+            "ITYPE": itype,
+        }
+
+
+@dataclass
+class Function:
+    """
+    A top level function of the script, ``start`` and ``end`` being 1-based and inclusive.
+    """
+
+    name: str
+    start: int
+    end: int
+    calls: set[str] = field(default_factory=set)
+
+
+@dataclass
+class Script:
+    """
+    A parsed bootstrap-salt.sh.
+    """
+
+    lines: list[str]
+    functions: dict[str, Function]
+    # The functions referenced from the code outside of any function
+    main_calls: set[str]
+    # The candidate name templates of each *_FUNC_NAMES variable, in the order they are tried
+    candidates: dict[str, list[str]]
+    heredoc_lines: set[int]
+
+    def __post_init__(self):
+        self._owners: dict[int, str] = {}
+        for function in self.functions.values():
+            for lineno in range(function.start, function.end + 1):
+                self._owners[lineno] = function.name
+        self._reachable_cache: dict[tuple[Target, str], frozenset[str]] = {}
+
+    @classmethod
+    def parse(cls, text: str) -> Script:
+        lines = text.splitlines()
+        functions: dict[str, Function] = {}
+        main_words: set[str] = set()
+        candidates: dict[str, list[str]] = {}
+        heredoc_lines: set[int] = set()
+        words: dict[str, set[str]] = {}
+
+        current: Function | None = None
+        heredoc: tuple[bool, str] | None = None
+        for lineno, line in enumerate(lines, start=1):
+            if heredoc is not None:
+                heredoc_lines.add(lineno)
+                strip_tabs, delimiter = heredoc
+                if (line.lstrip("\t") if strip_tabs else line) == delimiter:
+                    heredoc = None
+                continue
+
+            if current is None:
+                match = FUNCTION_RE.match(line)
+                if match:
+                    current = Function(match.group(1), lineno, lineno)
+                    functions[current.name] = current
+                    words[current.name] = set()
+                    continue
+            elif FUNCTION_END_RE.match(line):
+                current.end = lineno
+                current = None
+                continue
+
+            code = "" if line.lstrip().startswith("#") else line
+            (main_words if current is None else words[current.name]).update(
+                WORD_RE.findall(code)
+            )
+            match = CANDIDATES_RE.match(line)
+            if match:
+                candidates.setdefault(match.group(1), []).extend(match.group(2).split())
+            match = HEREDOC_RE.search(code)
+            if match:
+                heredoc = (match.group(1) == "-", match.group(2))
+
+        if current is not None:
+            raise ValueError(
+                f"The {current.name} function starting on line {current.start} never ends"
+            )
+
+        for name, function in functions.items():
+            function.calls = (words[name] & functions.keys()) - {name}
+        return cls(
+            lines=lines,
+            functions=functions,
+            main_calls=main_words & functions.keys(),
+            candidates=candidates,
+            heredoc_lines=heredoc_lines,
+        )
+
+    def function_at(self, lineno: int) -> str | None:
+        """
+        The function a line belongs to, ``None`` for the code outside of any function.
+        """
+        return self._owners.get(lineno)
+
+    def reachable(self, roots) -> set[str]:
+        seen: set[str] = set()
+        pending = [name for name in roots if name in self.functions]
+        while pending:
+            name = pending.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            pending.extend(self.functions[name].calls - seen)
+        return seen
+
+    def dispatch(self, target: Target, itype: str) -> dict[str, str | None]:
+        """
+        The function each ``*_FUNC_NAMES`` variable resolves to, ``None`` when none is defined.
+        """
+        variables = target.variables(itype)
+        resolved: dict[str, str | None] = {}
+        for variable, templates in self.candidates.items():
+            resolved[variable] = None
+            for template in templates:
+                name = re.sub(r"\$\{(\w+)\}", lambda m: variables[m.group(1)], template)
+                if name in self.functions:
+                    resolved[variable] = name
+                    break
+        return resolved
+
+    def reachable_for(self, target: Target, itype: str) -> frozenset[str]:
+        """
+        The functions a run on the target distribution with the given ITYPE can call.
+        """
+        key = (target, itype)
+        if key not in self._reachable_cache:
+            roots = set(self.main_calls)
+            roots.update(name for name in self.dispatch(target, itype).values() if name)
+            self._reachable_cache[key] = frozenset(self.reachable(roots))
+        return self._reachable_cache[key]
+
+    def versions(self, name: str) -> list[str]:
+        """
+        The versions of a distribution which can dispatch differently, ``""`` standing for all the
+        others. Only the versions some function is named after can resolve to other functions.
+        """
+        pattern = re.compile(
+            rf"^(?:install|config|preseed|daemons_running)_{re.escape(name)}_(\d+)(?:_(\d+))?(?:_|$)"
+        )
+        versions = {""}
+        for function in self.functions:
+            match = pattern.match(function)
+            if match:
+                versions.add(match.group(1))
+                if match.group(2):
+                    versions.add(f"{match.group(1)}.{match.group(2)}")
+        return sorted(
+            versions, key=lambda v: [int(part) for part in v.split(".") if part]
+        )
+
+
+def resolution_table(script: Script, names=DISTRO_NAMES) -> list[dict]:
+    """
+    What the ``*_FUNC_NAMES`` variables resolve to for every distribution, version and ITYPE.
+    """
+    table = []
+    for name in names:
+        for version in script.versions(name):
+            for itype in ITYPES:
+                functions = script.dispatch(Target(name, version), itype)
+                table.append(
+                    {
+                        "distro": name,
+                        "version": version,
+                        "itype": itype,
+                        "supported": all(
+                            functions.get(variable) for variable in REQUIRED_FUNC_NAMES
+                        ),
+                        "functions": functions,
+                    }
+                )
+    return table
+
+
+def dead_functions(script: Script, table: list[dict]) -> list[str]:
+    """
+    The functions no supported combination of the resolution table can call.
+    """
+    roots = set(script.main_calls)
+    for entry in table:
+        if entry["supported"]:
+            roots.update(name for name in entry["functions"].values() if name)
+    return sorted(set(script.functions) - script.reachable(roots))
+
+
+def trim_script(script: Script, names: list[str]) -> str:
+    """
+    The script without the functions the given distributions can't call, whatever their version
+    and ITYPE. The documentation header of a removed function goes along with it.
+    """
+    keep: set[str] = set()
+    for name in names:
+        for version in script.versions(name):
+            for itype in ITYPES:
+                keep |= script.reachable_for(Target(name, version), itype)
+
+    drop: set[int] = set()
+    for function in script.functions.values():
+        if function.name in keep:
+            continue
+        start = function.start - 1
+        if start > 0 and script.lines[start - 1].startswith("#----"):
+            header = start - 2
+            while (
+                header > 0
+                and script.lines[header].startswith("#")
+                and not script.lines[header].startswith("#---  FUNCTION")
+            ):
+                header -= 1
+            if script.lines[header].startswith("#---  FUNCTION"):
+                start = header
+        drop.update(range(start, function.end))
+
+    lines = [line for idx, line in enumerate(script.lines) if idx not in drop]
+    lines.insert(1, f"# Trimmed down to the functions used on: {', '.join(names)}")
+    return "\n".join(lines) + "\n"
+
+
+def quoted_lines(script: Script) -> set[int]:
+    """
+    The lines starting in the middle of a quoted string, which must be kept as they are.
+
+    This is a rough lexer, only following quotes, escapes and comments, which is enough for the
+    code of bootstrap-salt.sh.
+    """
+    quoted: set[int] = set()
+    quote = None
+    for lineno, line in enumerate(script.lines, start=1):
+        if lineno in script.heredoc_lines:
+            continue
+        if quote is not None:
+            quoted.add(lineno)
+        idx = 0
+        while idx < len(line):
+            char = line[idx]
+            if quote is None:
+                if char == "#" and (idx == 0 or line[idx - 1] in " \t;(|&"):
+                    break
+                if char == "\\":
+                    idx += 1
+                elif char in "'\"":
+                    quote = char
+            elif char == quote:
+                quote = None
+            elif char == "\\" and quote == '"':
+                idx += 1
+            idx += 1
+    return quoted
+
+
+def minify_script(script: Script) -> str:
+    """
+    The script without its comments, blank lines and indentation, the leading comment block with
+    the license excepted. Here-documents and multi-line strings are left untouched.
+    """
+    verbatim = script.heredoc_lines | quoted_lines(script)
+    lines = []
+    header = True
+    for lineno, line in enumerate(script.lines, start=1):
+        stripped = line.strip()
+        if header and stripped.startswith("#"):
+            lines.append(line)
+            continue
+        header = False
+        if lineno in verbatim:
+            lines.append(line)
+        elif not stripped or stripped.startswith("#"):
+            continue
+        elif lines and lines[-1].endswith("\\"):
+            # The indentation of a continued line is part of the command
+            lines.append(line)
+        else:
+            lines.append(line.lstrip())
+    return "\n".join(lines) + "\n"
+
+
+def check_trimmed(script: Script, trimmed: Script, names: list[str]) -> str | None:
+    """
+    Describe the first combination the trimmed script dispatches differently, if any.
+    """
+    for name in names:
+        for version in script.versions(name):
+            for itype in ITYPES:
+                target = Target(name, version)
+                if trimmed.dispatch(target, itype) != script.dispatch(target, itype):
+                    return f"{name} {version or '*'} {itype}"
+    return None
+
+
+def build_variants(script: Script, output_dir: pathlib.Path) -> dict[str, pathlib.Path]:
+    """
+    Write the ``bootstrap-salt-<variant>.sh`` scripts and their index to the output directory.
+    """
+    paths: dict[str, pathlib.Path] = {}
+    index: dict[str, dict] = {}
+    for variant, names in VARIANTS.items():
+        trimmed = Script.parse(
+            minify_script(Script.parse(trim_script(script, list(names))))
+        )
+        mismatch = check_trimmed(script, trimmed, list(names))
+        if mismatch is not None:
+            raise RuntimeError(
+                f"The {variant} variant dispatches differently on {mismatch}"
+            )
+        path = output_dir / f"bootstrap-salt-{variant}.sh"
+        content = ("\n".join(trimmed.lines) + "\n").encode()
+        path.write_bytes(content)
+        paths[variant] = path
+        index[variant] = {
+            "file": path.name,
+            "sha256": hashlib.sha256(content).hexdigest(),
+            "size": len(content),
+            "distros": list(names),
+            "host_ids": list(VARIANT_HOST_IDS[variant]),
+        }
+
+    full = (tools.utils.REPO_ROOT / SCRIPT_NAME).read_bytes()
+    index_path = output_dir / VARIANTS_INDEX_NAME
+    index_path.write_text(
+        json.dumps(
+            {
+                "script": {
+                    "file": SCRIPT_NAME,
+                    "sha256": hashlib.sha256(full).hexdigest(),
+                    "size": len(full),
+                },
+                "variants": index,
+            },
+            indent=2,
+        )
+        + "\n"
+    )
+    paths["index"] = index_path
+    return paths
+
+
+def changed_lines(diff: str) -> tuple[dict[int, str], dict[int, str]]:
+    """
+    The lines removed from the old file and the lines added to the new file, by line number, of a
+    ``git diff -U0``.
+    """
+    removed: dict[int, str] = {}
+    added: dict[int, str] = {}
+    old_lineno = new_lineno = 0
+    for line in diff.splitlines():
+        match = HUNK_RE.match(line)
+        if match:
+            old_lineno, new_lineno = int(match.group(1)), int(match.group(2))
+        elif line.startswith(("---", "+++")) or not old_lineno and not new_lineno:
+            continue
+        elif line.startswith("-"):
+            removed[old_lineno] = line[1:]
+            old_lineno += 1
+        elif line.startswith("+"):
+            added[new_lineno] = line[1:]
+            new_lineno += 1
+    return removed, added
+
+
+def touched_functions(script: Script, lines: dict[int, str]) -> set[str | None]:
+    """
+    The functions the changed lines belong to, ``None`` standing for the code outside of any
+    function. Blank and comment lines are ignored, unless they are part of a here-document.
+    """
+    touched: set[str | None] = set()
+    for lineno, text in lines.items():
+        text = text.strip()
+        if lineno not in script.heredoc_lines and (not text or text.startswith("#")):
+            continue
+        touched.add(script.function_at(lineno))
+    return touched
+
+
+class Impact:
+    """
+    Which CI distributions and install types a change to bootstrap-salt.sh can affect.
+    """
+
+    def __init__(self, old: Script, new: Script, diff: str):
+        removed, added = changed_lines(diff)
+        self.scripts = (
+            (old, touched_functions(old, removed)),
+            (new, touched_functions(new, added)),
+        )
+        # A change outside of the functions, like the option parsing, affects every run
+        self.everything = any(None in touched for _, touched in self.scripts)
+
+    @property
+    def functions(self) -> set[str]:
+        return {name for _, touched in self.scripts for name in touched if name}
+
+    def affects(self, target: Target, itype: str) -> bool:
+        if self.everything:
+            return True
+        # Checking the old script too catches the removed and renamed functions
+        return any(
+            touched & script.reachable_for(target, itype)
+            for script, touched in self.scripts
+        )
+
+
+def load_generate_py():
+    """
+    Import the CI workflow generator, it is not part of a package.
+    """
+    spec = importlib.util.spec_from_file_location("generate", GENERATE_PY)
+    module = importlib.util.module_from_spec(spec)
+    # The dataclasses of the module look it up while it is being executed
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def instance_itype(generate, instance: str) -> str:
+    """
+    The ITYPE a test instance, like ``old-stable-3005`` or ``latest``, runs the script with.
+    """
+    if instance in ("latest", "default"):
+        return "onedir"
+    bootstrap_types = sorted(generate.BOOTSTRAP_TYPES, key=len, reverse=True)
+    for bootstrap_type in bootstrap_types:
+        if instance.startswith(f"{bootstrap_type}-"):
+            return CI_ITYPES[bootstrap_type]
+    raise ValueError(f"Unknown test instance: {instance}")
+
+
+def select_instances(
+    generate, jobs: list[dict], changed_files: list[str], impact: Impact | None
+) -> dict[str, list[str]]:
+    """
+    The test instances, per distribution, which the changed files can affect.
+    """
+    everything: set[str] = set()
+    for path in changed_files:
+        if path in UNTESTED_FILES or path == SCRIPT_NAME:
+            continue
+        if path in PLATFORM_FILES:
+            everything.update(getattr(generate, PLATFORM_FILES[path]))
+        elif any(fnmatch.fnmatch(path, pattern) for pattern in TESTED_FILES):
+            everything.update(job["distro"] for job in jobs)
+
+    selected: dict[str, list[str]] = {}
+    for job in jobs:
+        distro = job["distro"]
+        if distro in everything:
+            selected[distro] = list(job["instances"])
+            continue
+        if impact is None or distro not in CI_TARGETS:
+            continue
+        target = Target(*CI_TARGETS[distro])
+        instances = [
+            instance
+            for instance in job["instances"]
+            if impact.affects(target, instance_itype(generate, instance))
+        ]
+        if instances:
+            selected[distro] = instances
+    return selected
+
+
+def trace_command(words: list[str]) -> str | None:
+    """
+    The command a traced line runs, skipping the variable assignments in front of it.
+    """
+    for word in words:
+        if not ASSIGNMENT_RE.match(word):
+            return word
+    return None
+
+
+def profile_trace(lines, functions: set[str]) -> dict[tuple[str, str], dict]:
+    """
+    Roll up a ``BS_PROFILE_TRACE`` trace into the external commands run per calling function.
+
+    A command is charged the time until the next traced line. That is exact for commands run
+    one after the other, like those of command substitutions, and approximate for pipelines,
+    whose commands are traced up front and then run concurrently.
+    """
+    entries = []
+    for line in lines:
+        match = TRACE_RE.match(line)
+        if match is None:
+            # The continuation of a multi-line command
+            continue
+        _, timestamp, caller, _, command = match.groups()
+        entries.append((float(timestamp.replace(",", ".")), caller, command))
+
+    stats: dict[tuple[str, str], dict] = {}
+    for idx, (timestamp, caller, command) in enumerate(entries):
+        try:
+            words = shlex.split(command)
+        except ValueError:
+            # Unbalanced quotes, from a value spanning multiple lines
+            words = [word.strip("'\"") for word in command.split()]
+        name = trace_command(words)
+        if name is None or name in SHELL_BUILTINS or name in functions:
+            continue
+        name = name.rsplit("/", 1)[-1]
+        elapsed = 0.0
+        if idx + 1 < len(entries):
+            # Concurrent subshells can write their lines slightly out of order
+            elapsed = max(0.0, entries[idx + 1][0] - timestamp)
+        entry = stats.setdefault((caller, name), {"count": 0, "seconds": 0.0})
+        entry["count"] += 1
+        entry["seconds"] += elapsed
+    return stats
+
+
+@analyze.command(
+    name="impact",
+    arguments={
+        "base": {
+            "help": "The git revision to compare against, usually the pull request's target branch.",
+        },
+        "output": {
+            "help": "Also write the selected test instances, per distribution, to this JSON file.",
+        },
+    },
+)
+def impact(ctx: Context, base: str = "origin/develop", output: pathlib.Path = None):
+    """
+    Select the CI test instances a change can affect.
+
+    The functions of bootstrap-salt.sh touched since the merge base are mapped to the distributions
+    and install types whose dispatched functions can reach them.
+    """
+    ret = ctx.run("git", "merge-base", base, "HEAD", capture=True, check=False)
+    if ret.returncode != 0:
+        ctx.error(f"Failed to find the merge base of {base} and HEAD")
+        ctx.exit(1)
+    merge_base = ret.stdout.decode().strip()
+
+    ret = ctx.run("git", "diff", "--name-only", merge_base, capture=True)
+    changed_files = ret.stdout.decode().split()
+
+    analysis = None
+    if SCRIPT_NAME in changed_files:
+        ret = ctx.run(
+            "git", "show", f"{merge_base}:{SCRIPT_NAME}", capture=True, check=False
+        )
+        old = Script.parse(ret.stdout.decode() if ret.returncode == 0 else "")
+        new = Script.parse((tools.utils.REPO_ROOT / SCRIPT_NAME).read_text())
+        ret = ctx.run("git", "diff", "-U0", merge_base, "--", SCRIPT_NAME, capture=True)
+        analysis = Impact(old, new, ret.stdout.decode())
+        if analysis.everything:
+            ctx.info(
+                f"Changes outside of the functions of {SCRIPT_NAME} affect every test"
+            )
+        else:
+            ctx.info(
+                f"Touched functions: {', '.join(sorted(analysis.functions)) or 'none'}"
+            )
+
+    generate = load_generate_py()
+    jobs = [job for job in generate.Matrix().jobs() if not job["push_only"]]
+    selected = select_instances(generate, jobs, changed_files, analysis)
+
+    table = Table(title=f"Tests affected by the changes since {base}")
+    table.add_column("Distribution")
+    table.add_column("Instances")
+    table.add_column("Of")
+    for job in jobs:
+        instances = selected.get(job["distro"], [])
+        table.add_row(
+            job["distro"], ", ".join(instances) or "-", str(len(job["instances"]))
+        )
+    ctx.print(table)
+    total = sum(len(job["instances"]) for job in jobs)
+    ctx.info(
+        f"Selected {sum(len(v) for v in selected.values())} of {total} test instances"
+    )
+
+    if output is not None:
+        output.write_text(json.dumps(selected) + "\n")
+
+
+@analyze.command(
+    name="resolve",
+    arguments={
+        "output": {
+            "help": "Also write the resolution table and the dead functions to this JSON file.",
+        },
+    },
+)
+def resolve(ctx: Context, output: pathlib.Path = None):
+    """
+    Resolve the functions bootstrap-salt.sh dispatches to for every distribution, version and ITYPE.
+
+    The combinations without a dependencies or an install function are reported as unsupported,
+    the functions none of the supported combinations can call as dead.
+    """
+    script = Script.parse((tools.utils.REPO_ROOT / SCRIPT_NAME).read_text())
+    table = resolution_table(script)
+    dead = dead_functions(script, table)
+
+    summary = Table(title="Supported install types")
+    summary.add_column("Distribution")
+    summary.add_column("Version")
+    for itype in ITYPES:
+        summary.add_column(itype, justify="center")
+    rows: dict[tuple[str, str], dict[str, bool]] = {}
+    for entry in table:
+        rows.setdefault((entry["distro"], entry["version"]), {})[
+            entry["itype"]
+        ] = entry["supported"]
+    for (name, version), supported in rows.items():
+        summary.add_row(
+            name,
+            version or "*",
+            *["yes" if supported[itype] else "-" for itype in ITYPES],
+        )
+    ctx.print(summary)
+
+    unsupported = sum(1 for entry in table if not entry["supported"])
+    ctx.info(
+        f"{len(table)} combinations, {unsupported} unsupported, {len(dead)} dead functions"
+    )
+    for name in dead:
+        function = script.functions[name]
+        ctx.warn(f"Dead function: {name} (lines {function.start}-{function.end})")
+
+    if output is not None:
+        output.write_text(
+            json.dumps({"combinations": table, "dead_functions": dead}, indent=2) + "\n"
+        )
+        ctx.info(f"Wrote {output}")
+
+
+@analyze.command(
+    name="trim",
+    arguments={
+        "distro": {
+            "help": "The distributions, as DISTRO_NAME_L, to keep the functions of.",
+            "nargs": "+",
+            "choices": DISTRO_NAMES,
+        },
+        "output": {
+            "help": "Where to write the trimmed script. Defaults to 'bootstrap-salt-<distro>.sh'.",
+        },
+    },
+)
+def trim(ctx: Context, distro: list[str], output: pathlib.Path = None):
+    """
+    Write a bootstrap-salt.sh keeping only the functions the given distributions can call.
+    """
+    script = Script.parse((tools.utils.REPO_ROOT / SCRIPT_NAME).read_text())
+    trimmed = Script.parse(trim_script(script, distro))
+    # The trimmed script must dispatch exactly like the full one on the kept distributions
+    mismatch = check_trimmed(script, trimmed, distro)
+    if mismatch is not None:
+        ctx.error(f"The trimmed script dispatches differently on {mismatch}")
+        ctx.exit(1)
+
+    if output is None:
+        output = pathlib.Path(f"bootstrap-salt-{distro[0]}.sh")
+    output.write_text("\n".join(trimmed.lines) + "\n")
+    ctx.run("sh", "-n", str(output))
+    ctx.info(
+        f"Wrote {output}: {len(trimmed.functions)} of {len(script.functions)} functions, "
+        f"{output.stat().st_size} bytes"
+    )
+
+
+@analyze.command(
+    name="variants",
+    arguments={
+        "output_dir": {
+            "help": "Where to write the variants and their index. Defaults to the repository root.",
+        },
+    },
+)
+def variants(ctx: Context, output_dir: pathlib.Path = None):
+    """
+    Write the per distribution variants of bootstrap-salt.sh the releases publish.
+    """
+    if output_dir is None:
+        output_dir = tools.utils.REPO_ROOT
+    output_dir.mkdir(parents=True, exist_ok=True)
+    script = Script.parse((tools.utils.REPO_ROOT / SCRIPT_NAME).read_text())
+    try:
+        paths = build_variants(script, output_dir)
+    except RuntimeError as exc:
+        ctx.error(str(exc))
+        ctx.exit(1)
+
+    for variant, path in paths.items():
+        if variant != "index":
+            ctx.run("sh", "-n", str(path))
+        ctx.info(f"Wrote {path}: {path.stat().st_size} bytes")
+
+
+@analyze.command(
+    name="profile",
+    arguments={
+        "trace": {
+            "help": "The BS_PROFILE_TRACE file of a 'bash bootstrap-salt.sh' run.",
+        },
+        "top": {
+            "help": "How many of the costliest function and command pairs to show.",
+        },
+        "output": {
+            "help": "Also write the whole profile to this JSON file.",
+        },
+    },
+)
+def profile(
+    ctx: Context, trace: pathlib.Path, top: int = 25, output: pathlib.Path = None
+):
+    """
+    Rank the external commands a bootstrap-salt.sh run forked, per calling function.
+
+    Record the trace with 'BS_PROFILE_TRACE=<file> bash bootstrap-salt.sh ...'.
+    """
+    script = Script.parse((tools.utils.REPO_ROOT / SCRIPT_NAME).read_text())
+    with trace.open(errors="replace") as rfh:
+        stats = profile_trace(rfh, set(script.functions))
+    if not stats:
+        ctx.error(
+            f"No external commands found in {trace}, was the script run with bash?"
+        )
+        ctx.exit(1)
+
+    ranked = sorted(stats.items(), key=lambda item: item[1]["seconds"], reverse=True)
+    callers: dict[str, dict] = {}
+    for (caller, _), entry in ranked:
+        totals = callers.setdefault(caller, {"count": 0, "seconds": 0.0})
+        totals["count"] += entry["count"]
+        totals["seconds"] += entry["seconds"]
+
+    table = Table(title=f"Top {min(top, len(ranked))} external commands")
+    table.add_column("Function")
+    table.add_column("Command")
+    table.add_column("Count", justify="right")
+    table.add_column("Total", justify="right")
+    table.add_column("Mean", justify="right")
+    for (caller, name), entry in ranked[:top]:
+        table.add_row(
+            caller,
+            name,
+            str(entry["count"]),
+            f"{entry['seconds']:.3f}s",
+            f"{entry['seconds'] * 1000 / entry['count']:.1f}ms",
+        )
+    ctx.print(table)
+
+    table = Table(title=f"Top {min(top, len(callers))} functions by forks")
+    table.add_column("Function")
+    table.add_column("Forks", justify="right")
+    table.add_column("Total", justify="right")
+    for caller, totals in sorted(
+        callers.items(), key=lambda item: item[1]["count"], reverse=True
+    )[:top]:
+        table.add_row(caller, str(totals["count"]), f"{totals['seconds']:.3f}s")
+    ctx.print(table)
+
+    forks = sum(entry["count"] for entry in stats.values())
+    seconds = sum(entry["seconds"] for entry in stats.values())
+    ctx.info(f"{forks} external commands, {seconds:.1f}s in total")
+
+    if output is not None:
+        output.write_text(
+            json.dumps(
+                {
+                    "commands": [
+                        {"function": caller, "command": name, **entry}
+                        for (caller, name), entry in ranked
+                    ],
+                    "functions": callers,
+                },
+                indent=2,
+            )
+            + "\n"
+        )
+        ctx.info(f"Wrote {output}")
@@ -0,0 +1,516 @@
+"""
+These commands are used to benchmark Salt Bootstrap in local containers.
+
+Every run records the wall time, the per phase durations and download counters of the
+``BS_REPORT_FILE`` run report, the bytes the container received and how many processes
+the run started. Salt's packages are served from a local mirror, so that the results don't
+depend on the network, and the results are compared against a baseline to flag regressions.
+"""
+# pylint: disable=resource-leakage,broad-except,3rd-party-module-not-gated
+from __future__ import annotations
+
+import contextlib
+import datetime
+import functools
+import hashlib
+import http.server
+import json
+import logging
+import pathlib
+import shlex
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from dataclasses import field
+
+import yaml
+from ptscripts import command_group
+from ptscripts import Context
+from rich.table import Table
+
+import tools.analyze
+import tools.report
+import tools.utils
+
+log = logging.getLogger(__name__)
+
+# Define the command group
+benchmark = command_group(
+    name="benchmark",
+    help="Benchmark Related Commands",
+    description=__doc__,
+)
+
+REPORT_PATH = "/tmp/bootstrap-report.json"
+SCRIPT_PATH = "/tmp/bootstrap-salt.sh"
+# The containers don't run an init system, so don't try to start the daemons
+DEFAULT_BOOTSTRAP_ARGS = ("-X",)
+# Metrics which are not durations in milliseconds
+COUNTER_METRICS = frozenset(tools.report.COUNTERS) | {
+    "received_bytes",
+    "mirror_bytes",
+    "processes",
+}
+
+
+@dataclass(frozen=True)
+class Platform:
+    """
+    A CI test distribution, and how to get a container of it.
+    """
+
+    slug: str
+    image: str
+    provision_commands: tuple[str, ...] = ()
+
+
+def load_platforms(slugs: list[str] | None = None) -> list[Platform]:
+    """
+    The Linux distributions of the CI workflow generator, with the container images and
+    provisioning commands of their test-kitchen platforms.
+    """
+    generate = tools.analyze.load_generate_py()
+    kitchen = yaml.safe_load((tools.utils.REPO_ROOT / "kitchen.yml").read_text())
+    # test-kitchen drops the dots of the platform names in its instance names
+    kitchen_platforms = {
+        entry["name"].replace(".", ""): entry for entry in kitchen["platforms"]
+    }
+    platforms = []
+    for slug in generate.LINUX_DISTROS:
+        if slugs and slug not in slugs:
+            continue
+        entry = kitchen_platforms.get(slug, {"name": slug})
+        driver = entry.get("driver") or {}
+        # Like kitchen-docker, default to the "<name>:<version>" image
+        image = driver.get("image") or ":".join(entry["name"].rsplit("-", 1))
+        platforms.append(
+            Platform(
+                slug=slug,
+                image=image,
+                provision_commands=tuple(driver.get("provision_command") or ()),
+            )
+        )
+    return platforms
+
+
+class MirrorHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        log.debug("Mirror: " + format, *args)
+
+    def copyfile(self, source, outputfile):
+        position = source.tell()
+        super().copyfile(source, outputfile)
+        with self.server.lock:
+            self.server.served_bytes += source.tell() - position
+
+
+class Mirror(http.server.ThreadingHTTPServer):
+    """
+    Serve a local copy of ``repo.saltproject.io`` to the containers, counting the bytes served.
+    """
+
+    def __init__(self, directory: pathlib.Path, port: int = 0):
+        super().__init__(
+            ("0.0.0.0", port),
+            functools.partial(MirrorHandler, directory=str(directory)),
+        )
+        self.lock = threading.Lock()
+        self.served_bytes = 0
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+@dataclass
+class BenchmarkRun:
+    """
+    Run ``bootstrap-salt.sh`` once in a fresh container and measure it.
+    """
+
+    ctx: Context
+    platform: Platform
+    install_type: str
+    script: pathlib.Path
+    bootstrap_args: list[str]
+    log_dir: pathlib.Path
+    mirror: Mirror | None = None
+    docker: list[str] = field(default_factory=lambda: ["docker"])
+
+    def _exec(self, container: str, command: str, **kwargs):
+        return self.ctx.run(
+            *self.docker, "exec", container, "sh", "-c", command, **kwargs
+        )
+
+    def _counter(self, container: str, command: str) -> int:
+        ret = self._exec(container, command, capture=True, check=False)
+        try:
+            return int(ret.stdout.decode().strip())
+        except ValueError:
+            return 0
+
+    def run(self) -> dict:
+        container = (
+            f"salt-bootstrap-benchmark-{self.platform.slug}-{uuid.uuid4().hex[:8]}"
+        )
+        cmdline = ["sh", SCRIPT_PATH, *self.bootstrap_args]
+        if self.mirror is not None:
+            port = self.mirror.server_address[1]
+            cmdline += ["-l", "-R", f"host.docker.internal:{port}"]
+        cmdline += shlex.split(self.install_type)
+
+        self.ctx.run(
+            *self.docker,
+            "run",
+            "--detach",
+            "--privileged",
+            "--add-host",
+            "host.docker.internal:host-gateway",
+            "--name",
+            container,
+            "--entrypoint",
+            "sleep",
+            self.platform.image,
+            "infinity",
+        )
+        try:
+            for command in self.platform.provision_commands:
+                # They were written for kitchen-docker images, failures are not fatal here
+                self._exec(container, command, capture=True, check=False)
+            self.ctx.run(
+                *self.docker, "cp", str(self.script), f"{container}:{SCRIPT_PATH}"
+            )
+
+            received = self._counter(
+                container, "cat /sys/class/net/eth0/statistics/rx_bytes"
+            )
+            served = self.mirror.served_bytes if self.mirror is not None else 0
+            # The container has its own PID namespace, so the PIDs handed out between these
+            # two markers tell how many processes the run started
+            first_pid = self._counter(container, "echo $$")
+            start = time.monotonic()
+            ret = self.ctx.run(
+                *self.docker,
+                "exec",
+                "--env",
+                f"BS_REPORT_FILE={REPORT_PATH}",
+                container,
+                *cmdline,
+                capture=True,
+                check=False,
+            )
+            wall_time_ms = int((time.monotonic() - start) * 1000)
+            processes = self._counter(container, "echo $$") - first_pid - 1
+            received = (
+                self._counter(container, "cat /sys/class/net/eth0/statistics/rx_bytes")
+                - received
+            )
+
+            log_file = (
+                self.log_dir
+                / f"{self.platform.slug}-{'-'.join(shlex.split(self.install_type))}.log"
+            )
+            log_file.write_bytes(ret.stdout + ret.stderr)
+            report_ret = self._exec(
+                container, f"cat {REPORT_PATH}", capture=True, check=False
+            )
+            try:
+                report = json.loads(report_ret.stdout)
+            except ValueError:
+                report = {}
+        finally:
+            self.ctx.run(*self.docker, "rm", "--force", container, capture=True)
+
+        metrics = {
+            name: values[0]
+            for name, values in tools.report.collect_metrics([report]).items()
+        }
+        metrics.update(
+            wall_time_ms=wall_time_ms,
+            received_bytes=received,
+            processes=processes,
+        )
+        if self.mirror is not None:
+            metrics["mirror_bytes"] = self.mirror.served_bytes - served
+        return {
+            "platform": self.platform.slug,
+            "image": self.platform.image,
+            "install_type": self.install_type,
+            "exit_code": ret.returncode,
+            "metrics": metrics,
+            "log_file": str(log_file),
+        }
+
+
+def median_result(results: list[dict]) -> dict:
+    """
+    Fold repeated runs of the same benchmark into one, keeping the median of every metric.
+    """
+    ret = dict(results[0])
+    ret["exit_code"] = max(result["exit_code"] for result in results)
+    ret["runs"] = len(results)
+    names = {name for result in results for name in result["metrics"]}
+    ret["metrics"] = {
+        name: tools.report.percentile(
+            [result["metrics"].get(name, 0) for result in results], 50
+        )
+        for name in sorted(names)
+    }
+    return ret
+
+
+def compare_results(
+    baseline: dict, current: dict, threshold: float, min_duration_ms: int
+) -> list[dict]:
+    """
+    Compare every metric of the benchmarks present in both result sets.
+
+    A metric regressed when it grew by more than ``threshold`` percent. Durations must also
+    have grown by at least ``min_duration_ms``, to not flag jitter on short phases. A run
+    which used to succeed and now fails always regressed.
+    """
+    baseline_results = {
+        (result["platform"], result["install_type"]): result
+        for result in baseline["results"]
+    }
+    rows = []
+    for result in current["results"]:
+        key = (result["platform"], result["install_type"])
+        base = baseline_results.get(key)
+        if base is None:
+            continue
+        if result["exit_code"] and not base["exit_code"]:
+            rows.append(
+                {
+                    "platform": key[0],
+                    "install_type": key[1],
+                    "metric": "exit_code",
+                    "baseline": base["exit_code"],
+                    "current": result["exit_code"],
+                    "change": None,
+                    "regressed": True,
+                }
+            )
+        for name, value in result["metrics"].items():
+            if name not in base["metrics"]:
+                continue
+            base_value = base["metrics"][name]
+            delta = value - base_value
+            change = delta * 100 / base_value if base_value else None
+            regressed = delta > 0 and (change is None or change > threshold)
+            if name not in COUNTER_METRICS and delta < min_duration_ms:
+                regressed = False
+            rows.append(
+                {
+                    "platform": key[0],
+                    "install_type": key[1],
+                    "metric": name,
+                    "baseline": base_value,
+                    "current": value,
+                    "change": change,
+                    "regressed": regressed,
+                }
+            )
+    return rows
+
+
+def print_comparison(ctx: Context, rows: list[dict], show_all: bool = False):
+    table = Table(title="Benchmark comparison")
+    for column in ("Platform", "Install Type", "Metric"):
+        table.add_column(column)
+    for column in ("Baseline", "Current", "Change"):
+        table.add_column(column, justify="right")
+    for row in rows:
+        if not show_all and not row["regressed"]:
+            continue
+        change = "new" if row["change"] is None else f"{row['change']:+.1f}%"
+        style = "red" if row["regressed"] else None
+        table.add_row(
+            row["platform"],
+            row["install_type"],
+            row["metric"],
+            f"{row['baseline']:.0f}",
+            f"{row['current']:.0f}",
+            change,
+            style=style,
+        )
+    ctx.print(table)
+
+
+@benchmark.command(
+    name="run",
+    arguments={
+        "platform": {
+            "help": (
+                "CI distribution slug to benchmark, e.g. 'debian-11'. Can be passed multiple "
+                "times. Defaults to all the Linux distributions of the CI workflow generator."
+            ),
+            "action": "append",
+        },
+        "install_type": {
+            "help": (
+                "Install type, and its arguments, to benchmark, e.g. 'onedir' or 'stable 3006'. "
+                "Can be passed multiple times. Default: onedir."
+            ),
+            "action": "append",
+        },
+        "bootstrap_args": {
+            "help": "Extra arguments passed to bootstrap-salt.sh. Default: -X.",
+            "nargs": "*",
+        },
+        "repeat": {
+            "help": "How many times to run each benchmark. The median of the runs is kept.",
+        },
+        "mirror": {
+            "help": (
+                "Directory with a copy of repo.saltproject.io to serve to the containers. "
+                "bootstrap-salt.sh gets pointed at it with '-R'."
+            ),
+        },
+        "mirror_port": {
+            "help": "The port to serve the mirror on. Default: any free port.",
+        },
+        "script": {
+            "help": "The bootstrap script to benchmark.",
+        },
+        "output": {
+            "help": "Where to write the JSON results.",
+        },
+        "log_dir": {
+            "help": "Directory where the bootstrap-salt.sh output of every run is written.",
+        },
+        "baseline": {
+            "help": "Results of a previous run to compare against. Regressions fail the command.",
+        },
+        "threshold": {
+            "help": "How much, in percent, a metric can grow before it is a regression.",
+        },
+        "min_duration_ms": {
+            "help": "How much, in milliseconds, a duration must grow to be a regression.",
+        },
+    },
+)
+def run(
+    ctx: Context,
+    bootstrap_args: list[str],
+    platform: list[str] = None,
+    install_type: list[str] = None,
+    repeat: int = 1,
+    mirror: pathlib.Path = None,
+    mirror_port: int = 0,
+    script: pathlib.Path = tools.utils.REPO_ROOT / "bootstrap-salt.sh",
+    output: pathlib.Path = pathlib.Path("benchmark-results.json"),
+    log_dir: pathlib.Path = pathlib.Path("benchmark-logs"),
+    baseline: pathlib.Path = None,
+    threshold: float = 10.0,
+    min_duration_ms: int = 1000,
+):
+    """
+    Benchmark bootstrap-salt.sh on the CI distributions, in local containers.
+    """
+    platforms = load_platforms(platform)
+    unknown = set(platform or ()) - {entry.slug for entry in platforms}
+    if unknown:
+        ctx.error(f"Unknown platforms: {', '.join(sorted(unknown))}")
+        ctx.exit(1)
+    if mirror is not None and not mirror.is_dir():
+        ctx.error(f"The mirror directory {mirror} does not exist")
+        ctx.exit(1)
+    log_dir.mkdir(parents=True, exist_ok=True)
+
+    results = []
+    server_context = (
+        Mirror(mirror, mirror_port) if mirror is not None else contextlib.nullcontext()
+    )
+    with server_context as server:
+        for entry in platforms:
+            for itype in install_type or ("onedir",):
+                runs = []
+                for attempt in range(1, max(1, repeat) + 1):
+                    ctx.info(
+                        f"Benchmarking {itype!r} on {entry.slug} ({entry.image}), run {attempt} ..."
+                    )
+                    runs.append(
+                        BenchmarkRun(
+                            ctx,
+                            platform=entry,
+                            install_type=itype,
+                            script=script,
+                            bootstrap_args=list(
+                                bootstrap_args or DEFAULT_BOOTSTRAP_ARGS
+                            ),
+                            log_dir=log_dir,
+                            mirror=server,
+                        ).run()
+                    )
+                result = median_result(runs)
+                if result["exit_code"]:
+                    ctx.warn(f"The run failed, see {result['log_file']}")
+                results.append(result)
+
+    data = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "script_sha256": hashlib.sha256(script.read_bytes()).hexdigest(),
+        "results": results,
+    }
+    output.write_text(json.dumps(data, indent=2) + "\n")
+    ctx.info(f"Wrote {output}")
+
+    if baseline is not None:
+        rows = compare_results(
+            json.loads(baseline.read_text()), data, threshold, min_duration_ms
+        )
+        print_comparison(ctx, rows)
+        regressions = [row for row in rows if row["regressed"]]
+        if regressions:
+            ctx.exit(1, f"{len(regressions)} metrics regressed")
+    ctx.exit(0)
+
+
+@benchmark.command(
+    name="compare",
+    arguments={
+        "baseline": {
+            "help": "The baseline results.",
+        },
+        "current": {
+            "help": "The results to check for regressions.",
+        },
+        "threshold": {
+            "help": "How much, in percent, a metric can grow before it is a regression.",
+        },
+        "min_duration_ms": {
+            "help": "How much, in milliseconds, a duration must grow to be a regression.",
+        },
+        "show_all": {
+            "help": "Show every metric, not only the regressions.",
+        },
+    },
+)
+def compare(
+    ctx: Context,
+    baseline: pathlib.Path,
+    current: pathlib.Path,
+    threshold: float = 10.0,
+    min_duration_ms: int = 1000,
+    show_all: bool = False,
+):
+    """
+    Compare two sets of benchmark results and fail on regressions.
+    """
+    rows = compare_results(
+        json.loads(baseline.read_text()),
+        json.loads(current.read_text()),
+        threshold,
+        min_duration_ms,
+    )
+    print_comparison(ctx, rows, show_all=show_all)
+    regressions = [row for row in rows if row["regressed"]]
+    if regressions:
+        ctx.exit(1, f"{len(regressions)} metrics regressed")
+    ctx.exit(0, "No regressions")
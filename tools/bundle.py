@@ -0,0 +1,550 @@
+"""
+These commands are used to build offline bundles for Salt Bootstrap.
+
+An offline bundle is a single tarball holding the onedir packages, the repository
+signing keys and the repository metadata for one distribution, version, architecture
+and Salt revision. ``bootstrap-salt.sh -B <bundle>`` installs from it without any
+network access.
+"""
+# pylint: disable=resource-leakage,broad-except,3rd-party-module-not-gated
+from __future__ import annotations
+
+import bz2
+import gzip
+import hashlib
+import json
+import logging
+import lzma
+import pathlib
+import re
+import tarfile
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from dataclasses import field
+
+import requests
+from ptscripts import command_group
+from ptscripts import Context
+
+import tools.utils
+
+log = logging.getLogger(__name__)
+
+# Define the command group
+bundle = command_group(
+    name="bundle",
+    help="Offline Bundle Related Commands",
+    description=__doc__,
+)
+
+DEB_DISTROS = ("debian", "ubuntu")
+RPM_DISTROS = ("amazon", "fedora", "photon", "redhat")
+# Distributions which bootstrap-salt.sh points at the 'redhat' repository
+REDHAT_ALIASES = (
+    "almalinux",
+    "centos",
+    "centosstream",
+    "oraclelinux",
+    "rhel",
+    "rockylinux",
+)
+# Names of the apt repository suites, bootstrap-salt.sh reads them from the host
+CODENAMES = {
+    "debian": {
+        "10": "buster",
+        "11": "bullseye",
+        "12": "bookworm",
+    },
+    "ubuntu": {
+        "18.04": "bionic",
+        "20.04": "focal",
+        "22.04": "jammy",
+        "23.04": "lunar",
+    },
+}
+SALT_PACKAGES = (
+    "salt-api",
+    "salt-cloud",
+    "salt-master",
+    "salt-minion",
+    "salt-ssh",
+    "salt-syndic",
+)
+RPM_NS = {
+    "common": "http://linux.duke.edu/metadata/common",
+    "repo": "http://linux.duke.edu/metadata/repo",
+    "rpm": "http://linux.duke.edu/metadata/rpm",
+}
+
+
+@dataclass
+class Package:
+    """
+    A package found in the repository metadata.
+    """
+
+    name: str
+    version: str
+    location: str
+    sha256: str | None = None
+    size: int | None = None
+    depends: list[str] = field(default_factory=list)
+
+    @property
+    def filename(self) -> str:
+        return self.location.rsplit("/", 1)[-1]
+
+
+@dataclass
+class Repository:
+    """
+    Where bootstrap-salt.sh would find the onedir packages.
+    """
+
+    distro: str
+    version: str
+    arch: str
+    rev: str
+    url: str
+    keys: list[str]
+    codename: str | None = None
+
+    @property
+    def package_format(self) -> str:
+        return "deb" if self.distro in DEB_DISTROS else "rpm"
+
+
+def onedir_rev(salt_version: str) -> str:
+    """
+    Translate a Salt version into ``ONEDIR_REV`` the same way bootstrap-salt.sh does.
+    """
+    if re.match(r"^(nightly|latest|3005|3006)$", salt_version):
+        return salt_version
+    if re.match(r"^3005(\.[0-9]*)?", salt_version):
+        return "minor/" + re.sub(r"^(3005)\.0$", r"\1", salt_version)
+    if re.match(r"^[3-9][0-9]{3}(\.[0-9]*)?", salt_version) or "rc" in salt_version:
+        return f"minor/{salt_version}"
+    raise ValueError(
+        f"Unknown onedir version: {salt_version} (valid: 3005, 3006, latest, nightly)"
+    )
+
+
+def resolve_repository(
+    distro: str,
+    version: str,
+    arch: str,
+    salt_version: str,
+    repo_url: str = "repo.saltproject.io",
+    http: str = "https",
+    rc: bool = False,
+) -> Repository:
+    """
+    Build the repository URL and signing key names like ``__install_saltstack_*_onedir_repository``.
+    """
+    if distro in REDHAT_ALIASES:
+        distro = "redhat"
+    if distro not in DEB_DISTROS + RPM_DISTROS:
+        raise ValueError(f"Offline bundles are not supported for {distro}")
+
+    rev = onedir_rev(salt_version)
+    major = version.split(".")[0]
+    codename = None
+    if distro == "ubuntu":
+        # Same workaround for the non-LTS releases as bootstrap-salt.sh
+        if version == "20.10" or major == "21":
+            version = "20.04"
+        codename = CODENAMES["ubuntu"].get(version)
+    elif distro == "debian":
+        version = major
+        codename = CODENAMES["debian"].get(version)
+    elif distro == "amazon":
+        version = "2"
+    else:
+        version = major
+
+    if distro in DEB_DISTROS and codename is None:
+        raise ValueError(f"Don't know the codename of {distro} {version}")
+
+    onedir_dir = "salt_rc/salt" if rc else "salt"
+    if rev == "nightly":
+        url = (
+            f"{http}://{repo_url}/salt-dev/{onedir_dir}/py3/{distro}/{version}/{arch}/"
+        )
+    else:
+        url = f"{http}://{repo_url}/{onedir_dir}/py3/{distro}/{version}/{arch}/{rev}/"
+
+    legacy = re.search(r"(3004|3005)", rev) is not None
+    if distro in DEB_DISTROS:
+        if legacy:
+            keys = ["salt-archive-keyring.gpg"]
+        elif rev in ("latest", "nightly"):
+            keys = ["salt-archive-keyring.gpg", "SALT-PROJECT-GPG-PUBKEY-2023.gpg"]
+        else:
+            keys = ["SALT-PROJECT-GPG-PUBKEY-2023.gpg"]
+    elif distro in ("redhat", "amazon") and (legacy or rev == "nightly"):
+        keys = ["SALTSTACK-GPG-KEY2.pub" if major == "9" else "SALTSTACK-GPG-KEY.pub"]
+    else:
+        keys = ["SALT-PROJECT-GPG-PUBKEY-2023.pub"]
+
+    return Repository(
+        distro=distro,
+        version=version,
+        arch=arch,
+        rev=rev,
+        url=url,
+        keys=keys,
+        codename=codename,
+    )
+
+
+def version_key(version: str) -> tuple[int | str, ...]:
+    """
+    A sort key good enough to pick the newest Salt package out of a repository.
+    """
+    return tuple(
+        int(part) if part.isdigit() else part
+        for part in re.findall(r"\d+|[a-z]+", version)
+    )
+
+
+def decompress(path: str, content: bytes) -> bytes:
+    if path.endswith(".gz"):
+        return gzip.decompress(content)
+    if path.endswith(".xz"):
+        return lzma.decompress(content)
+    if path.endswith(".bz2"):
+        return bz2.decompress(content)
+    return content
+
+
+def parse_packages_index(content: str) -> list[Package]:
+    """
+    Parse an apt ``Packages`` index.
+    """
+    packages = []
+    for stanza in content.strip().split("\n\n"):
+        fields: dict[str, str] = {}
+        for line in stanza.splitlines():
+            if not line or line[0].isspace() or ":" not in line:
+                continue
+            key, value = line.split(":", 1)
+            fields[key] = value.strip()
+        if "Package" not in fields or "Filename" not in fields:
+            continue
+        depends = []
+        for dependency in fields.get("Depends", "").split(","):
+            # Keep the first alternative, without the version constraint
+            name = dependency.split("|")[0].split("(")[0].strip()
+            if name:
+                depends.append(name)
+        packages.append(
+            Package(
+                name=fields["Package"],
+                version=fields.get("Version", "0"),
+                location=fields["Filename"],
+                sha256=fields.get("SHA256"),
+                size=int(fields["Size"]) if "Size" in fields else None,
+                depends=depends,
+            )
+        )
+    return packages
+
+
+def parse_primary(content: bytes) -> list[Package]:
+    """
+    Parse the ``primary.xml`` of a yum repository.
+    """
+    packages = []
+    for element in ET.fromstring(content).findall("common:package", RPM_NS):
+        name = element.findtext("common:name", namespaces=RPM_NS)
+        version = element.find("common:version", RPM_NS)
+        location = element.find("common:location", RPM_NS)
+        if name is None or version is None or location is None:
+            continue
+        checksum = element.find("common:checksum", RPM_NS)
+        size = element.find("common:size", RPM_NS)
+        requires = element.findall("common:format/rpm:requires/rpm:entry", RPM_NS)
+        packages.append(
+            Package(
+                name=name,
+                version=f"{version.get('ver')}-{version.get('rel')}",
+                location=location.get("href", ""),
+                sha256=(
+                    checksum.text
+                    if checksum is not None and checksum.get("type") == "sha256"
+                    else None
+                ),
+                size=int(size.get("package", 0)) if size is not None else None,
+                depends=[entry.get("name", "") for entry in requires],
+            )
+        )
+    return packages
+
+
+def select_packages(
+    available: list[Package], wanted: list[str], strict: bool = True
+) -> list[Package]:
+    """
+    Pick the newest version of the wanted packages and of their dependencies found in the repository.
+
+    When ``strict`` is false, wanted packages missing from the repository are skipped.
+    """
+    newest: dict[str, Package] = {}
+    for package in available:
+        current = newest.get(package.name)
+        if current is None or version_key(package.version) > version_key(
+            current.version
+        ):
+            newest[package.name] = package
+
+    selected: dict[str, Package] = {}
+    pending = list(wanted)
+    while pending:
+        name = pending.pop()
+        if name in selected:
+            continue
+        if name not in newest:
+            if strict and name in wanted:
+                raise ValueError(f"Package {name} is not available in the repository")
+            # Provided by the distribution, not by the Salt repository
+            continue
+        selected[name] = newest[name]
+        pending.extend(newest[name].depends)
+    return sorted(selected.values(), key=lambda package: package.name)
+
+
+class BundleBuilder:
+    """
+    Download everything needed for an offline install and write the bundle.
+    """
+
+    def __init__(self, ctx: Context, repository: Repository, workers: int = 4):
+        self.ctx = ctx
+        self.repository = repository
+        self.workers = workers
+        self.session = requests.Session()
+        self.metadata: dict[str, bytes] = {}
+
+    def get(self, path: str) -> bytes:
+        url = self.repository.url + path
+        self.ctx.debug(f"Fetching {url}")
+        response = self.session.get(url, timeout=60)
+        response.raise_for_status()
+        return response.content
+
+    def fetch_metadata(self) -> list[Package]:
+        if self.repository.package_format == "deb":
+            base = (
+                f"dists/{self.repository.codename}/main/binary-{self.repository.arch}/"
+            )
+            for name in ("Packages.gz", "Packages.xz", "Packages"):
+                try:
+                    content = self.get(base + name)
+                except requests.HTTPError:
+                    continue
+                self.metadata[base + name] = content
+                self.metadata[f"dists/{self.repository.codename}/Release"] = self.get(
+                    f"dists/{self.repository.codename}/Release"
+                )
+                return parse_packages_index(decompress(name, content).decode())
+            raise ValueError(
+                f"No Packages index found under {self.repository.url}{base}"
+            )
+
+        repomd = self.get("repodata/repomd.xml")
+        self.metadata["repodata/repomd.xml"] = repomd
+        primary = ET.fromstring(repomd).find(
+            "repo:data[@type='primary']/repo:location", RPM_NS
+        )
+        if primary is None:
+            raise ValueError(
+                f"No primary metadata listed in {self.repository.url}repodata/repomd.xml"
+            )
+        href = primary.get("href", "")
+        content = self.get(href)
+        self.metadata[href] = content
+        return parse_primary(decompress(href, content))
+
+    def download(self, package: Package, destination: pathlib.Path) -> str:
+        """
+        Stream a package to disk, returning its SHA256 sum.
+        """
+        digest = hashlib.sha256()
+        with self.session.get(
+            self.repository.url + package.location, stream=True, timeout=60
+        ) as response:
+            response.raise_for_status()
+            with destination.open("wb") as wfh:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    digest.update(chunk)
+                    wfh.write(chunk)
+        sha256 = digest.hexdigest()
+        if package.sha256 and package.sha256 != sha256:
+            raise ValueError(
+                f"{package.filename} does not match the repository metadata: {sha256} != {package.sha256}"
+            )
+        return sha256
+
+    def build(self, packages: list[str], output: pathlib.Path, strict: bool = True):
+        self.ctx.info(f"Reading the repository metadata from {self.repository.url} ...")
+        selected = select_packages(self.fetch_metadata(), packages, strict=strict)
+        self.ctx.info(
+            f"Bundling {', '.join(f'{p.name} {p.version}' for p in selected)}"
+        )
+
+        with tempfile.TemporaryDirectory(prefix="salt-bundle-") as tmpdir:
+            root = pathlib.Path(tmpdir)
+            for directory in ("keys", "metadata", "packages"):
+                root.joinpath(directory).mkdir()
+
+            keys = []
+            for key in self.repository.keys:
+                try:
+                    root.joinpath("keys", key).write_bytes(self.get(key))
+                except requests.HTTPError as exc:
+                    self.ctx.warn(f"Failed to fetch the {key} signing key: {exc}")
+                    continue
+                keys.append(key)
+            if not keys:
+                raise ValueError("None of the repository signing keys could be fetched")
+
+            for path, content in self.metadata.items():
+                destination = root / "metadata" / path
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                destination.write_bytes(content)
+
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                sums = list(
+                    pool.map(
+                        lambda package: self.download(
+                            package, root / "packages" / package.filename
+                        ),
+                        selected,
+                    )
+                )
+
+            with root.joinpath("SHA256SUMS").open("w") as wfh:
+                for package, sha256 in zip(selected, sums):
+                    wfh.write(f"{sha256}  packages/{package.filename}\n")
+
+            manifest = {
+                "distro": self.repository.distro,
+                "version": self.repository.version,
+                "arch": self.repository.arch,
+                "onedir_rev": self.repository.rev,
+                "format": self.repository.package_format,
+                "source": self.repository.url,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "keys": keys,
+                "packages": [
+                    {
+                        "name": package.name,
+                        "version": package.version,
+                        "file": f"packages/{package.filename}",
+                        "sha256": sha256,
+                    }
+                    for package, sha256 in zip(selected, sums)
+                ],
+            }
+            root.joinpath("manifest.json").write_text(
+                json.dumps(manifest, indent=2) + "\n"
+            )
+
+            output.parent.mkdir(parents=True, exist_ok=True)
+            with tarfile.open(output, "w:gz") as tar:
+                for path in sorted(root.iterdir()):
+                    tar.add(path, arcname=path.name)
+
+        return manifest
+
+
+@bundle.command(
+    name="build",
+    arguments={
+        "distro": {
+            "help": (
+                "The distribution, as lower cased by bootstrap-salt.sh. RHEL variants "
+                "like 'centos' or 'rockylinux' use the 'redhat' repository."
+            ),
+        },
+        "version": {
+            "help": "The distribution version, e.g. '22.04', '11' or '9'.",
+        },
+        "arch": {
+            "help": "The repository architecture, e.g. 'amd64' or 'x86_64'.",
+        },
+        "salt_version": {
+            "help": "The Salt version, as passed to 'bootstrap-salt.sh onedir'.",
+        },
+        "package": {
+            "help": (
+                "Salt package to bundle, together with its dependencies from the Salt "
+                "repository. Can be passed multiple times. Defaults to all the Salt packages."
+            ),
+            "action": "append",
+        },
+        "repo_url": {
+            "help": "The repository host, like 'bootstrap-salt.sh -R'.",
+        },
+        "http": {
+            "help": "The scheme used to reach the repository.",
+            "choices": ("https", "http"),
+        },
+        "rc": {
+            "help": "Bundle release candidate packages, like the 'onedir_rc' install type.",
+        },
+        "output": {
+            "help": "Where to write the bundle. Defaults to 'salt-bundle-<distro>-<version>-<arch>-<salt-version>.tar.gz'.",
+        },
+    },
+)
+def build(
+    ctx: Context,
+    distro: str,
+    version: str,
+    arch: str,
+    salt_version: str = "latest",
+    package: list[str] = None,
+    repo_url: str = "repo.saltproject.io",
+    http: str = "https",
+    rc: bool = False,
+    output: pathlib.Path = None,
+):
+    """
+    Build an offline bundle for 'bootstrap-salt.sh -B'.
+    """
+    try:
+        repository = resolve_repository(
+            distro.lower(),
+            version,
+            arch,
+            salt_version,
+            repo_url=repo_url,
+            http=http,
+            rc=rc,
+        )
+    except ValueError as exc:
+        ctx.error(str(exc))
+        ctx.exit(1)
+
+    if output is None:
+        output = tools.utils.REPO_ROOT / (
+            f"salt-bundle-{repository.distro}-{repository.version}-{arch}-{salt_version}.tar.gz"
+        )
+
+    try:
+        manifest = BundleBuilder(ctx, repository).build(
+            package or list(SALT_PACKAGES), output, strict=bool(package)
+        )
+    except (requests.RequestException, ValueError, ET.ParseError) as exc:
+        ctx.error(f"Failed to build the bundle: {exc}")
+        ctx.exit(1)
+
+    size = output.stat().st_size
+    ctx.info(
+        f"Wrote {output} ({len(manifest['packages'])} packages, {size / 1024 / 1024:.1f} MiB)"
+    )
+    ctx.print(output)
@@ -0,0 +1,490 @@
+"""
+These commands are used to bootstrap fleets of hosts with Salt Bootstrap.
+"""
+# pylint: disable=resource-leakage,broad-except,3rd-party-module-not-gated
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import pathlib
+import shlex
+import time
+from dataclasses import dataclass
+from dataclasses import field
+from typing import TYPE_CHECKING
+
+from ptscripts import command_group
+from ptscripts import Context
+from rich.table import Table
+
+import tools.utils
+
+log = logging.getLogger(__name__)
+
+# How long removing the pushed files may take, including after the bootstrap timed out
+CLEANUP_TIMEOUT = 60
+
+# Define the command group
+fleet = command_group(
+    name="fleet",
+    help="Fleet Bootstrap Related Commands",
+    description=__doc__,
+)
+
+
+@dataclass
+class Host:
+    """
+    A single inventory entry.
+    """
+
+    hostname: str
+    user: str | None = None
+    port: int | None = None
+    args: list[str] = field(default_factory=list)
+
+    @property
+    def name(self) -> str:
+        return self.hostname if self.port is None else f"{self.hostname}:{self.port}"
+
+    @property
+    def target(self) -> str:
+        return self.hostname if self.user is None else f"{self.user}@{self.hostname}"
+
+
+@dataclass
+class HostResult:
+    """
+    The outcome of bootstrapping a single host.
+    """
+
+    host: Host
+    status: str = "pending"
+    returncode: int | None = None
+    duration: float = 0.0
+    log_file: pathlib.Path | None = None
+    report_file: pathlib.Path | None = None
+
+
+def parse_inventory(path: pathlib.Path) -> list[Host]:
+    """
+    Parse an inventory file.
+
+    JSON inventories are a list of either strings or mappings with the ``host``,
+    ``user``, ``port`` and ``args`` keys. Any other file is read as one
+    ``[user@]host[:port]`` entry per line, ``#`` starting a comment.
+    """
+    if path.suffix == ".json":
+        entries = json.loads(path.read_text())
+    else:
+        entries = []
+        for line in path.read_text().splitlines():
+            line = line.split("#", 1)[0].strip()
+            if line:
+                entries.append(line)
+
+    hosts: list[Host] = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            hosts.append(
+                Host(
+                    hostname=entry["host"],
+                    user=entry.get("user"),
+                    port=entry.get("port"),
+                    args=list(entry.get("args") or []),
+                )
+            )
+            continue
+        user = port = None
+        if "@" in entry:
+            user, entry = entry.split("@", 1)
+        if entry.count(":") == 1:
+            entry, port = entry.split(":", 1)
+        hosts.append(Host(hostname=entry, user=user, port=int(port) if port else None))
+    return hosts
+
+
+class Transport:
+    """
+    Run commands on, and copy files to, a remote host through ``ssh`` and ``scp``.
+
+    The binaries are configurable so that a fake stand-in can be used in tests.
+    """
+
+    def __init__(
+        self, ssh: str = "ssh", scp: str = "scp", options: list[str] | None = None
+    ):
+        self.ssh = shlex.split(ssh)
+        self.scp = shlex.split(scp)
+        self.options = ["-o", "BatchMode=yes"] + list(options or [])
+
+    def exec_cmdline(self, host: Host, command: str) -> list[str]:
+        cmdline = [*self.ssh, *self.options]
+        if host.port is not None:
+            cmdline += ["-p", str(host.port)]
+        return [*cmdline, host.target, command]
+
+    def copy_cmdline(
+        self, host: Host, sources: list[str], destination: str
+    ) -> list[str]:
+        cmdline = [*self.scp, *self.options, "-r"]
+        if host.port is not None:
+            cmdline += ["-P", str(host.port)]
+        return [*cmdline, *sources, f"{host.target}:{destination}"]
+
+
+class DockerTransport(Transport):
+    """
+    Run commands on, and copy files to, a local container. The inventory host is the container name.
+    """
+
+    def __init__(self, docker: str = "docker"):
+        self.docker = shlex.split(docker)
+
+    def exec_cmdline(self, host: Host, command: str) -> list[str]:
+        return [*self.docker, "exec", host.hostname, "sh", "-c", command]
+
+    def copy_cmdline(
+        self, host: Host, sources: list[str], destination: str
+    ) -> list[str]:
+        # ``docker cp`` only takes a single source, chain them through a shell
+        cmds = [
+            shlex.join([*self.docker, "cp", source, f"{host.hostname}:{destination}/"])
+            for source in sources
+        ]
+        return ["sh", "-c", " && ".join(cmds)]
+
+
+class FleetBootstrap:
+    """
+    Push ``bootstrap-salt.sh`` plus the optional configuration and keys directories to every host
+    and run it, at most ``concurrency`` hosts at a time.
+    """
+
+    def __init__(
+        self,
+        ctx: Context,
+        transport: Transport,
+        script: pathlib.Path,
+        log_dir: pathlib.Path,
+        bootstrap_args: list[str],
+        config_dir: pathlib.Path | None = None,
+        keys_dir: pathlib.Path | None = None,
+        concurrency: int = 10,
+        timeout: int = 1800,
+        sudo: bool = False,
+        stream: bool = True,
+        reports: bool = False,
+    ):
+        self.ctx = ctx
+        self.transport = transport
+        self.script = script
+        self.log_dir = log_dir
+        self.bootstrap_args = bootstrap_args
+        self.config_dir = config_dir
+        self.keys_dir = keys_dir
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.sudo = sudo
+        self.stream = stream
+        self.reports = reports
+
+    async def _run(self, cmdline: list[str], log_fh, prefix: str) -> int:
+        proc = await asyncio.create_subprocess_exec(
+            *cmdline,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+        try:
+            if TYPE_CHECKING:
+                assert proc.stdout
+            async for raw_line in proc.stdout:
+                line = raw_line.decode("utf-8", errors="replace").rstrip()
+                log_fh.write(f"{line}\n")
+                log_fh.flush()
+                if self.stream:
+                    self.ctx.print(f"{prefix} {line}", markup=False, highlight=False)
+            return await proc.wait()
+        except asyncio.CancelledError:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            raise
+
+    async def _capture(self, host: Host, command: str) -> tuple[int, bytes, bytes]:
+        proc = await asyncio.create_subprocess_exec(
+            *self.transport.exec_cmdline(host, command),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await proc.communicate()
+        if TYPE_CHECKING:
+            assert proc.returncode is not None
+        return proc.returncode, stdout, stderr
+
+    async def _fetch_report(
+        self, host: Host, remote_path: str, destination: pathlib.Path
+    ):
+        returncode, stdout, _ = await self._capture(
+            host, f"cat {shlex.quote(remote_path)}"
+        )
+        if returncode == 0 and stdout:
+            destination.write_bytes(stdout)
+
+    async def _cleanup(self, host: Host, remote_dir: str, log_fh, prefix: str):
+        cmdline = self.transport.exec_cmdline(host, f"rm -rf {shlex.quote(remote_dir)}")
+        try:
+            ret = await asyncio.wait_for(
+                self._run(cmdline, log_fh, prefix), timeout=CLEANUP_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            ret = None
+        if ret != 0:
+            log_fh.write(f"Failed to remove {remote_dir} from the host\n")
+
+    async def _bootstrap(self, host: Host, log_fh, report_file: pathlib.Path) -> int:
+        prefix = f"[{host.name}]"
+        # Let the remote host pick a private, unpredictable directory to push the files to
+        ret, stdout, stderr = await self._capture(
+            host, 'mktemp -d "${TMPDIR:-/tmp}/salt-bootstrap.XXXXXXXXXX"'
+        )
+        log_fh.write(stderr.decode("utf-8", errors="replace"))
+        remote_dir = stdout.decode("utf-8", errors="replace").strip()
+        if ret:
+            return ret
+        if not remote_dir:
+            log_fh.write("Failed to create a temporary directory on the host\n")
+            return 1
+        # The pushed files are removed however the bootstrap ends, even when it timed out
+        try:
+            return await self._push_and_run(host, log_fh, report_file, remote_dir)
+        finally:
+            await self._cleanup(host, remote_dir, log_fh, prefix)
+
+    async def _push_and_run(
+        self, host: Host, log_fh, report_file: pathlib.Path, remote_dir: str
+    ) -> int:
+        prefix = f"[{host.name}]"
+        sources = [str(self.script)]
+        args = []
+        if self.config_dir is not None:
+            sources.append(str(self.config_dir))
+            args += ["-c", f"{remote_dir}/{self.config_dir.name}"]
+        if self.keys_dir is not None:
+            sources.append(str(self.keys_dir))
+            args += ["-k", f"{remote_dir}/{self.keys_dir.name}"]
+        ret = await self._run(
+            self.transport.copy_cmdline(host, sources, remote_dir), log_fh, prefix
+        )
+        if ret:
+            return ret
+
+        command = shlex.join(
+            [
+                "sh",
+                f"{remote_dir}/{self.script.name}",
+                *args,
+                *self.bootstrap_args,
+                *host.args,
+            ]
+        )
+        if self.reports:
+            command = (
+                f"BS_REPORT_FILE={shlex.quote(remote_dir + '/report.json')} {command}"
+            )
+        if self.sudo:
+            command = f"sudo {command}"
+        ret = await self._run(
+            self.transport.exec_cmdline(host, command), log_fh, prefix
+        )
+        if self.reports:
+            await self._fetch_report(host, f"{remote_dir}/report.json", report_file)
+        return ret
+
+    async def _process(
+        self, semaphore: asyncio.Semaphore, result: HostResult
+    ) -> HostResult:
+        async with semaphore:
+            host = result.host
+            result.log_file = self.log_dir / f"{host.name.replace(':', '_')}.log"
+            report_file = self.log_dir / f"{host.name.replace(':', '_')}.report.json"
+            result.status = "running"
+            start = time.monotonic()
+            with result.log_file.open("w", encoding="utf-8") as log_fh:
+                try:
+                    result.returncode = await asyncio.wait_for(
+                        self._bootstrap(host, log_fh, report_file), timeout=self.timeout
+                    )
+                    result.status = "ok" if result.returncode == 0 else "failed"
+                except asyncio.TimeoutError:
+                    result.status = "timeout"
+                    log_fh.write(f"Timed out after {self.timeout} seconds\n")
+                except Exception as exc:
+                    result.status = "error"
+                    log_fh.write(f"{exc}\n")
+            result.duration = time.monotonic() - start
+            if report_file.exists():
+                result.report_file = report_file
+            self.ctx.info(
+                f"{host.name}: {result.status} after {result.duration:.1f} seconds"
+            )
+            return result
+
+    async def run(self, hosts: list[Host]) -> list[HostResult]:
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = [HostResult(host=host) for host in hosts]
+        return await asyncio.gather(
+            *[self._process(semaphore, result) for result in results]
+        )
+
+
+def summary_table(results: list[HostResult]) -> Table:
+    table = Table(title="Bootstrap Summary")
+    table.add_column("Host")
+    table.add_column("Status")
+    table.add_column("Exit Code", justify="right")
+    table.add_column("Duration", justify="right")
+    table.add_column("Log")
+    styles = {"ok": "green", "failed": "red", "timeout": "yellow", "error": "red"}
+    for result in sorted(results, key=lambda r: r.host.name):
+        table.add_row(
+            result.host.name,
+            f"[{styles.get(result.status, 'white')}]{result.status}",
+            "" if result.returncode is None else str(result.returncode),
+            f"{result.duration:.1f}s",
+            str(result.log_file),
+        )
+    return table
+
+
+@fleet.command(
+    name="bootstrap",
+    arguments={
+        "inventory": {
+            "help": (
+                "Path to the inventory. Either one '[user@]host[:port]' per line or a JSON "
+                "list of strings or {'host', 'user', 'port', 'args'} mappings."
+            ),
+        },
+        "bootstrap_args": {
+            "help": (
+                "Arguments passed to bootstrap-salt.sh on every host. Pass any options to this "
+                "command before the inventory and separate these arguments with '--'."
+            ),
+            "nargs": "*",
+        },
+        "concurrency": {
+            "help": "How many hosts to bootstrap at the same time.",
+            "flags": ["-n", "--concurrency"],
+        },
+        "timeout": {
+            "help": "Per host timeout, in seconds.",
+        },
+        "config_dir": {
+            "help": "Local configuration directory to push and pass to bootstrap-salt.sh as '-c'.",
+        },
+        "keys_dir": {
+            "help": "Local pre-seed keys directory to push and pass to bootstrap-salt.sh as '-k'.",
+        },
+        "script": {
+            "help": "The bootstrap script to push.",
+        },
+        "log_dir": {
+            "help": "Directory where the per host logs are written.",
+        },
+        "transport": {
+            "help": "How to reach the hosts. With 'docker', inventory hosts are container names.",
+            "choices": ("ssh", "docker"),
+        },
+        "ssh": {
+            "help": "The ssh command to use.",
+        },
+        "scp": {
+            "help": "The scp command to use.",
+        },
+        "ssh_option": {
+            "help": "Extra '-o' options passed to ssh and scp. Can be passed multiple times.",
+            "action": "append",
+        },
+        "sudo": {
+            "help": "Run bootstrap-salt.sh through sudo on the remote hosts.",
+        },
+        "quiet_hosts": {
+            "help": "Do not stream the per host output to the console, only write the logs.",
+        },
+        "reports": {
+            "help": (
+                "Collect the bootstrap-salt.sh run reports next to the per host logs. "
+                "Aggregate them with 'tools report aggregate'."
+            ),
+        },
+    },
+)
+def bootstrap(
+    ctx: Context,
+    inventory: pathlib.Path,
+    bootstrap_args: list[str],
+    concurrency: int = 10,
+    timeout: int = 1800,
+    config_dir: pathlib.Path = None,
+    keys_dir: pathlib.Path = None,
+    script: pathlib.Path = tools.utils.REPO_ROOT / "bootstrap-salt.sh",
+    log_dir: pathlib.Path = pathlib.Path("fleet-logs"),
+    transport: str = "ssh",
+    ssh: str = "ssh",
+    scp: str = "scp",
+    ssh_option: list[str] = None,
+    sudo: bool = False,
+    quiet_hosts: bool = False,
+    reports: bool = False,
+):
+    """
+    Bootstrap every host in an inventory, in parallel.
+    """
+    hosts = parse_inventory(inventory)
+    if not hosts:
+        ctx.error(f"No hosts found in {inventory}")
+        ctx.exit(1)
+    for path in (config_dir, keys_dir):
+        if path is not None and not path.is_dir():
+            ctx.error(f"The directory {path} does not exist")
+            ctx.exit(1)
+
+    if transport == "docker":
+        runner_transport: Transport = DockerTransport()
+    else:
+        options: list[str] = []
+        for option in ssh_option or ():
+            options += ["-o", option]
+        runner_transport = Transport(ssh=ssh, scp=scp, options=options)
+
+    concurrency = max(1, concurrency)
+    runner = FleetBootstrap(
+        ctx,
+        transport=runner_transport,
+        script=script,
+        log_dir=log_dir,
+        bootstrap_args=bootstrap_args,
+        config_dir=config_dir,
+        keys_dir=keys_dir,
+        concurrency=concurrency,
+        timeout=timeout,
+        sudo=sudo,
+        stream=not quiet_hosts,
+        reports=reports,
+    )
+    ctx.info(f"Bootstrapping {len(hosts)} hosts, {concurrency} at a time ...")
+    try:
+        results = asyncio.run(runner.run(hosts))
+    except KeyboardInterrupt:
+        ctx.exit(1)
+
+    ctx.console.print(summary_table(results))
+    failed = [result for result in results if result.status != "ok"]
+    if failed:
+        ctx.exit(1, f"{len(failed)} of {len(results)} hosts failed to bootstrap")
+    ctx.exit(0, f"All {len(results)} hosts bootstrapped")
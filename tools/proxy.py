@@ -0,0 +1,535 @@
+"""
+These commands are used to run a caching proxy of the Salt package repository.
+
+The proxy serves the ``repo.saltproject.io`` layout which ``bootstrap-salt.sh`` builds its
+repository, key and package URLs from. Every file is downloaded from upstream the first time
+a host asks for it, streamed to that host while it's written to the disk cache, and served
+from the cache afterwards. Pointing ``-R`` at the proxy during a fleet rollout makes every
+package cross the WAN once, however many hosts install it at the same time.
+"""
+# pylint: disable=resource-leakage,broad-except,3rd-party-module-not-gated
+from __future__ import annotations
+
+import hashlib
+import http.server
+import json
+import logging
+import os
+import pathlib
+import posixpath
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import OrderedDict
+
+from ptscripts import command_group
+from ptscripts import Context
+
+log = logging.getLogger(__name__)
+
+# Define the command group
+proxy = command_group(
+    name="proxy",
+    help="Package Repository Proxy Related Commands",
+    description=__doc__,
+)
+
+UPSTREAM_URL = "https://repo.saltproject.io"
+CHUNK_SIZE = 64 * 1024
+# The files which change when a release is published: the directory listings, the onedir
+# repo.json, the yum .repo files, the APT and YUM repository metadata and the signing keys.
+# Their cached copies are revalidated with upstream once older than the metadata TTL. The
+# package files have the version in their name and never change once published.
+METADATA_RE = re.compile(
+    r"(?:/|/repo\.json|\.repo|/(?:In)?Release(?:\.gpg)?|/Packages(?:\.\w+)?"
+    r"|/repomd\.xml(?:\.asc|\.key)?|\.(?:gpg|pub|key|asc))$"
+)
+# The upstream response headers which are cached and passed on to the clients
+FORWARDED_HEADERS = ("Content-Type", "Last-Modified", "ETag")
+RANGE_RE = re.compile(r"^bytes=(\d+)-(\d*)$")
+
+
+def is_metadata(path: str) -> bool:
+    """
+    Whether the repository path is one whose content changes upstream.
+    """
+    return METADATA_RE.search(path) is not None
+
+
+class Cache:
+    """
+    The disk cache of the proxy, evicting the least recently used files past its maximum size.
+
+    Every file is stored under the SHA256 sum of its repository path, next to a JSON file of
+    its upstream headers and when they were last validated.
+    """
+
+    def __init__(self, directory: pathlib.Path, max_size: int):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # Key to size, least recently used first
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        self.size = 0
+
+        for path in self.directory.glob("*.tmp"):
+            # The leftovers of downloads interrupted by a restart
+            path.unlink()
+        bodies = [
+            path
+            for path in self.directory.iterdir()
+            if path.suffix != ".json" and path.with_suffix(".json").exists()
+        ]
+        for path in sorted(bodies, key=lambda path: path.stat().st_mtime):
+            size = path.stat().st_size
+            self.entries[path.name] = size
+            self.size += size
+
+    @staticmethod
+    def key(path: str) -> str:
+        return hashlib.sha256(path.encode()).hexdigest()
+
+    def temporary_path(self, path: str) -> pathlib.Path:
+        return self.directory / f"{self.key(path)}.{uuid.uuid4().hex}.tmp"
+
+    def metadata(self, path: str) -> dict | None:
+        """
+        The cached headers of the path, or ``None`` if it's not cached.
+        """
+        key = self.key(path)
+        with self.lock:
+            if key not in self.entries:
+                return None
+        try:
+            return json.loads((self.directory / f"{key}.json").read_text())
+        except (OSError, ValueError):
+            return None
+
+    def open(self, path: str):
+        """
+        Open the cached file of the path and mark it as recently used.
+
+        Returns the open file and its cached headers, or ``None`` if it's not cached.
+        """
+        key = self.key(path)
+        body = self.directory / key
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            try:
+                # Opened under the lock, so that it's not evicted in between
+                fileobj = body.open("rb")
+            except OSError:
+                return None
+        try:
+            metadata = json.loads(body.with_suffix(".json").read_text())
+            # Persist the recency, for the order of the entries after a restart
+            os.utime(body)
+        except (OSError, ValueError):
+            fileobj.close()
+            return None
+        return fileobj, metadata
+
+    def store(self, path: str, source: pathlib.Path, metadata: dict):
+        """
+        Move a complete download into the cache.
+        """
+        key = self.key(path)
+        body = self.directory / key
+        self.write_metadata(path, metadata)
+        with self.lock:
+            os.replace(source, body)
+            self.size -= self.entries.pop(key, 0)
+            self.entries[key] = body.stat().st_size
+            self.size += self.entries[key]
+            self._evict()
+
+    def write_metadata(self, path: str, metadata: dict):
+        target = self.directory / f"{self.key(path)}.json"
+        temporary = target.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        temporary.write_text(json.dumps(metadata))
+        os.replace(temporary, target)
+
+    def _evict(self):
+        # Always keep the most recent file, even when it's larger than the cache
+        while self.size > self.max_size and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.size -= size
+            log.debug("Evicting %s from the cache", key)
+            for path in (self.directory / key, self.directory / f"{key}.json"):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+
+class Fill:
+    """
+    One download from upstream, which every client asking for the same path meanwhile reads
+    from, while it's being written to the cache.
+    """
+
+    def __init__(self, server: RepoProxy, path: str, metadata: dict | None):
+        self.server = server
+        self.path = path
+        self.metadata = metadata
+        self.temporary = server.cache.temporary_path(path)
+        # Created upfront, so that the clients can open it before the download starts
+        self.temporary.touch()
+        self.condition = threading.Condition()
+        self.status: int | None = None
+        self.headers: dict = {}
+        self.length: int | None = None
+        self.written = 0
+        self.done = False
+        self.failed = False
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def _respond(self, status: int, headers: dict | None = None, length=None):
+        with self.condition:
+            self.status = status
+            self.headers = headers or {}
+            self.length = length
+            self.condition.notify_all()
+
+    def _finish(self, failed: bool = False):
+        with self.server.lock:
+            # Cached before the download is dropped, so that new clients find it in either
+            if not failed and self.status == 200:
+                self.server.cache.store(
+                    self.path,
+                    self.temporary,
+                    {"headers": self.headers, "validated_at": time.time()},
+                )
+            self.server.fills.pop(self.path, None)
+        if failed or self.status != 200:
+            self.temporary.unlink(missing_ok=True)
+        with self.condition:
+            self.done = True
+            self.failed = failed
+            self.condition.notify_all()
+
+    def run(self):
+        url = self.server.upstream + urllib.parse.quote(self.path)
+        request = urllib.request.Request(url)
+        if self.metadata is not None:
+            cached = self.metadata["headers"]
+            if "ETag" in cached:
+                request.add_header("If-None-Match", cached["ETag"])
+            if "Last-Modified" in cached:
+                request.add_header("If-Modified-Since", cached["Last-Modified"])
+
+        # A 304 status tells the clients to read the cached copy. When revalidating it fails on
+        # upstream's side, the stale copy is served rather than an error, and it's revalidated
+        # again on the next request.
+        try:
+            response = urllib.request.urlopen(request, timeout=self.server.timeout)
+        except urllib.error.HTTPError as exc:
+            status = exc.code
+            if status == 304 and self.metadata is not None:
+                self.metadata["validated_at"] = time.time()
+                self.server.cache.write_metadata(self.path, self.metadata)
+            elif status >= 500 and self.metadata is not None:
+                log.warning(
+                    "Upstream answered %s for %s, serving the stale cached copy",
+                    status,
+                    self.path,
+                )
+                status = 304
+            else:
+                log.info("Upstream answered %s for %s", status, self.path)
+            self._respond(status)
+            self._finish()
+            return
+        except (urllib.error.URLError, OSError) as exc:
+            if self.metadata is not None:
+                log.warning(
+                    "Failed to reach upstream for %s, serving the stale cached copy: %s",
+                    self.path,
+                    exc,
+                )
+                self._respond(304)
+            else:
+                log.warning("Failed to reach upstream for %s: %s", self.path, exc)
+                self._respond(502)
+            self._finish()
+            return
+
+        headers = {
+            name: response.headers[name]
+            for name in FORWARDED_HEADERS
+            if response.headers[name] is not None
+        }
+        length = response.headers["Content-Length"]
+        self._respond(200, headers, int(length) if length is not None else None)
+        try:
+            with response, self.temporary.open("wb") as fileobj:
+                while True:
+                    chunk = response.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    fileobj.write(chunk)
+                    fileobj.flush()
+                    with self.condition:
+                        self.written += len(chunk)
+                        self.condition.notify_all()
+            if self.length is not None and self.written != self.length:
+                raise OSError(f"Got {self.written} of {self.length} bytes")
+        except OSError as exc:
+            log.warning("Failed to download %s from upstream: %s", self.path, exc)
+            self._finish(failed=True)
+            return
+        with self.server.lock:
+            self.server.upstream_bytes += self.written
+        log.info("Cached %s (%d bytes)", self.path, self.written)
+        self._finish()
+
+
+class RepoProxyHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        log.debug("Proxy: " + format, *args)
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def handle_request(self, send_body: bool):
+        path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        normalized = posixpath.normpath(path)
+        if not path.startswith("/") or ".." in normalized.split("/"):
+            self.send_error(400)
+            return
+        # Keep the trailing slash of the directory listings
+        if path.endswith("/") and normalized != "/":
+            normalized += "/"
+
+        cached = self.server.cached(normalized)
+        if cached is not None:
+            fileobj, metadata = cached
+            with fileobj:
+                self.send_cached(fileobj, metadata, send_body)
+            return
+
+        fill, reader = self.server.join_fill(normalized)
+        with reader:
+            with fill.condition:
+                fill.condition.wait_for(lambda: fill.status is not None)
+            if fill.status == 304:
+                cached = self.server.cache.open(normalized)
+                if cached is None:
+                    self.send_error(502)
+                    return
+                fileobj, metadata = cached
+                with fileobj:
+                    self.send_cached(fileobj, metadata, send_body)
+                return
+            if fill.status != 200:
+                self.send_error(fill.status)
+                return
+            self.send_filling(fill, reader, send_body)
+
+    def send_headers(self, status: int, headers: dict, length: int | None):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if length is not None:
+            self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def send_cached(self, fileobj, metadata: dict, send_body: bool):
+        with self.server.lock:
+            self.server.hits += 1
+        headers = dict(metadata["headers"])
+        size = os.fstat(fileobj.fileno()).st_size
+        start, end = 0, size - 1
+        match = RANGE_RE.match(self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)), end)
+            if start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.end_headers()
+                return
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        self.send_headers(206 if match else 200, headers, end - start + 1)
+        if not send_body:
+            return
+        fileobj.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = fileobj.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+            remaining -= len(chunk)
+        with self.server.lock:
+            self.server.served_bytes += end - start + 1 - remaining
+
+    def send_filling(self, fill: Fill, reader, send_body: bool):
+        # Range requests of a file which is still downloading get the whole file
+        self.send_headers(200, fill.headers, fill.length)
+        if not send_body:
+            return
+        position = 0
+        while True:
+            chunk = reader.read(CHUNK_SIZE)
+            if chunk:
+                self.wfile.write(chunk)
+                position += len(chunk)
+                continue
+            with fill.condition:
+                fill.condition.wait_for(lambda: fill.done or fill.written > position)
+                if fill.failed:
+                    # Cut the connection short, for the client to see an incomplete download
+                    self.close_connection = True
+                    break
+                if fill.done and fill.written == position:
+                    break
+        with self.server.lock:
+            self.server.served_bytes += position
+
+
+class RepoProxy(http.server.ThreadingHTTPServer):
+    """
+    A caching proxy of the Salt package repository, which downloads every file once.
+    """
+
+    def __init__(
+        self,
+        cache: Cache,
+        upstream: str = UPSTREAM_URL,
+        address: tuple[str, int] = ("0.0.0.0", 8080),
+        metadata_ttl: int = 300,
+        timeout: int = 60,
+    ):
+        super().__init__(address, RepoProxyHandler)
+        self.cache = cache
+        self.upstream = upstream.rstrip("/")
+        self.metadata_ttl = metadata_ttl
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        # The downloads in progress, by path
+        self.fills: dict[str, Fill] = {}
+        self.hits = 0
+        self.misses = 0
+        self.served_bytes = 0
+        self.upstream_bytes = 0
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+    def cached(self, path: str):
+        """
+        The open cached file of the path and its headers, unless it's not cached or, being
+        repository metadata, must be revalidated with upstream.
+        """
+        metadata = self.cache.metadata(path)
+        if metadata is None:
+            return None
+        if (
+            is_metadata(path)
+            and time.time() - metadata["validated_at"] > self.metadata_ttl
+        ):
+            return None
+        return self.cache.open(path)
+
+    def join_fill(self, path: str):
+        """
+        The download of the path from upstream, started unless one already is, and a reader of
+        the file it's written to.
+        """
+        with self.lock:
+            fill = self.fills.get(path)
+            if fill is None:
+                self.misses += 1
+                fill = self.fills[path] = Fill(self, path, self.cache.metadata(path))
+                fill.start()
+            # Opened under the lock, before the download can be moved into the cache
+            return fill, fill.temporary.open("rb")
+
+
+@proxy.command(
+    name="serve",
+    arguments={
+        "cache_dir": {
+            "help": "Where the proxied files are cached.",
+        },
+        "max_size": {
+            "help": "Maximum size of the cache in MiB.",
+        },
+        "upstream": {
+            "help": "The Salt package repository to proxy.",
+        },
+        "host": {
+            "help": "The address to listen on.",
+        },
+        "port": {
+            "help": "The port to listen on.",
+        },
+        "metadata_ttl": {
+            "help": (
+                "Seconds the cached repository metadata, like repo.json and the APT and YUM "
+                "indexes, is served before it's revalidated with upstream."
+            ),
+        },
+        "timeout": {
+            "help": "Seconds to wait on upstream before failing a download.",
+        },
+    },
+)
+def serve(
+    ctx: Context,
+    cache_dir: pathlib.Path = pathlib.Path("repo-proxy-cache"),
+    max_size: int = 10240,
+    upstream: str = UPSTREAM_URL,
+    host: str = "0.0.0.0",
+    port: int = 8080,
+    metadata_ttl: int = 300,
+    timeout: int = 60,
+):
+    """
+    Serve a caching proxy of the Salt package repository, for 'bootstrap-salt.sh -R'.
+    """
+    cache = Cache(cache_dir, max_size * 1024 * 1024)
+    server = RepoProxy(
+        cache,
+        upstream=upstream,
+        address=(host, port),
+        metadata_ttl=metadata_ttl,
+        timeout=timeout,
+    )
+    ctx.info(
+        f"Proxying {upstream} on {host}:{port}, with {len(cache.entries)} cached files "
+        f"({cache.size / 1024 / 1024:.1f} MiB) in {cache_dir}"
+    )
+    ctx.info(
+        f"Bootstrap through it with: sh bootstrap-salt.sh -l -R <this host>:{port} ..."
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    ctx.info(
+        f"Served {server.served_bytes} bytes, {server.hits} cache hits and "
+        f"{server.misses} misses, downloading {server.upstream_bytes} bytes from upstream"
+    )
@@ -4,6 +4,7 @@ These commands are used to release Salt Bootstrap.
 # pylint: disable=resource-leakage,broad-except,3rd-party-module-not-gated
 from __future__ import annotations
 
+import concurrent.futures
 import logging
 import os
 import pathlib
@@ -13,10 +14,13 @@ from typing import TYPE_CHECKING
 from ptscripts import command_group
 from ptscripts import Context
 
+import tools.analyze
 import tools.utils
 
 try:
     import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.exceptions import ClientError
 except ImportError:
     print(
         "\nPlease run 'python -m pip install -r requirements/release.txt'\n",
@@ -34,6 +38,105 @@ release = command_group(
     description=__doc__,
 )
 
+MANIFEST_NAME = "bootstrap-salt-manifest.json"
+# The release artifacts are small, so parallelize across files rather than within them
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=16 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=4,
+)
+
+
+def is_unchanged(s3, bucket: str, rpath: str, md5: str, sha256: str) -> bool:
+    """
+    Whether the object at ``rpath`` already holds the bytes of the local file.
+
+    Objects published by this tool carry their sha256 as metadata. Older ones are compared
+    by ETag, which is the md5 of the contents for objects not uploaded in multiple parts.
+    """
+    try:
+        head = s3.head_object(Bucket=bucket, Key=rpath)
+    except ClientError as exc:
+        if exc.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+    if "sha256" in head.get("Metadata", {}):
+        return head["Metadata"]["sha256"] == sha256
+    return head["ETag"].strip('"') == md5
+
+
+def upload_file(
+    s3, bucket: str, lpath: str, rpaths: list[str], progress, task
+) -> dict[str, str]:
+    """
+    Make every one of ``rpaths`` hold the contents of ``lpath``.
+
+    The file is uploaded at most once. The other destinations which are out of date get a
+    server side copy of the uploaded object. Returns what was done for each destination,
+    one of ``"uploaded"``, ``"copied"`` or ``"unchanged"``.
+    """
+    path = pathlib.Path(lpath)
+    size = path.stat().st_size
+    digests = tools.utils.file_digests(path, "md5", "sha256")
+    md5, sha256 = digests["md5"], digests["sha256"]
+    ret = {}
+    source = None
+    for rpath in rpaths:
+        if is_unchanged(s3, bucket, rpath, md5, sha256):
+            ret[rpath] = "unchanged"
+            source = source or rpath
+    for rpath in rpaths:
+        if rpath in ret:
+            continue
+        if source is None:
+            s3.upload_file(
+                lpath,
+                bucket,
+                rpath,
+                ExtraArgs={"Metadata": {"sha256": sha256}},
+                Config=TRANSFER_CONFIG,
+                Callback=tools.utils.UpdateProgress(progress, task),
+            )
+            source = rpath
+            ret[rpath] = "uploaded"
+        else:
+            s3.copy_object(
+                Bucket=bucket,
+                Key=rpath,
+                CopySource={"Bucket": bucket, "Key": source},
+                Metadata={"sha256": sha256},
+                MetadataDirective="REPLACE",
+            )
+            ret[rpath] = "copied"
+    if "uploaded" not in ret.values():
+        progress.update(task, advance=size)
+    return ret
+
+
+def upload_artifacts(
+    s3, bucket: str, files: dict[str, list[str]], jobs: int
+) -> dict[str, str]:
+    """
+    Upload the local files to their S3 destinations concurrently.
+
+    ``s3`` is any boto3 S3 client, like one pointed at a local S3 stand-in through
+    ``AWS_ENDPOINT_URL``. Returns what was done for each destination, as ``upload_file``.
+    """
+    ret: dict[str, str] = {}
+    total = sum(pathlib.Path(lpath).stat().st_size for lpath in files)
+    with tools.utils.create_progress_bar(file_progress=True) as progress:
+        task = progress.add_task(
+            description=f"Uploading {len(files)} files...", total=total
+        )
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(upload_file, s3, bucket, lpath, rpaths, progress, task)
+                for lpath, rpaths in sorted(files.items())
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                ret.update(future.result())
+    return ret
+
 
 @release.command(
     name="s3-publish",
@@ -46,11 +149,16 @@ release = command_group(
             "help": "The GnuPG key ID used to sign.",
             "required": True,
         },
+        "jobs": {
+            "help": "How many files to upload at the same time.",
+        },
     },
 )
-def s3_publish(ctx: Context, branch: str, key_id: str = None):
+def s3_publish(ctx: Context, branch: str, key_id: str = None, jobs: int = 8):
     """
     Publish scripts to S3.
+
+    Destinations already holding the same contents are left alone.
     """
     if TYPE_CHECKING:
         assert key_id
@@ -108,40 +216,57 @@ def s3_publish(ctx: Context, branch: str, key_id: str = None):
         },
     }
 
-    files_to_upload: list[tuple[str, str]] = []
+    # The slim per distribution variants, and their index, go next to the full script
+    for variant in tools.analyze.VARIANTS:
+        lpath = f"bootstrap-salt-{variant}.sh"
+        upload_files[branch][lpath] = [f"bootstrap/{branch}/{lpath}"]
+        upload_files[branch][f"{lpath}.sha256"] = [f"bootstrap/{branch}/{lpath}.sha256"]
+        # Never reuse the checksum of a previous build
+        pathlib.Path(f"{lpath}.sha256").unlink(missing_ok=True)
+    upload_files[branch][tools.analyze.VARIANTS_INDEX_NAME] = [
+        f"bootstrap/{branch}/{tools.analyze.VARIANTS_INDEX_NAME}"
+    ]
+    upload_files[branch][MANIFEST_NAME] = [f"bootstrap/{branch}/{MANIFEST_NAME}"]
+
+    files_to_upload: dict[str, list[str]] = {}
 
     try:
         # Export the GPG key in use
         tools.utils.export_gpg_key(ctx, key_id, tools.utils.REPO_ROOT)
+        ctx.info("Building the per distribution variants of bootstrap-salt.sh ...")
+        script = tools.analyze.Script.parse(
+            (tools.utils.REPO_ROOT / "bootstrap-salt.sh").read_text()
+        )
+        try:
+            tools.analyze.build_variants(script, tools.utils.REPO_ROOT)
+        except RuntimeError as exc:
+            ctx.error(str(exc))
+            ctx.exit(1)
+        ctx.info("Hashing the release artifacts ...")
+        manifest = tools.utils.write_manifest(
+            [
+                pathlib.Path(lpath)
+                for lpath in upload_files[branch]
+                if not lpath.endswith(".sha256") and lpath != MANIFEST_NAME
+            ],
+            pathlib.Path(MANIFEST_NAME),
+            jobs,
+        )
+        to_sign = []
         for lpath, rpaths in upload_files[branch].items():
-            ctx.info(f"Processing {lpath} ...")
             if lpath.endswith(".sha256") and not os.path.exists(lpath):
-                ret = ctx.run(
-                    "sha256sum",
-                    lpath.replace(".sha256", ""),
-                    capture=True,
-                    check=False,
-                )
-                if ret.returncode:
-                    ctx.error(f"Failed to get the sha256sum of {lpath}")
-                    ctx.exit(1)
-                pathlib.Path(lpath).write_bytes(ret.stdout)
-            for rpath in rpaths:
-                files_to_upload.append((lpath, rpath))
+                name = lpath.replace(".sha256", "")
+                pathlib.Path(lpath).write_text(f"{manifest[name]['sha256']}  {name}\n")
+            files_to_upload[lpath] = rpaths
             if not lpath.endswith((".gpg", ".pub")):
-                tools.utils.gpg_sign(ctx, key_id, pathlib.Path(lpath))
-                files_to_upload.append((f"{lpath}.asc", f"{rpaths[0]}.asc"))
-
-        for lpath, rpath in sorted(files_to_upload):
-            size = pathlib.Path(lpath).stat().st_size
-            ctx.info(f" Uploading {lpath} -> {rpath}")
-            with tools.utils.create_progress_bar(file_progress=True) as progress:
-                task = progress.add_task(description="Uploading...", total=size)
-                s3.upload_file(
-                    lpath,
-                    tools.utils.RELEASE_BUCKET_NAME,
-                    rpath,
-                    Callback=tools.utils.UpdateProgress(progress, task),
-                )
+                to_sign.append(pathlib.Path(lpath))
+                files_to_upload[f"{lpath}.asc"] = [f"{rpaths[0]}.asc"]
+        tools.utils.gpg_sign_files(ctx, key_id, to_sign, jobs)
+
+        results = upload_artifacts(
+            s3, tools.utils.RELEASE_BUCKET_NAME, files_to_upload, jobs
+        )
+        for rpath, action in sorted(results.items()):
+            ctx.info(f" {action.capitalize()}: {rpath}")
     except KeyboardInterrupt:
         pass
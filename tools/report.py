@@ -0,0 +1,203 @@
+"""
+These commands are used to analyze the run reports written by bootstrap-salt.sh.
+
+Run ``bootstrap-salt.sh`` with ``BS_REPORT_FILE`` set, or ``tools fleet bootstrap --reports``,
+to collect them.
+"""
+# pylint: disable=resource-leakage,broad-except,3rd-party-module-not-gated
+from __future__ import annotations
+
+import json
+import logging
+import math
+import pathlib
+from collections import defaultdict
+
+from ptscripts import command_group
+from ptscripts import Context
+from rich.table import Table
+
+log = logging.getLogger(__name__)
+
+# Define the command group
+report = command_group(
+    name="report",
+    help="Run Report Related Commands",
+    description=__doc__,
+)
+
+# Metrics which are not durations in milliseconds, and how to display them
+COUNTERS = {
+    "lock_retries": "{:.0f}",
+    "lock_wait_seconds": "{:.0f}s",
+    "downloads": "{:.0f}",
+    "downloaded_bytes": "{:.0f}",
+    "cache_hits": "{:.0f}",
+    "download_retries": "{:.0f}",
+}
+
+
+def load_reports(ctx: Context, paths: list[pathlib.Path]) -> list[dict]:
+    """
+    Load the reports from the given files, or from the JSON files found under the given directories.
+    """
+    files: list[pathlib.Path] = []
+    for path in paths:
+        if path.is_dir():
+            files.extend(sorted(path.rglob("*.json")))
+        else:
+            files.append(path)
+
+    reports = []
+    for path in files:
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError) as exc:
+            ctx.warn(f"Skipping {path}: {exc}")
+            continue
+        if not isinstance(data, dict) or "phases" not in data:
+            ctx.debug(f"Skipping {path}: not a bootstrap-salt.sh run report")
+            continue
+        reports.append(data)
+    return reports
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """
+    The percentile of the values, linearly interpolated between the closest ranks.
+    """
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    rank = (len(ordered) - 1) * pct / 100
+    low = math.floor(rank)
+    high = math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def group_key(data: dict, group_by: str | None) -> str:
+    if group_by is None:
+        return "all"
+    if group_by == "distro":
+        detection = data.get("detection", {})
+        return f"{detection.get('distro_name_l', '')}-{detection.get('distro_version', '')}"
+    return str(data.get(group_by, ""))
+
+
+def collect_metrics(reports: list[dict]) -> dict[str, list[float]]:
+    """
+    Gather, per metric, one value per report.
+
+    Phases which ran more than once in the same run, like ``settle``, are summed up.
+    """
+    metrics: dict[str, list[float]] = defaultdict(list)
+    for data in reports:
+        metrics["total"].append(data.get("duration_ms", 0))
+        phases: dict[str, float] = defaultdict(float)
+        for phase in data.get("phases", []):
+            phases[phase["name"]] += phase.get("duration_ms", 0)
+        for name, duration in phases.items():
+            metrics[name].append(duration)
+        for name in COUNTERS:
+            metrics[name].append(data.get(name, 0))
+    return metrics
+
+
+def aggregate_reports(
+    reports: list[dict], percentiles: list[int], group_by: str | None = None
+) -> dict[str, dict]:
+    groups: dict[str, list[dict]] = defaultdict(list)
+    for data in reports:
+        groups[group_key(data, group_by)].append(data)
+
+    aggregated = {}
+    for group, group_reports in sorted(groups.items()):
+        failed_phases: dict[str, int] = defaultdict(int)
+        for data in group_reports:
+            for phase in data.get("phases", []):
+                if phase.get("status", 0) != 0:
+                    failed_phases[phase["name"]] += 1
+        aggregated[group] = {
+            "runs": len(group_reports),
+            "failed": sum(1 for data in group_reports if data.get("exit_code", 0) != 0),
+            "failed_phases": dict(failed_phases),
+            "metrics": {
+                name: {
+                    "count": len(values),
+                    **{f"p{pct}": percentile(values, pct) for pct in percentiles},
+                    "max": max(values),
+                }
+                for name, values in collect_metrics(group_reports).items()
+            },
+        }
+    return aggregated
+
+
+def format_value(name: str, value: float) -> str:
+    if name in COUNTERS:
+        return COUNTERS[name].format(value)
+    return f"{value / 1000:.1f}s"
+
+
+@report.command(
+    name="aggregate",
+    arguments={
+        "paths": {
+            "help": "Report files, or directories searched for '*.json' report files.",
+            "nargs": "+",
+        },
+        "percentile": {
+            "help": "Percentile to compute. Can be passed multiple times. Default: 50, 90 and 99.",
+            "action": "append",
+        },
+        "group_by": {
+            "help": "Aggregate the reports separately per distribution, install type or exit code.",
+            "choices": ("distro", "install_type", "exit_code", "repo_url"),
+        },
+        "output": {
+            "help": "Also write the aggregated results to this JSON file.",
+        },
+    },
+)
+def aggregate(
+    ctx: Context,
+    paths: list[pathlib.Path],
+    percentile: list[int] = None,
+    group_by: str = None,
+    output: pathlib.Path = None,
+):
+    """
+    Roll up bootstrap-salt.sh run reports into per phase percentiles.
+    """
+    reports = load_reports(ctx, paths)
+    if not reports:
+        ctx.error("No run reports found")
+        ctx.exit(1)
+
+    percentiles = sorted({int(pct) for pct in percentile or (50, 90, 99)})
+    aggregated = aggregate_reports(reports, percentiles, group_by=group_by)
+
+    for group, data in aggregated.items():
+        title = f"{data['runs']} runs, {data['failed']} failed"
+        if group_by is not None:
+            title = f"{group}: {title}"
+        table = Table(title=title)
+        table.add_column("Metric")
+        table.add_column("Runs", justify="right")
+        for pct in percentiles:
+            table.add_column(f"p{pct}", justify="right")
+        table.add_column("Max", justify="right")
+        table.add_column("Failures", justify="right")
+        for name, metric in data["metrics"].items():
+            table.add_row(
+                name,
+                str(metric["count"]),
+                *[format_value(name, metric[f"p{pct}"]) for pct in percentiles],
+                format_value(name, metric["max"]),
+                str(data["failed_phases"].get(name, "")),
+            )
+        ctx.print(table)
+
+    if output is not None:
+        output.write_text(json.dumps(aggregated, indent=2) + "\n")
+        ctx.info(f"Wrote {output}")
@@ -1,8 +1,12 @@
 # pylint: disable=resource-leakage,broad-except,3rd-party-module-not-gated
 from __future__ import annotations
 
+import concurrent.futures
+import hashlib
+import json
 import os
 import pathlib
+import subprocess
 
 from ptscripts import Context
 from rich.progress import BarColumn
@@ -49,6 +53,36 @@ def create_progress_bar(file_progress: bool = False, **kwargs):
     )
 
 
+def file_digests(path: pathlib.Path, *algorithms: str) -> dict[str, str]:
+    """
+    The hex digests of a file for each of the given hashlib algorithms, read in a single pass.
+    """
+    hashes = {name: hashlib.new(name) for name in algorithms}
+    with path.open("rb") as rfh:
+        for chunk in iter(lambda: rfh.read(1024 * 1024), b""):
+            for hash_ in hashes.values():
+                hash_.update(chunk)
+    return {name: hash_.hexdigest() for name, hash_ in hashes.items()}
+
+
+def write_manifest(
+    paths: list[pathlib.Path], manifest: pathlib.Path, jobs: int = 8
+) -> dict[str, dict[str, int | str]]:
+    """
+    Write a JSON manifest with the size, sha256 and sha512 of the given files, keyed by name.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        digests = executor.map(
+            lambda path: file_digests(path, "sha256", "sha512"), paths
+        )
+        entries = {
+            path.name: {"size": path.stat().st_size, **digest}
+            for path, digest in zip(paths, digests)
+        }
+    manifest.write_text(json.dumps(entries, indent=2, sort_keys=True) + "\n")
+    return entries
+
+
 def export_gpg_key(ctx: Context, key_id: str, export_path: pathlib.Path):
     keyfile_gpg = export_path.joinpath(GPG_KEY_FILENAME).with_suffix(".gpg")
     if keyfile_gpg.exists():
@@ -63,18 +97,42 @@ def export_gpg_key(ctx: Context, key_id: str, export_path: pathlib.Path):
 
 
 def gpg_sign(ctx: Context, key_id: str, path: pathlib.Path):
-    ctx.info(f"GPG Signing '{path}' ...")
-    signature_fpath = path.parent / f"{path.name}.asc"
-    if signature_fpath.exists():
-        signature_fpath.unlink()
-    ctx.run(
-        "gpg",
-        "--local-user",
-        key_id,
-        "--output",
-        str(signature_fpath),
-        "--armor",
-        "--detach-sign",
-        "--sign",
-        str(path),
-    )
+    gpg_sign_files(ctx, key_id, [path], jobs=1)
+
+
+def gpg_sign_files(ctx: Context, key_id: str, paths: list[pathlib.Path], jobs: int = 8):
+    """
+    Write a detached, armored, ``.asc`` signature next to each of the given files.
+
+    The signatures are made in parallel. They all go through the same gpg-agent, so the
+    passphrase, if any, is only unlocked once. It takes one gpg process per file, gpg
+    refuses ``--multifile`` together with ``--detach-sign``.
+    """
+
+    def sign(path: pathlib.Path) -> subprocess.CompletedProcess:
+        signature_fpath = path.parent / f"{path.name}.asc"
+        if signature_fpath.exists():
+            signature_fpath.unlink()
+        return subprocess.run(
+            [
+                "gpg",
+                "--batch",
+                "--yes",
+                "--local-user",
+                key_id,
+                "--output",
+                str(signature_fpath),
+                "--armor",
+                "--detach-sign",
+                str(path),
+            ],
+            capture_output=True,
+            check=False,
+        )
+
+    ctx.info(f"GPG Signing {len(paths)} files ...")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for path, ret in zip(paths, executor.map(sign, paths)):
+            if ret.returncode:
+                ctx.error(f"Failed to sign {path}:\n{ret.stderr.decode()}")
+                ctx.exit(1)
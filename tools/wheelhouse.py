@@ -0,0 +1,164 @@
+"""
+These commands are used to build pip wheelhouses for Salt Bootstrap.
+
+A wheelhouse is a directory of pre-built wheels for one Python version and platform.
+Pointing ``BS_PIP_WHEELHOUSE`` at it makes the pip based installs of ``bootstrap-salt.sh``
+install those wheels instead of compiling Salt's C extensions on every host.
+"""
+# pylint: disable=resource-leakage,broad-except,3rd-party-module-not-gated
+from __future__ import annotations
+
+import logging
+import pathlib
+import tempfile
+
+from ptscripts import command_group
+from ptscripts import Context
+
+import tools.utils
+
+log = logging.getLogger(__name__)
+
+# Define the command group
+wheelhouse = command_group(
+    name="wheelhouse",
+    help="Pip Wheelhouse Related Commands",
+    description=__doc__,
+)
+
+SALT_REPO_URL = "https://github.com/saltstack/salt.git"
+# What bootstrap-salt.sh itself pip installs, besides Salt's requirements
+BOOTSTRAP_REQUIREMENTS = ("pip", "setuptools", "wheel", "virtualenv")
+
+
+def python_version(ctx: Context, python: str) -> str:
+    """
+    The ``major.minor`` version of the given Python interpreter.
+    """
+    ret = ctx.run(
+        python,
+        "-c",
+        "import sys; print('{}.{}'.format(*sys.version_info))",
+        capture=True,
+    )
+    return ret.stdout.decode().strip()
+
+
+def requirements_files(
+    checkout: pathlib.Path, version: str, platform: str
+) -> list[pathlib.Path]:
+    """
+    The requirements files of a Salt checkout for a Python version and platform.
+
+    The pinned static requirements are preferred. Older Salt releases, which don't ship them
+    for the given Python version, fall back to the unpinned base requirements.
+    """
+    static = (
+        checkout
+        / "requirements"
+        / "static"
+        / "pkg"
+        / f"py{version}"
+        / f"{platform}.txt"
+    )
+    if static.exists():
+        return [static]
+    files = [
+        checkout / "requirements" / name
+        for name in ("base.txt", "zeromq.txt", "crypto.txt")
+    ]
+    return [path for path in files if path.exists()]
+
+
+@wheelhouse.command(
+    name="build",
+    arguments={
+        "salt_version": {
+            "help": (
+                "The Salt git revision whose requirements are built, e.g. 'v3006.1'. Defaults to "
+                "'master' when cloning, and to the checked out revision of an existing checkout."
+            ),
+        },
+        "python": {
+            "help": (
+                "The Python interpreter to build the wheels with. It must match the Python "
+                "of the hosts the wheelhouse is meant for."
+            ),
+        },
+        "platform": {
+            "help": "The platform of the static requirements files.",
+            "choices": ("linux", "darwin", "freebsd", "windows"),
+        },
+        "salt_repo": {
+            "help": "The Salt repository to clone, or the path to an existing Salt checkout.",
+        },
+        "requirement": {
+            "help": "Extra requirement to build a wheel for. Can be passed multiple times.",
+            "action": "append",
+        },
+        "output": {
+            "help": "Where to write the wheels. Defaults to 'wheelhouse-py<version>-<platform>'.",
+        },
+    },
+)
+def build(
+    ctx: Context,
+    salt_version: str = None,
+    python: str = "python3",
+    platform: str = "linux",
+    salt_repo: str = SALT_REPO_URL,
+    requirement: list[str] = None,
+    output: pathlib.Path = None,
+):
+    """
+    Build a wheelhouse for 'BS_PIP_WHEELHOUSE' from Salt's requirements files.
+    """
+    version = python_version(ctx, python)
+    if output is None:
+        output = tools.utils.REPO_ROOT / f"wheelhouse-py{version}-{platform}"
+    output.mkdir(parents=True, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(prefix="salt-wheelhouse-") as tempdir:
+        checkout = pathlib.Path(salt_repo)
+        if not checkout.is_dir():
+            checkout = pathlib.Path(tempdir) / "salt"
+            salt_version = salt_version or "master"
+            ctx.info(f"Cloning {salt_version} from {salt_repo}")
+            ctx.run(
+                "git",
+                "clone",
+                "--depth",
+                "1",
+                "--branch",
+                salt_version,
+                salt_repo,
+                str(checkout),
+            )
+        elif salt_version is not None:
+            # Leave the existing checkout alone, check the revision out in a local clone of it
+            source = checkout
+            checkout = pathlib.Path(tempdir) / "salt"
+            ctx.info(f"Checking out {salt_version} from {source}")
+            ctx.run(
+                "git", "clone", "--quiet", "--no-checkout", str(source), str(checkout)
+            )
+            ctx.run("git", "-C", str(checkout), "checkout", "--quiet", salt_version)
+
+        files = requirements_files(checkout, version, platform)
+        if not files:
+            ctx.error(f"No requirements files found in {checkout}")
+            ctx.exit(1)
+
+        cmdline = [python, "-m", "pip", "wheel", "--wheel-dir", str(output)]
+        for path in files:
+            ctx.info(f"Building the wheels of {path.relative_to(checkout)}")
+            cmdline.extend(["-r", str(path)])
+        cmdline.extend(BOOTSTRAP_REQUIREMENTS)
+        cmdline.extend(requirement or ())
+        ctx.run(*cmdline)
+
+    wheels = sorted(output.glob("*.whl"))
+    ctx.info(f"Wrote {len(wheels)} wheels to {output}")
+    ctx.info(
+        f"Install from it with: BS_PIP_WHEELHOUSE={output} sh bootstrap-salt.sh ..."
+    )